@@ -0,0 +1,62 @@
+"""
+Providers of the services the endpoints depend on.
+
+Endpoints receive their services through FastAPI Depends() instead of
+importing the module-level instances, so a test can swap one out with
+`app.dependency_overrides[get_diagram_service] = lambda: fake`.
+"""
+
+from typing import NamedTuple
+
+from fastapi import Depends
+
+from services.azure_openai import AzureOpenAIService, azure_openai_service
+from services.diagram import DiagramService, diagram_service
+from services.diagram_jobs import DiagramJobQueue, diagram_jobs
+from services.intent_router import IntentRouter, intent_router
+from services.sessions import SessionStore, session_store
+
+
+class Services(NamedTuple):
+    """The services a request is served with."""
+    llm: AzureOpenAIService
+    diagrams: DiagramService
+    jobs: DiagramJobQueue
+    sessions: SessionStore
+    router: IntentRouter
+
+
+def get_azure_openai_service() -> AzureOpenAIService:
+    """Get the Azure OpenAI service; its client is created on first use."""
+    return azure_openai_service
+
+
+def get_diagram_service() -> DiagramService:
+    """Get the diagram rendering service."""
+    return diagram_service
+
+
+def get_diagram_jobs() -> DiagramJobQueue:
+    """Get the background diagram job queue; its workers start with the first job."""
+    return diagram_jobs
+
+
+def get_session_store() -> SessionStore:
+    """Get the chat session store."""
+    return session_store
+
+
+def get_intent_router() -> IntentRouter:
+    """Get the router deciding whether a prompt is offered the diagram tool."""
+    return intent_router
+
+
+def get_services(
+    llm: AzureOpenAIService = Depends(get_azure_openai_service),
+    diagrams: DiagramService = Depends(get_diagram_service),
+    jobs: DiagramJobQueue = Depends(get_diagram_jobs),
+    sessions: SessionStore = Depends(get_session_store),
+    router: IntentRouter = Depends(get_intent_router)
+) -> Services:
+    """Collect the services of a request, each resolved through its own provider."""
+    return Services(llm, diagrams, jobs, sessions, router)
@@ -2,27 +2,75 @@
 API endpoints for the Azure solutions assistant.
 """
 
-from typing import Any, Dict
+import asyncio
+import json
+import math
+from typing import Any, AsyncIterator, Awaitable, Dict, List, Optional, Tuple, TypeVar
 from pathlib import Path
 
-from fastapi import Body, Query
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi import Body, Depends, Query, Request
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from openai import APIConnectionError, APITimeoutError, RateLimitError
 
-from schemas.models import TextResponse, DiagramResponse, DiagramSummary
-from services.azure_openai import azure_openai_service
-from services.diagram import diagram_service
+from api.dependencies import Services, get_services
+from config.settings import settings
+from schemas.diagram_spec import SpecValidationError
+from schemas.models import TextResponse, DiagramResponse, DiagramSummary, DiagramJobResponse
+from services.admission import BATCH, AdmissionRejectedError, admission_priority
+from services.diagram import DIAGRAM_FORMATS, RENDER_ENGINES
+from services.diagram_jobs import JobQueueFullError
+from services.diagram_store import is_safe_name
+from services.intent_router import DIAGRAM
+from services.json_extractor import IncrementalJSONExtractor
+from services.json_patch import apply_json_patch, JsonPatchError, JsonPatchTestFailed
+from services.metrics import metrics, timed
+from services.sessions import ChatSession
+from services.spec_edit import apply_spec_edit, describe_spec_edit
+from services.warmup import warm_up
+from services.cassette import CassetteMissError
+from services.render_pool import RenderQueueFullError, RenderTimeoutError
+from services.resilience import CircuitOpenError, DeadlineExceededError, retry_after_seconds
+
+T = TypeVar("T")
+
+# Tool the model calls to change a session's current diagram
+EDIT_TOOL_NAME = "edit_azure_architecture"
+
+# Diagram files are content-addressed, so a name never changes its content
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# Media type of RFC 6902 patch documents accepted by PATCH /diagrams/{id}
+JSON_PATCH_MEDIA_TYPE = "application/json-patch+json"
+
+# Shared by every /chat/batch request, so concurrent batches respect the limits together
+_batch_llm_slots = asyncio.Semaphore(max(1, settings.CHAT_BATCH_LLM_CONCURRENCY))
+_batch_render_slots = asyncio.Semaphore(max(1, settings.CHAT_BATCH_RENDER_CONCURRENCY))
+
+
+class ClientDisconnectedError(Exception):
+    """Raised when the HTTP client goes away before a response is ready."""
 
 
 async def chat_endpoint(
+    request: Request,
     payload: Dict[str, Any] = Body(...), 
-    download: bool = Query(False, description="If true and a diagram is generated, return the PNG file as attachment")
+    download: bool = Query(False, description="If true and a diagram is generated, return the image file as attachment"),
+    engine: Optional[str] = Query(None, description="Render engine: 'diagrams' or 'dot' (defaults to RENDER_ENGINE)"),
+    output_format: str = Query("png", alias="format", description="Diagram format: 'png', 'preview', 'svg' or 'pdf'"),
+    defer: bool = Query(False, description="If true and a diagram is generated, render it as a background job and return the job id"),
+    services: Services = Depends(get_services)
 ):
     """
     Main chat endpoint for handling user queries.
     
     Args:
+        request: Incoming request, watched for client disconnects
         payload: Request payload containing the user prompt
         download: Whether to return diagram as direct download
+        engine: Render engine override for this request
+        output_format: Format the diagram is rendered in
+        defer: Whether to hand the diagram to the job queue instead of rendering inline
+        services: Services the request is served with
         
     Returns:
         JSON response with text or diagram content, or direct file download
@@ -31,126 +79,1265 @@ async def chat_endpoint(
     prompt = (payload.get("prompt") or "").strip()
     if not prompt:
         return JSONResponse({"error": "Field 'prompt' is required"}, status_code=400)
+    invalid = _validate_render_options(engine, output_format)
+    if invalid is not None:
+        return invalid
+    if defer and download:
+        return JSONResponse(
+            {"error": "Query parameters 'defer' and 'download' cannot be combined"}, 
+            status_code=400
+        )
+    session = None
+    session_id = payload.get("session_id")
+    if session_id is not None:
+        session = services.sessions.get(str(session_id))
+        if session is None:
+            return JSONResponse({"error": "Session not found"}, status_code=404)
     
     try:
-        # Get response from Azure OpenAI
-        completion = azure_openai_service.create_chat_completion(prompt)
-        message = completion.choices[0].message
+        if session is None:
+            return await _answer_prompt(
+                services, prompt, download, engine, output_format, defer, request=request
+            )
+        async with session.lock:
+            return await _answer_prompt(
+                services, prompt, download, engine, output_format, defer, request=request, session=session
+            )
+    except Exception as e:
+        status_code, message, headers = _describe_error(e)
+        return JSONResponse({"error": message}, status_code=status_code, headers=headers)
+
+
+async def chat_batch_endpoint(
+    request: Request,
+    payload: Dict[str, Any] = Body(...),
+    stream: bool = Query(False, description="If true, stream each result as an NDJSON line as soon as it finishes"),
+    engine: Optional[str] = Query(None, description="Render engine: 'diagrams' or 'dot' (defaults to RENDER_ENGINE)"),
+    output_format: str = Query("png", alias="format", description="Diagram format: 'png', 'preview', 'svg' or 'pdf'"),
+    defer: bool = Query(False, description="If true, render diagrams as background jobs and return their ids"),
+    services: Services = Depends(get_services)
+):
+    """
+    Answer several prompts concurrently.
+    
+    Each prompt is handled like a `/chat` request. LLM calls and renders are
+    bounded by CHAT_BATCH_LLM_CONCURRENCY and CHAT_BATCH_RENDER_CONCURRENCY
+    across all batches, and a failing prompt is reported in its own result
+    instead of failing the batch.
+    
+    Args:
+        request: Incoming request, watched for client disconnects
+        payload: Request payload with a `prompts` list
+        stream: Whether to stream results as NDJSON in completion order
+        engine: Render engine override for this batch
+        output_format: Format diagrams are rendered in
+        defer: Whether to hand diagrams to the job queue instead of rendering inline
+        services: Services the request is served with
         
-        # Handle tool calls (diagrams)
-        if getattr(message, "tool_calls", None):
-            return await _handle_diagram_tool_call(message.tool_calls[0], download)
+    Returns:
+        Results in prompt order, or an NDJSON stream of results as they finish
+    """
+    prompts = payload.get("prompts")
+    if not isinstance(prompts, list) or not prompts:
+        return JSONResponse({"error": "Field 'prompts' must be a non-empty list"}, status_code=400)
+    if len(prompts) > settings.CHAT_BATCH_MAX_PROMPTS:
+        return JSONResponse(
+            {"error": f"Too many prompts (limit {settings.CHAT_BATCH_MAX_PROMPTS})"}, 
+            status_code=400
+        )
+    invalid = _validate_render_options(engine, output_format)
+    if invalid is not None:
+        return invalid
+    
+    if stream:
+        return StreamingResponse(
+            _batch_result_stream(services, prompts, engine, output_format, defer),
+            media_type="application/x-ndjson",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+    
+    items = [_batch_item(services, i, prompt, engine, output_format, defer) for i, prompt in enumerate(prompts)]
+    try:
+        results = await _cancel_on_disconnect(request, asyncio.gather(*items))
+    except ClientDisconnectedError as e:
+        status_code, message, headers = _describe_error(e)
+        return JSONResponse({"error": message}, status_code=status_code, headers=headers)
+    
+    succeeded = sum(1 for result in results if result["ok"])
+    return {"results": results, "succeeded": succeeded, "failed": len(results) - succeeded}
+
+
+async def chat_stream_endpoint(
+    payload: Dict[str, Any] = Body(...),
+    engine: Optional[str] = Query(None, description="Render engine: 'diagrams' or 'dot' (defaults to RENDER_ENGINE)"),
+    output_format: str = Query("png", alias="format", description="Diagram format: 'png', 'preview', 'svg' or 'pdf'"),
+    services: Services = Depends(get_services)
+):
+    """
+    Streaming chat endpoint using Server-Sent Events.
+    
+    Emits `delta` events with text as it is generated, `tool_call` when the
+    model starts a diagram tool call, `rendering` while the diagram is drawn,
+    `diagram` with its URLs, and a final `done` (or `error`) event.
+    
+    Args:
+        payload: Request payload containing the user prompt
+        engine: Render engine override for this request
+        output_format: Format the diagram is rendered in
+        services: Services the request is served with
         
-        # Handle text content with potential embedded diagram specs
-        content = message.content or ""
-        diagram_spec = diagram_service.extract_spec_from_text(content)
+    Returns:
+        An SSE stream of chat events
+    """
+    prompt = (payload.get("prompt") or "").strip()
+    if not prompt:
+        return JSONResponse({"error": "Field 'prompt' is required"}, status_code=400)
+    invalid = _validate_render_options(engine, output_format)
+    if invalid is not None:
+        return invalid
+    
+    return StreamingResponse(
+        _chat_event_stream(services, prompt, engine, output_format),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def download_endpoint(
+    request: Request,
+    filename: str,
+    output_format: Optional[str] = Query(None, alias="format", description="Diagram format: 'png', 'preview', 'svg' or 'pdf'"),
+    services: Services = Depends(get_services)
+):
+    """
+    Endpoint for downloading generated diagram files.
+    
+    The format is taken from the `format` query parameter, else negotiated
+    from the Accept header, else implied by the filename. Formats that have
+    not been rendered yet are rendered on demand and kept for later requests.
+    
+    Args:
+        request: Incoming request, whose Accept header is negotiated
+        filename: Name of the file to download
+        output_format: Explicit format override
+        services: Services the request is served with
         
-        if diagram_spec:
-            return await _handle_diagram_from_content(diagram_spec, content, download)
+    Returns:
+        File response with the requested diagram
+    """
+    parsed = services.diagrams.parse_filename(filename)
+    if parsed is None:
+        return JSONResponse({"error": "File not found"}, status_code=404)
+    base_name, file_format = parsed
+    
+    if output_format is not None:
+        if output_format not in DIAGRAM_FORMATS:
+            return JSONResponse(
+                {"error": f"Query parameter 'format' must be one of: {', '.join(DIAGRAM_FORMATS)}"}, 
+                status_code=400
+            )
+    else:
+        output_format = _negotiate_format(request.headers.get("accept"), file_format)
+        if output_format is None:
+            media_types = sorted({fmt.media_type for fmt in DIAGRAM_FORMATS.values()})
+            return JSONResponse(
+                {"error": f"No acceptable format; available: {', '.join(media_types)}"}, 
+                status_code=406
+            )
+    
+    name = services.diagrams.variant_name(base_name, output_format)
+    if await asyncio.to_thread(services.diagrams.store.stat, name) is None:
+        try:
+            result = await services.diagrams.render_variant_async(base_name, output_format)
+        except Exception as e:
+            status_code, message, headers = _describe_error(e)
+            return JSONResponse({"error": message}, status_code=status_code, headers=headers)
+        if result is None:
+            return JSONResponse({"error": "File not found"}, status_code=404)
+        if not result.get("ok"):
+            return _render_failure(result)
+        name = result["filename"]
+    
+    response = await _artifact_response(
+        services, request, name, DIAGRAM_FORMATS[output_format].media_type, attachment=True
+    )
+    response.headers["Vary"] = "Accept"
+    return response
+
+
+async def diagram_file_endpoint(
+    request: Request,
+    filename: str,
+    services: Services = Depends(get_services)
+):
+    """
+    Serve a generated diagram inline, as linked from the `url` of a diagram response.
+    
+    Args:
+        request: Incoming request, for conditional and range headers
+        filename: Name of the diagram file
+        services: Services the request is served with
         
-        # Return plain text response
-        return TextResponse(answer=content or "OK")
+    Returns:
+        The diagram with caching headers
+    """
+    parsed = services.diagrams.parse_filename(filename)
+    if parsed is None:
+        return JSONResponse({"error": "File not found"}, status_code=404)
+    return await _artifact_response(services, request, filename, DIAGRAM_FORMATS[parsed[1]].media_type)
+
+
+async def diagram_spec_endpoint(diagram_id: str, services: Services = Depends(get_services)):
+    """
+    Get the validated spec a diagram was rendered from.
     
-    except Exception as e:
+    Args:
+        diagram_id: Diagram id, or the filename of any of its formats
+        services: Services the request is served with
+        
+    Returns:
+        The canonical spec with its render engine, for building a JSON Patch
+    """
+    loaded = await _load_diagram(services, diagram_id)
+    if loaded is None:
+        return JSONResponse({"error": "Diagram not found"}, status_code=404)
+    base_name, stored = loaded
+    return JSONResponse(
+        {"id": base_name, "engine": stored["engine"], "spec": stored["spec"]}, 
+        headers={"Accept-Patch": JSON_PATCH_MEDIA_TYPE}
+    )
+
+
+async def patch_diagram_endpoint(
+    request: Request,
+    diagram_id: str,
+    engine: Optional[str] = Query(None, description="Render engine: 'diagrams' or 'dot' (defaults to the diagram's engine)"),
+    output_format: str = Query("png", alias="format", description="Diagram format: 'png', 'preview', 'svg' or 'pdf'"),
+    services: Services = Depends(get_services)
+):
+    """
+    Edit a diagram with a JSON Patch (RFC 6902) and render the result.
+    
+    The patch is applied to the diagram's stored spec, which is re-validated
+    and rendered without calling the model. Diagrams are content-addressed,
+    so the edited diagram gets a new id and the original stays available.
+    
+    Args:
+        request: Incoming request carrying the patch document
+        diagram_id: Diagram id, or the filename of any of its formats
+        engine: Render engine override
+        output_format: Format the edited diagram is rendered in
+        services: Services the request is served with
+        
+    Returns:
+        Diagram response for the edited diagram, 409 if a `test` operation
+        failed, or 422 if the patch cannot be applied or yields an invalid spec
+    """
+    invalid = _validate_render_options(engine, output_format)
+    if invalid is not None:
+        return invalid
+    media_type = (request.headers.get("content-type") or "").split(";")[0].strip().lower()
+    if media_type not in (JSON_PATCH_MEDIA_TYPE, "application/json"):
         return JSONResponse(
-            {"error": f"Internal server error: {str(e)}"}, 
-            status_code=500
+            {"error": f"Content-Type must be {JSON_PATCH_MEDIA_TYPE}"}, 
+            status_code=415, 
+            headers={"Accept-Patch": JSON_PATCH_MEDIA_TYPE}
         )
+    loaded = await _load_diagram(services, diagram_id)
+    if loaded is None:
+        return JSONResponse({"error": "Diagram not found"}, status_code=404)
+    _, stored = loaded
+    
+    try:
+        patch = json.loads(await request.body())
+    except ValueError:
+        return JSONResponse({"error": "Patch is not valid JSON"}, status_code=400)
+    try:
+        spec = apply_json_patch(stored["spec"], patch)
+    except JsonPatchTestFailed as e:
+        return JSONResponse({"error": str(e)}, status_code=409)
+    except JsonPatchError as e:
+        return JSONResponse({"error": str(e)}, status_code=422)
+    if not isinstance(spec, dict):
+        return JSONResponse({"error": "Patched spec must be an object"}, status_code=422)
+    try:
+        # Patches are explicit edits: report their mistakes instead of repairing them
+        services.diagrams.prepare_spec(spec, repair=False)
+    except SpecValidationError as e:
+        return JSONResponse({"error": "Patched spec is invalid", "errors": e.errors}, status_code=422)
+    except Exception as e:
+        return JSONResponse({"error": f"Patched spec is invalid: {e}"}, status_code=422)
+    
+    try:
+        result = await services.diagrams.render_diagram_async(
+            spec, stored["prefix"], engine or stored["engine"], output_format
+        )
+    except Exception as e:
+        status_code, message, headers = _describe_error(e)
+        return JSONResponse({"error": message}, status_code=status_code, headers=headers)
+    if not result.get("ok"):
+        return _render_failure(result)
+    
+    filename = result["filename"]
+    response = DiagramResponse(
+        answer="Diagram updated.",
+        url=result["url"],
+        download=f"/download/{filename}",
+        format=result["format"],
+        summary=DiagramSummary(**result["summary"]),
+        id=result["id"],
+        repairs=result["repairs"]
+    )
+    return JSONResponse(response.model_dump(), headers={"Location": f"/diagrams/{result['id']}"})
 
 
-async def download_endpoint(filename: str):
+async def create_diagram_job_endpoint(
+    spec: Dict[str, Any] = Body(..., description="DiagramSpec to render"),
+    engine: Optional[str] = Query(None, description="Render engine: 'diagrams' or 'dot' (defaults to RENDER_ENGINE)"),
+    output_format: str = Query("png", alias="format", description="Diagram format: 'png', 'preview', 'svg' or 'pdf'"),
+    services: Services = Depends(get_services)
+):
     """
-    Endpoint for downloading generated diagram files.
+    Queue a diagram for background rendering.
     
     Args:
-        filename: Name of the file to download
+        spec: The diagram specification
+        engine: Render engine override for this job
+        output_format: Format the diagram is rendered in
+        services: Services the request is served with
         
     Returns:
-        File response with the requested diagram
+        202 response with the job, whose status URL is in the Location header
+    """
+    invalid = _validate_render_options(engine, output_format)
+    if invalid is not None:
+        return invalid
+    if not isinstance(spec.get("nodes"), list) or not isinstance(spec.get("edges"), list):
+        return JSONResponse({"error": "Fields 'nodes' and 'edges' are required"}, status_code=400)
+    
+    try:
+        job = services.jobs.submit(spec, engine, output_format)
+    except JobQueueFullError as e:
+        status_code, message, headers = _describe_error(e)
+        return JSONResponse({"error": message}, status_code=status_code, headers=headers)
+    
+    return JSONResponse(
+        job.to_dict(), 
+        status_code=202, 
+        headers={"Location": f"/diagrams/jobs/{job.id}"}
+    )
+
+
+async def diagram_job_endpoint(job_id: str, services: Services = Depends(get_services)):
+    """
+    Report the status of a diagram job.
+    
+    Args:
+        job_id: Job identifier
+        services: Services the request is served with
+        
+    Returns:
+        Job status and timing, with the result URLs once it has succeeded
+    """
+    job = services.jobs.get(job_id)
+    if job is None:
+        return JSONResponse({"error": "Job not found"}, status_code=404)
+    return job.to_dict()
+
+
+async def cancel_diagram_job_endpoint(job_id: str, services: Services = Depends(get_services)):
+    """
+    Cancel a queued or running diagram job.
+    
+    Args:
+        job_id: Job identifier
+        services: Services the request is served with
+        
+    Returns:
+        The cancelled job, or 409 if it had already finished
+    """
+    job = services.jobs.get(job_id)
+    if job is None:
+        return JSONResponse({"error": "Job not found"}, status_code=404)
+    if job.finished:
+        return JSONResponse({"error": f"Job already {job.status}", "job": job.to_dict()}, status_code=409)
+    return services.jobs.cancel(job_id).to_dict()
+
+
+async def cache_stats_endpoint(services: Services = Depends(get_services)):
+    """
+    Endpoint reporting completion cache and diagram store effectiveness.
+    
+    Args:
+        services: Services the request is served with
+        
+    Returns:
+        Hit/miss counters and occupancy of the completion cache, and
+        occupancy and evictions of the diagram store
+    """
+    cache = services.llm.cache
+    return {
+        "completions": cache.stats() if cache else {"enabled": False},
+        "diagrams": services.diagrams.store.stats(),
+    }
+
+
+async def llm_endpoints_endpoint(services: Services = Depends(get_services)):
+    """
+    Endpoint reporting how Azure OpenAI requests are spread over the configured endpoints.
+    
+    Args:
+        services: Services the request is served with
+        
+    Returns:
+        State (healthy, throttled or ejected), load, expected latency per kind
+        of request, and request, failure and ejection counts of each endpoint
+    """
+    return {"endpoints": services.llm.pool.stats()}
+
+
+async def create_session_endpoint(services: Services = Depends(get_services)):
+    """
+    Start a chat session.
+    
+    Pass the returned `session_id` with each `/chat` request; the server keeps
+    the conversation history and the current diagram.
+    
+    Args:
+        services: Services the request is served with
+        
+    Returns:
+        201 response describing the new session
+    """
+    session = services.sessions.create()
+    return JSONResponse(session.to_dict(), status_code=201)
+
+
+async def session_endpoint(session_id: str, services: Services = Depends(get_services)):
+    """
+    Describe a chat session.
+    
+    Args:
+        session_id: Session identifier
+        services: Services the request is served with
+        
+    Returns:
+        History size and the current diagram spec
+    """
+    session = services.sessions.get(session_id)
+    if session is None:
+        return JSONResponse({"error": "Session not found"}, status_code=404)
+    return session.to_dict()
+
+
+async def delete_session_endpoint(session_id: str, services: Services = Depends(get_services)):
+    """
+    End a chat session.
+    
+    Args:
+        session_id: Session identifier
+        services: Services the request is served with
+        
+    Returns:
+        204 response, or 404 if the session is unknown
+    """
+    if not services.sessions.delete(session_id):
+        return JSONResponse({"error": "Session not found"}, status_code=404)
+    return Response(status_code=204)
+
+
+async def metrics_endpoint():
+    """
+    Endpoint exposing service metrics for Prometheus to scrape.
+    
+    Returns:
+        Stage latencies, request latencies, token usage, render errors and
+        queue depths in the Prometheus text exposition format
     """
-    file_path = Path("static/diagrams") / filename
-    if not file_path.exists():
+    return Response(metrics.expose(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+async def readiness_endpoint():
+    """
+    Endpoint reporting whether start-up warm-up has finished.
+    
+    Returns:
+        Warm-up progress and start-up timings; 503 with a Retry-After header
+        until the application is ready
+    """
+    status = warm_up.status()
+    if not status["ready"]:
+        return JSONResponse(status, status_code=503, headers={"Retry-After": "1"})
+    return status
+
+
+async def _chat_event_stream(
+    services: Services,
+    prompt: str, 
+    engine: Optional[str] = None, 
+    output_format: str = "png"
+) -> AsyncIterator[str]:
+    """
+    Produce the SSE events for a streamed chat turn.
+    
+    Args:
+        services: Services the request is served with
+        prompt: The user prompt
+        engine: Render engine override
+        output_format: Format the diagram is rendered in
+        
+    Yields:
+        Encoded SSE events
+    """
+    content_parts: List[str] = []
+    tool_name: Optional[str] = None
+    tool_args_parts: List[str] = []
+    # Embedded specs are picked up while the text streams in
+    extractor = IncrementalJSONExtractor(stop_at_spec=True)
+    
+    try:
+        with timed("route"):
+            decision = services.router.route(prompt)
+        stream = await services.llm.stream_chat_completion(
+            prompt, with_tools=decision.route == DIAGRAM
+        )
+        try:
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta
+                if delta.content:
+                    content_parts.append(delta.content)
+                    extractor.feed(delta.content)
+                    yield _sse_event("delta", {"text": delta.content})
+                for tool_call in delta.tool_calls or []:
+                    # Like /chat, only the first tool call is rendered
+                    if tool_call.index != 0 or tool_call.function is None:
+                        continue
+                    if tool_name is None and tool_call.function.name:
+                        tool_name = tool_call.function.name
+                        yield _sse_event("tool_call", {"name": tool_name})
+                    if tool_call.function.arguments:
+                        tool_args_parts.append(tool_call.function.arguments)
+        finally:
+            await stream.close()
+        
+        content = "".join(content_parts)
+        if tool_name is not None:
+            try:
+                spec = json.loads("".join(tool_args_parts) or "{}")
+            except json.JSONDecodeError:
+                yield _sse_event("error", {"error": "Invalid tool arguments JSON", "status": 500})
+                return
+            if not isinstance(spec, dict):
+                yield _sse_event("error", {"error": "Tool arguments must be a JSON object", "status": 422})
+                return
+        else:
+            spec = extractor.spec
+        services.router.record_outcome(decision, produced_diagram=tool_name is not None or bool(spec))
+        
+        if not spec:
+            yield _sse_event("done", {"type": "text", "answer": content or "OK"})
+            return
+        
+        yield _sse_event("rendering", {})
+        result = await services.diagrams.render_diagram_async(
+            spec, engine=engine, output_format=output_format
+        )
+        if result.get("errors"):
+            yield _sse_event("error", {"error": result["error"], "errors": result["errors"], "status": 422})
+            return
+        if not result.get("ok"):
+            yield _sse_event("error", {"error": result.get("error", "Failed to render diagram"), "status": 500})
+            return
+        
+        filename = result["filename"]
+        yield _sse_event("diagram", {
+            "id": result["id"],
+            "url": result["url"],
+            "format": result["format"],
+            "download": f"/download/{filename}",
+            "summary": result["summary"],
+            "repairs": result["repairs"],
+        })
+        yield _sse_event("done", {"type": "diagram", "answer": content or "Diagram generated."})
+    
+    except Exception as e:
+        status_code, message, _ = _describe_error(e)
+        yield _sse_event("error", {"error": message, "status": status_code})
+
+
+async def _artifact_response(
+    services: Services,
+    request: Optional[Request], 
+    name: str, 
+    media_type: str, 
+    attachment: bool = False
+) -> Response:
+    """
+    Serve a stored diagram with a strong ETag, conditional and range support.
+    
+    Args:
+        services: Services the request is served with
+        request: Incoming GET request, for If-None-Match, Range and If-Range;
+            None to always serve the full artifact
+        name: Artifact name in the diagram store
+        media_type: Content type of the artifact
+        attachment: Whether to ask the client to save the file
+        
+    Returns:
+        200, 206, 304 or 416 response, or 404 if the artifact is not stored
+    """
+    store = services.diagrams.store
+    artifact = await asyncio.to_thread(store.describe, name)
+    if artifact is None:
         return JSONResponse({"error": "File not found"}, status_code=404)
     
-    return FileResponse(
-        str(file_path), 
-        media_type="image/png", 
-        filename=filename
+    headers = {
+        "ETag": artifact.etag,
+        "Cache-Control": IMMUTABLE_CACHE_CONTROL,
+        "Accept-Ranges": "bytes",
+    }
+    if attachment:
+        # Names are validated by the store, so they are safe to quote verbatim
+        headers["Content-Disposition"] = f'attachment; filename="{name}"'
+    
+    # Conditional and range requests are answered from the index, reading
+    # at most the requested bytes
+    request_headers = request.headers if request is not None else {}
+    if _etag_matches(request_headers.get("if-none-match"), artifact.etag):
+        return Response(status_code=304, headers=headers)
+    
+    byte_range = None
+    if_range = request_headers.get("if-range")
+    if if_range is None or if_range.strip() == artifact.etag:
+        byte_range = _parse_range(request_headers.get("range"), artifact.size)
+    if byte_range is not None:
+        start, end = byte_range
+        if start >= end:
+            headers["Content-Range"] = f"bytes */{artifact.size}"
+            return Response(status_code=416, headers=headers)
+        data = await asyncio.to_thread(store.read_range, name, start, end)
+        if data is None:
+            return JSONResponse({"error": "File not found"}, status_code=404)
+        headers["Content-Range"] = f"bytes {start}-{start + len(data) - 1}/{artifact.size}"
+        return Response(data, status_code=206, media_type=media_type, headers=headers)
+    
+    path = store.local_path(name)
+    if path is not None and "range" not in request_headers:
+        # Streamed from disk; a Range header we chose to ignore is kept away
+        # from FileResponse, which would otherwise answer it itself
+        return FileResponse(path, media_type=media_type, headers=headers)
+    found = await asyncio.to_thread(store.get, name)
+    if found is None:
+        return JSONResponse({"error": "File not found"}, status_code=404)
+    return Response(found[1], media_type=media_type, headers=headers)
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Evaluate an If-None-Match header against an ETag (weak comparison)."""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+def _parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single-range `Range: bytes=` header.
+    
+    Args:
+        header: Range header value, if any
+        size: Length of the representation
+        
+    Returns:
+        Tuple of (start, end) with an exclusive end, where start >= end means
+        the range cannot be satisfied; None to serve the whole representation,
+        which is also how malformed and multi-range requests are answered
+    """
+    if not header:
+        return None
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, sep, last = spec.strip().partition("-")
+    if not sep:
+        return None
+    try:
+        if not first:
+            # Suffix range: the last N bytes
+            length = int(last)
+            if length < 0:
+                return None
+            return max(0, size - length), size
+        start = int(first)
+        end = int(last) + 1 if last else size
+    except ValueError:
+        return None
+    if start < 0 or (last and end <= start):
+        return None
+    return start, min(end, size)
+
+
+async def _load_diagram(services: Services, diagram_id: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+    """
+    Look up the stored spec of a diagram.
+    
+    Args:
+        services: Services the request is served with
+        diagram_id: Diagram id, or the filename of any of its formats
+        
+    Returns:
+        Tuple of (base_name, stored spec record), or None if the diagram is unknown
+    """
+    parsed = services.diagrams.parse_filename(diagram_id)
+    base_name = parsed[0] if parsed else diagram_id
+    if not is_safe_name(base_name):
+        return None
+    stored = await asyncio.to_thread(services.diagrams.load_spec, base_name)
+    if stored is None:
+        return None
+    return base_name, stored
+
+
+def _validate_render_options(engine: Optional[str], output_format: str) -> Optional[JSONResponse]:
+    """
+    Check the render engine and format query parameters of a chat request.
+    
+    Returns:
+        A 400 response describing the invalid parameter, or None if both are valid
+    """
+    if engine is not None and engine.lower() not in RENDER_ENGINES:
+        return JSONResponse(
+            {"error": f"Query parameter 'engine' must be one of: {', '.join(RENDER_ENGINES)}"}, 
+            status_code=400
+        )
+    if output_format not in DIAGRAM_FORMATS:
+        return JSONResponse(
+            {"error": f"Query parameter 'format' must be one of: {', '.join(DIAGRAM_FORMATS)}"}, 
+            status_code=400
+        )
+    return None
+
+
+def _negotiate_format(accept: Optional[str], preferred: str) -> Optional[str]:
+    """
+    Pick the diagram format that best matches an Accept header.
+    
+    Media ranges are matched most-specific first and weighted by their q
+    value; on a tie the format named by the requested file wins, so browsers
+    sending `*/*` get exactly the file they asked for.
+    
+    Args:
+        accept: Accept header value, if any
+        preferred: Format implied by the requested filename
+        
+    Returns:
+        Format name, or None if nothing acceptable is available
+    """
+    if not accept:
+        return preferred
+    
+    ranges: List[Tuple[str, float]] = []
+    for part in accept.split(","):
+        media_range, _, params = part.partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        ranges.append((media_range.strip().lower(), quality))
+    
+    def quality_of(media_type: str) -> float:
+        main_type = media_type.split("/", 1)[0]
+        best: Tuple[int, float] = (-1, 0.0)
+        for media_range, quality in ranges:
+            if media_range == media_type:
+                specificity = 2
+            elif media_range == f"{main_type}/*":
+                specificity = 1
+            elif media_range == "*/*":
+                specificity = 0
+            else:
+                continue
+            best = max(best, (specificity, quality))
+        return best[1]
+    
+    candidates = [preferred] + [name for name in DIAGRAM_FORMATS if name != preferred]
+    quality, _, output_format = max(
+        (quality_of(DIAGRAM_FORMATS[name].media_type), -i, name) 
+        for i, name in enumerate(candidates)
+    )
+    return output_format if quality > 0 else None
+
+
+async def _answer_prompt(
+    services: Services,
+    prompt: str,
+    download: bool = False,
+    engine: Optional[str] = None,
+    output_format: str = "png",
+    defer: bool = False,
+    request: Optional[Request] = None,
+    llm_slots: Optional[asyncio.Semaphore] = None,
+    render_slots: Optional[asyncio.Semaphore] = None,
+    session: Optional[ChatSession] = None
+) -> Any:
+    """
+    Run one chat turn: get a completion, then answer with text or a diagram.
+    
+    In a session the completion sees the history and the current diagram,
+    the model may answer with an edit of that diagram, and a successful turn
+    is added to the history.
+    
+    Args:
+        services: Services the request is served with
+        prompt: The user prompt
+        download: Whether to return a diagram as direct download
+        engine: Render engine override
+        output_format: Format the diagram is rendered in
+        defer: Whether to hand the diagram to the job queue instead of rendering inline
+        request: Request to watch for disconnects while the completion runs
+        llm_slots: Semaphore bounding concurrent completions, if any
+        render_slots: Semaphore bounding concurrent renders, if any
+        session: Chat session the turn belongs to, if any
+        
+    Returns:
+        Text or diagram response, file download, or JSON error response
+    """
+    # Get response from Azure OpenAI; outside sessions, plain questions skip the diagram tool
+    decision = None
+    if session is not None:
+        completion_call = services.llm.create_session_completion(
+            session.messages, session.spec_json(), prompt
+        )
+    else:
+        with timed("route"):
+            decision = services.router.route(prompt)
+        completion_call = services.llm.create_chat_completion(
+            prompt, with_tools=decision.route == DIAGRAM
+        )
+    completion_call = _limited(llm_slots, completion_call)
+    with timed("completion"):
+        if request is not None:
+            completion = await _cancel_on_disconnect(request, completion_call)
+        else:
+            completion = await completion_call
+    message = completion.choices[0].message
+    
+    # Handle tool calls (diagrams)
+    if getattr(message, "tool_calls", None):
+        if decision is not None:
+            services.router.record_outcome(decision, produced_diagram=True)
+        tool_call = message.tool_calls[0]
+        spec = services.llm.extract_tool_call_args(tool_call)
+        if not spec:
+            return JSONResponse({"error": "Invalid tool arguments JSON"}, status_code=500)
+        if not isinstance(spec, dict):
+            # Reject before anything is queued or added to the session
+            return JSONResponse({"error": "Tool arguments must be a JSON object"}, status_code=422)
+        note = None
+        if session is not None and tool_call.function.name == EDIT_TOOL_NAME:
+            if session.spec is None:
+                return JSONResponse({"error": "There is no diagram to edit in this session"}, status_code=422)
+            try:
+                edited = apply_spec_edit(session.spec, spec)
+            except ValueError as e:
+                return JSONResponse({"error": f"Invalid diagram edit: {e}"}, status_code=422)
+            note = f"[Edited the diagram: {describe_spec_edit(spec)}]"
+            spec = edited
+        if defer:
+            response = _defer_diagram(services, spec, engine, output_format)
+        else:
+            response = await _limited(
+                render_slots, 
+                _handle_diagram_tool_call(services, tool_call, download, engine, output_format, spec=spec)
+            )
+        return _record_session_turn(services, session, prompt, response, spec=spec, note=note)
+    
+    # Handle text content with potential embedded diagram specs
+    content = message.content or ""
+    with timed("extract"):
+        diagram_spec = services.diagrams.extract_spec_from_text(content)
+    if decision is not None:
+        services.router.record_outcome(decision, produced_diagram=bool(diagram_spec))
+    
+    if diagram_spec:
+        if defer:
+            response = _defer_diagram(services, diagram_spec, engine, output_format, raw=content)
+        else:
+            response = await _limited(
+                render_slots, 
+                _handle_diagram_from_content(services, diagram_spec, content, download, engine, output_format)
+            )
+        return _record_session_turn(services, session, prompt, response, spec=diagram_spec)
+    
+    # Return plain text response
+    return _record_session_turn(services, session, prompt, TextResponse(answer=content or "OK"), note=content)
+
+
+def _record_session_turn(
+    services: Services,
+    session: Optional[ChatSession], 
+    prompt: str, 
+    response: Any, 
+    spec: Optional[Dict[str, Any]] = None, 
+    note: Optional[str] = None
+) -> Any:
+    """
+    Add a chat turn to its session, unless it failed.
+    
+    Diagrams are kept as the session's current spec, and the history only
+    gets a one-line note instead of the spec itself.
+    
+    Args:
+        services: Services the request is served with
+        session: The session, or None for stateless requests
+        prompt: The user prompt
+        response: The response of the turn
+        spec: Diagram specification the response shows, if any
+        note: History entry for the assistant's answer, if not the default
+        
+    Returns:
+        The response, tagged with the session id
+    """
+    if session is None or isinstance(response, JSONResponse):
+        return response
+    if spec is not None:
+        try:
+            session.spec = services.diagrams.prepare_spec(spec)[0]
+        except SpecValidationError:
+            # A queued render will report the problems; keep the spec to edit it
+            session.spec = services.diagrams.canonicalize_spec(spec)
+        except ValueError:
+            # A malformed compact spec cannot be edited; keep the previous one
+            spec = None
+    if spec is not None and note is None:
+        note = (
+            f"[Rendered the diagram \"{session.spec['title']}\" with "
+            f"{len(session.spec['nodes'])} nodes and {len(session.spec['edges'])} edges]"
+        )
+    session.add_turn(prompt, note or "OK")
+    if hasattr(response, "session_id"):
+        response.session_id = session.id
+    else:
+        response.headers["X-Session-Id"] = session.id
+    return response
+
+
+async def _limited(slots: Optional[asyncio.Semaphore], awaitable: Awaitable[T]) -> T:
+    """Await a coroutine while holding a semaphore slot, if a semaphore is given."""
+    if slots is None:
+        return await awaitable
+    async with slots:
+        return await awaitable
+
+
+async def _batch_item(
+    services: Services,
+    index: int, 
+    prompt: Any, 
+    engine: Optional[str], 
+    output_format: str, 
+    defer: bool
+) -> Dict[str, Any]:
+    """
+    Answer one prompt of a batch, capturing any failure in the result.
+    
+    Args:
+        services: Services the request is served with
+        index: Position of the prompt in the batch
+        prompt: The prompt as sent by the client
+        engine: Render engine override
+        output_format: Format the diagram is rendered in
+        defer: Whether to hand the diagram to the job queue
+        
+    Returns:
+        Result with `index`, `ok`, `status` and either `response` or `error`
+    """
+    prompt = prompt.strip() if isinstance(prompt, str) else ""
+    if not prompt:
+        return {"index": index, "ok": False, "status": 400, "error": "Prompt must be a non-empty string"}
+    
+    try:
+        # Interactive requests are admitted to Azure OpenAI ahead of batch work
+        with admission_priority(BATCH):
+            response = await _answer_prompt(
+                services, prompt, engine=engine, output_format=output_format, defer=defer,
+                llm_slots=_batch_llm_slots, render_slots=_batch_render_slots,
+            )
+    except Exception as e:
+        status_code, message, _ = _describe_error(e)
+        return {"index": index, "ok": False, "status": status_code, "error": message}
+    
+    if isinstance(response, JSONResponse):
+        body = json.loads(response.body)
+        return {"index": index, "ok": False, "status": response.status_code, "error": body.get("error")}
+    return {"index": index, "ok": True, "status": 200, "response": response.model_dump()}
+
+
+async def _batch_result_stream(
+    services: Services,
+    prompts: List[Any], 
+    engine: Optional[str], 
+    output_format: str, 
+    defer: bool
+) -> AsyncIterator[str]:
+    """
+    Produce NDJSON lines for a batch as its items finish.
+    
+    Each line is one item result carrying its `index`; a final
+    `{"done": true, ...}` line reports the totals. Pending items are
+    cancelled if the client goes away.
+    
+    Args:
+        services: Services the request is served with
+        prompts: Prompts of the batch
+        engine: Render engine override
+        output_format: Format diagrams are rendered in
+        defer: Whether to hand diagrams to the job queue
+        
+    Yields:
+        NDJSON lines
+    """
+    tasks = [
+        asyncio.ensure_future(_batch_item(services, i, prompt, engine, output_format, defer)) 
+        for i, prompt in enumerate(prompts)
+    ]
+    succeeded = 0
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            result = await next_done
+            if result["ok"]:
+                succeeded += 1
+            yield json.dumps(result, ensure_ascii=False) + "\n"
+        yield json.dumps({"done": True, "succeeded": succeeded, "failed": len(tasks) - succeeded}) + "\n"
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def _sse_event(event: str, data: Dict[str, Any]) -> str:
+    """Encode a Server-Sent Event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _render_failure(result: Dict[str, Any]) -> JSONResponse:
+    """
+    Map a failed render result to an HTTP error.
+    
+    Args:
+        result: Render result that is not ok
+        
+    Returns:
+        422 with every problem for an invalid spec, 500 otherwise
+    """
+    if result.get("errors"):
+        return JSONResponse({"error": result["error"], "errors": result["errors"]}, status_code=422)
+    return JSONResponse({"error": result.get("error", "Failed to render diagram")}, status_code=500)
+
+
+def _describe_error(error: Exception) -> Tuple[int, str, Dict[str, str]]:
+    """
+    Map an exception raised while serving a chat turn to an HTTP error.
+    
+    Args:
+        error: The exception
+        
+    Returns:
+        Tuple of (status_code, message, headers)
+    """
+    if isinstance(error, ClientDisconnectedError):
+        # Nobody is listening any more; 499 mirrors the nginx convention
+        return 499, "Client closed request", {}
+    if isinstance(error, APITimeoutError):
+        return 504, "Azure OpenAI request timed out", {}
+    if isinstance(error, DeadlineExceededError):
+        return 504, str(error), {}
+    if isinstance(error, APIConnectionError):
+        return 502, "Could not reach Azure OpenAI", {}
+    if isinstance(error, CircuitOpenError):
+        return 503, str(error), {"Retry-After": str(error.retry_after)}
+    if isinstance(error, RateLimitError):
+        retry_after = math.ceil(retry_after_seconds(error) or 1)
+        return 429, "Azure OpenAI rate limit reached", {"Retry-After": str(max(1, retry_after))}
+    if isinstance(error, AdmissionRejectedError):
+        return 429, str(error), {"Retry-After": str(error.retry_after)}
+    if isinstance(error, (RenderQueueFullError, JobQueueFullError)):
+        return 503, str(error), {"Retry-After": str(error.retry_after)}
+    if isinstance(error, RenderTimeoutError):
+        return 504, str(error), {}
+    if isinstance(error, CassetteMissError):
+        # Replay mode stands in for Azure OpenAI, which could not answer
+        return 502, str(error), {}
+    return 500, f"Internal server error: {str(error)}", {}
+
+
+async def _cancel_on_disconnect(request: Request, awaitable: Awaitable[T]) -> T:
+    """
+    Await a coroutine, cancelling it if the client disconnects first.
+    
+    Args:
+        request: The request whose connection is watched
+        awaitable: The work to run on behalf of the request
+        
+    Returns:
+        The result of the awaitable
+        
+    Raises:
+        ClientDisconnectedError: If the client went away before completion
+    """
+    task = asyncio.ensure_future(awaitable)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=settings.CLIENT_DISCONNECT_POLL_SECONDS)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                task.cancel()
+                raise ClientDisconnectedError()
+    finally:
+        if not task.done():
+            task.cancel()
+
+
+def _defer_diagram(
+    services: Services,
+    spec: Dict[str, Any], 
+    engine: Optional[str], 
+    output_format: str, 
+    raw: Optional[str] = None
+) -> DiagramJobResponse:
+    """
+    Hand a diagram spec to the background job queue.
+    
+    Args:
+        services: Services the request is served with
+        spec: Diagram specification from the model
+        engine: Render engine override
+        output_format: Format the diagram is rendered in
+        raw: Original content containing the spec, if it was embedded in text
+        
+    Returns:
+        Diagram job response pointing at the job status URL
+        
+    Raises:
+        JobQueueFullError: If the job queue is full
+    """
+    job = services.jobs.submit(spec, engine, output_format)
+    return DiagramJobResponse(
+        job=job.id,
+        status=job.status,
+        status_url=f"/diagrams/jobs/{job.id}",
+        raw=raw
     )
 
 
-async def _handle_diagram_tool_call(tool_call: Any, download: bool) -> Any:
+async def _handle_diagram_tool_call(
+    services: Services,
+    tool_call: Any, 
+    download: bool, 
+    engine: Optional[str] = None, 
+    output_format: str = "png",
+    spec: Optional[Dict[str, Any]] = None
+) -> Any:
     """
     Handle diagram generation from tool call.
     
     Args:
+        services: Services the request is served with
         tool_call: The tool call object from OpenAI
         download: Whether to return file as download
+        engine: Render engine override
+        output_format: Format the diagram is rendered in
+        spec: Spec to render instead of the tool arguments, e.g. after
+            applying a session edit
         
     Returns:
         Diagram response or file download
     """
     # Extract tool arguments
-    spec = azure_openai_service.extract_tool_call_args(tool_call)
+    if spec is None:
+        spec = services.llm.extract_tool_call_args(tool_call)
     if not spec:
         return JSONResponse(
             {"error": "Invalid tool arguments JSON"}, 
             status_code=500
         )
+    if not isinstance(spec, dict):
+        return JSONResponse({"error": "Tool arguments must be a JSON object"}, status_code=422)
     
     # Render diagram
-    result = diagram_service.render_diagram(spec)
+    result = await services.diagrams.render_diagram_async(
+        spec, engine=engine, output_format=output_format
+    )
     if not result.get("ok"):
-        return JSONResponse(
-            {"error": result.get("error", "Failed to render diagram")}, 
-            status_code=500
-        )
+        return _render_failure(result)
     
     # Return file download if requested
-    png_path = result["path"]
-    filename = Path(png_path).name
+    filename = result["filename"]
     if download:
-        return FileResponse(png_path, media_type="image/png", filename=filename)
+        return await _artifact_response(services, None, filename, result["media_type"], attachment=True)
     
     # Return diagram response
     return DiagramResponse(
         url=result["url"],
         download=f"/download/{filename}",
-        summary=DiagramSummary(**result["summary"])
+        format=result["format"],
+        summary=DiagramSummary(**result["summary"]),
+        id=result["id"],
+        repairs=result["repairs"]
     )
 
 
-async def _handle_diagram_from_content(spec: Dict[str, Any], content: str, download: bool) -> Any:
+async def _handle_diagram_from_content(
+    services: Services,
+    spec: Dict[str, Any], 
+    content: str, 
+    download: bool, 
+    engine: Optional[str] = None, 
+    output_format: str = "png"
+) -> Any:
     """
     Handle diagram generation from content parsing.
     
     Args:
+        services: Services the request is served with
         spec: Extracted diagram specification
         content: Original content containing the spec
         download: Whether to return file as download
+        engine: Render engine override
+        output_format: Format the diagram is rendered in
         
     Returns:
         Diagram response or file download
     """
     # Render diagram
-    result = diagram_service.render_diagram(spec)
+    result = await services.diagrams.render_diagram_async(
+        spec, engine=engine, output_format=output_format
+    )
     if not result.get("ok"):
-        return JSONResponse(
-            {"error": result.get("error", "Failed to render diagram")}, 
-            status_code=500
-        )
+        return _render_failure(result)
     
     # Return file download if requested
-    png_path = result["path"]
-    filename = Path(png_path).name
+    filename = result["filename"]
     if download:
-        return FileResponse(png_path, media_type="image/png", filename=filename)
+        return await _artifact_response(services, None, filename, result["media_type"], attachment=True)
     
     # Return diagram response with raw content
     return DiagramResponse(
         url=result["url"],
         download=f"/download/{filename}",
+        format=result["format"],
         summary=DiagramSummary(**result["summary"]),
+        id=result["id"],
+        repairs=result["repairs"],
         raw=content,
         saved=str(Path("api_diagrams") / filename)
     )
\ No newline at end of file
@@ -0,0 +1,78 @@
+"""
+ASGI middleware for request metrics and Server-Timing headers.
+"""
+
+import time
+from typing import Any, Dict
+
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from services.metrics import (
+    HTTP_REQUEST_SECONDS,
+    end_request_timing,
+    metrics,
+    server_timing_header,
+    start_request_timing,
+)
+from services.warmup import warm_up
+
+
+class MetricsMiddleware:
+    """
+    Times every HTTP request and the stages recorded while handling it.
+    
+    Written as plain ASGI middleware rather than BaseHTTPMiddleware so
+    streaming responses pass through untouched and stage timings recorded by
+    the endpoint share the request's context.
+    """
+    
+    def __init__(self, app: ASGIApp, server_timing: bool = True):
+        """
+        Initialize the middleware.
+        
+        Args:
+            app: The wrapped ASGI application
+            server_timing: Whether to add a Server-Timing header to responses
+        """
+        self.app = app
+        self.server_timing = server_timing
+        self.in_flight = 0
+        metrics.gauge(
+            "diagram_service_http_requests_in_flight",
+            "HTTP requests currently being handled",
+            (),
+            lambda: {(): self.in_flight},
+        )
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        started = time.perf_counter()
+        stages, token = start_request_timing()
+        status: Dict[str, Any] = {"code": 500}
+        
+        async def send_with_timing(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                if self.server_timing:
+                    # Headers go out before a streamed body, so streaming
+                    # responses only report the stages finished by now
+                    headers = MutableHeaders(scope=message)
+                    headers.append(
+                        "Server-Timing", server_timing_header(stages, time.perf_counter() - started)
+                    )
+            await send(message)
+        
+        self.in_flight += 1
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            self.in_flight -= 1
+            end_request_timing(token)
+            elapsed = time.perf_counter() - started
+            route = getattr(scope.get("route"), "path", "unmatched")
+            HTTP_REQUEST_SECONDS.observe(elapsed, method=scope["method"], route=route, status=status["code"])
+            warm_up.record_request(route, elapsed)
@@ -0,0 +1,184 @@
+"""
+Throttling, throughput and interactive latency with admission control.
+
+Runs interactive and batch traffic through the resilience policy of the
+Azure OpenAI service against a simulated deployment with a tokens-per-minute
+quota, with time scaled down so the run takes seconds. The simulated
+deployment answers 429 with a Retry-After once the quota is used up, like
+Azure OpenAI, and slows down as more requests run at once. A burst of batch
+prompts arrives while interactive prompts keep coming; the run compares no
+admission control with token-aware, priority-ordered admission. No Azure
+OpenAI calls are made.
+
+Run from the fastapi-backend directory:
+    python -m benchmarks.bench_admission
+"""
+
+import argparse
+import asyncio
+import random
+import time
+from typing import Any, Dict, List
+
+import httpx
+from openai import RateLimitError
+
+from services.admission import (
+    BATCH,
+    INTERACTIVE,
+    AdaptiveLimit,
+    AdmissionController,
+    admission_priority,
+)
+from services.resilience import CircuitBreaker, Resilience, RetryBudget
+
+_REQUEST = httpx.Request("POST", "https://example.openai.azure.com/")
+
+# A diagram request: system prompt and tool schema of about 2,500 tokens
+_PROMPT = {"messages": [{"role": "user", "content": "x" * 10_000}]}
+
+
+class Deployment:
+    """Simulated Azure OpenAI deployment with a TPM quota enforced over 10-second windows."""
+    
+    def __init__(self, tpm: int, scale: float, rng: random.Random):
+        self.capacity = tpm / 6
+        self.rate = tpm / 60
+        self.tokens = self.capacity
+        self.scale = scale
+        self.rng = rng
+        self.in_flight = 0
+        self.throttled = 0
+        self.served_tokens = 0
+        self._updated = time.monotonic()
+    
+    async def complete(self, remaining: float, ticket: Any = None) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) / self.scale * self.rate)
+        self._updated = now
+        prompt_tokens = 2_500
+        completion_tokens = int(self.rng.uniform(300, 900))
+        if self.tokens < prompt_tokens + completion_tokens:
+            self.throttled += 1
+            wait = (prompt_tokens + completion_tokens - self.tokens) / self.rate
+            response = httpx.Response(
+                429, headers={"retry-after-ms": str(int(wait * self.scale * 1000))}, request=_REQUEST
+            )
+            raise RateLimitError("Rate limit is exceeded", response=response, body=None)
+        self.tokens -= prompt_tokens + completion_tokens
+        self.in_flight += 1
+        try:
+            # ~4 s for a diagram, slower as the deployment gets busy
+            seconds = self.rng.lognormvariate(0, 0.2) * 4 * (1 + self.in_flight / 40)
+            await asyncio.sleep(min(remaining, seconds * self.scale))
+        finally:
+            self.in_flight -= 1
+        self.served_tokens += prompt_tokens + completion_tokens
+        if ticket is not None:
+            ticket.usage_tokens = (prompt_tokens, completion_tokens)
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile of a list of values."""
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def run(
+    admission: bool,
+    tpm: int,
+    batch: int,
+    interactive: int,
+    interval: float,
+    scale: float,
+    seed: int
+) -> Dict[str, Any]:
+    """Send a batch burst and a stream of interactive prompts; collect outcomes per priority."""
+    rng = random.Random(seed)
+    deployment = Deployment(tpm, scale, rng)
+    policy = Resilience(
+        deadline=60 * scale,
+        max_retries=2,
+        backoff=0.5 * scale,
+        backoff_max=8 * scale,
+        budget=RetryBudget(0.2, 1 / scale),
+        breaker=CircuitBreaker(10 ** 9, 30 * scale),
+        hedge_enabled=False,
+    )
+    controller = AdmissionController(
+        AdaptiveLimit(16, 1, 128),
+        tpm_limit=tpm / scale,
+        queue_depth=200,
+        max_wait=60 * scale,
+        expected_completion_tokens=800,
+        enabled=admission,
+    )
+    
+    async def attempt(remaining: float) -> None:
+        async with controller.admit(_PROMPT, "diagram") as ticket:
+            await deployment.complete(remaining, ticket)
+    
+    results: Dict[str, List[Any]] = {INTERACTIVE: [], BATCH: []}
+    
+    async def one(priority: str) -> None:
+        with admission_priority(priority):
+            started = time.perf_counter()
+            try:
+                await policy.call(attempt, kind="diagram")
+                results[priority].append((time.perf_counter() - started) / scale)
+            except Exception:
+                results[priority].append(None)
+    
+    async def interactive_arrivals() -> None:
+        tasks = []
+        for _ in range(interactive):
+            tasks.append(asyncio.ensure_future(one(INTERACTIVE)))
+            await asyncio.sleep(rng.expovariate(1 / interval) * scale)
+        await asyncio.gather(*tasks)
+    
+    started = time.perf_counter()
+    await asyncio.gather(interactive_arrivals(), *(one(BATCH) for _ in range(batch)))
+    elapsed = (time.perf_counter() - started) / scale
+    
+    stats: Dict[str, Any] = {"throttled": deployment.throttled, "tpm": deployment.served_tokens / elapsed * 60}
+    for priority, outcomes in results.items():
+        latencies = [seconds for seconds in outcomes if seconds is not None]
+        stats[priority] = {
+            "ok": len(latencies) / len(outcomes),
+            "p50": percentile(latencies, 0.5),
+            "p95": percentile(latencies, 0.95),
+        }
+    return stats
+
+
+def main() -> None:
+    """Run without and with admission control and print a table."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--tpm", type=int, default=240_000, help="Simulated deployment's tokens-per-minute quota")
+    parser.add_argument("--batch", type=int, default=80, help="Batch prompts arriving at once")
+    parser.add_argument("--interactive", type=int, default=40, help="Interactive prompts")
+    parser.add_argument("--interval", type=float, default=5.0, help="Mean seconds between interactive prompts")
+    parser.add_argument("--scale", type=float, default=0.01, help="Real seconds per simulated second")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    
+    print(
+        f"{'admission':<10} {'429s':>5} {'served TPM':>11} "
+        f"{'interactive ok':>15} {'p50 s':>7} {'p95 s':>7} {'batch ok':>9} {'p50 s':>7} {'p95 s':>7}"
+    )
+    for admission in (False, True):
+        stats = asyncio.run(run(
+            admission, args.tpm, args.batch, args.interactive, args.interval, args.scale, args.seed
+        ))
+        chat, batch = stats[INTERACTIVE], stats[BATCH]
+        print(
+            f"{'on' if admission else 'off':<10} {stats['throttled']:>5} {stats['tpm']:>11,.0f} "
+            f"{chat['ok']:>15.0%} {chat['p50']:>7.1f} {chat['p95']:>7.1f} "
+            f"{batch['ok']:>9.0%} {batch['p50']:>7.1f} {batch['p95']:>7.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
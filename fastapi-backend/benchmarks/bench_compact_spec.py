@@ -0,0 +1,116 @@
+"""
+Output tokens of the full DiagramSpec versus the compact tool spec dialect.
+
+Each sample spec is serialized as tool-call arguments in both forms and
+counted with the o200k_base tokenizer when tiktoken is installed, otherwise
+with an approximation of it (see approximate_tokens()). Every compact spec is
+also expanded back and checked to canonicalize to the same spec.
+
+Run from the fastapi-backend directory:
+    python -m benchmarks.bench_compact_spec
+"""
+
+import argparse
+import json
+import re
+import sys
+from typing import Any, Callable, Dict, List, Tuple
+
+from benchmarks.samples import make_spec
+from services.compact_spec import compact_spec
+from services.diagram import diagram_service
+
+# A spec as the model writes it for a typical prompt
+RAG_SPEC: Dict[str, Any] = {
+    "title": "RAG Chat on Azure",
+    "direction": "LR",
+    "clusters": [
+        {"id": "app", "label": "App Layer"},
+        {"id": "ai", "label": "LLM + Retrieval"},
+        {"id": "data", "label": "Data Layer"},
+    ],
+    "nodes": [
+        {"id": "user", "label": "User", "icon": "diagrams.onprem.client.User"},
+        {"id": "fd", "label": "Front Door", "icon": "diagrams.azure.network.FrontDoors"},
+        {"id": "web", "label": "Chat UI", "icon": "diagrams.azure.web.AppServices", "cluster": "app"},
+        {"id": "api", "label": "Orchestrator", "icon": "diagrams.azure.compute.FunctionApps", "cluster": "app"},
+        {"id": "aoai", "label": "Azure OpenAI", "icon": "diagrams.azure.ml.AzureOpenAI", "cluster": "ai"},
+        {"id": "search", "label": "AI Search", "icon": "diagrams.azure.web.Search", "cluster": "ai"},
+        {"id": "blob", "label": "Documents", "icon": "diagrams.azure.storage.BlobStorage", "cluster": "data"},
+        {"id": "cosmos", "label": "Chat History", "icon": "diagrams.azure.database.CosmosDb", "cluster": "data"},
+        {"id": "kv", "label": "Secrets", "icon": "diagrams.azure.security.KeyVaults"},
+    ],
+    "edges": [
+        {"source": "user", "target": "fd", "label": "HTTPS"},
+        {"source": "fd", "target": "web"},
+        {"source": "web", "target": "api"},
+        {"source": "api", "target": "search", "label": "retrieve"},
+        {"source": "api", "target": "aoai", "label": "prompt"},
+        {"source": "search", "target": "blob", "label": "index"},
+        {"source": "api", "target": "cosmos"},
+        {"source": "api", "target": "kv"},
+    ],
+}
+
+# Splits text roughly like the GPT-4o (o200k_base) pre-tokenizer; common
+# words and JSON punctuation runs are single tokens there, long words a few
+_PIECE = re.compile(r"[A-Za-z]+|[0-9]{1,3}|\s+|[^A-Za-z0-9\s]+")
+
+
+def approximate_tokens(text: str) -> int:
+    """Approximate the o200k_base token count of text, counting long words as several tokens."""
+    count = 0
+    for piece in _PIECE.findall(text):
+        if piece.isalpha():
+            count += max(1, (len(piece) + 5) // 6)
+        elif not piece.isspace():
+            count += max(1, (len(piece) + 2) // 3)
+    return count
+
+
+def get_counter() -> Tuple[str, Callable[[str], int]]:
+    """Get the tokenizer name and a token counting function."""
+    try:
+        import tiktoken
+    except ImportError:
+        return "approximate", approximate_tokens
+    encoding = tiktoken.get_encoding("o200k_base")
+    return "o200k_base", lambda text: len(encoding.encode(text))
+
+
+def samples(sizes: List[int]) -> List[Tuple[str, Dict[str, Any]]]:
+    """Get the named sample specs."""
+    found = [("rag chat", RAG_SPEC)]
+    for nodes in sizes:
+        found.append((f"{nodes} nodes", make_spec(nodes, min(nodes * 2, 120), clusters=max(1, nodes // 10))))
+    return found
+
+
+def main() -> None:
+    """Run the comparison and print a token table."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", default="8,20,40,60", help="Node counts of the synthetic specs")
+    args = parser.parse_args()
+    
+    tokenizer, count = get_counter()
+    print(f"tokenizer: {tokenizer}")
+    print(f"{'sample':<10} {'v1 tokens':>10} {'v2 tokens':>10} {'saved':>7} {'v1 chars':>9} {'v2 chars':>9}")
+    totals = [0, 0]
+    for name, spec in samples([int(s) for s in args.sizes.split(",")]):
+        compact = compact_spec(spec)
+        if diagram_service.canonicalize_spec(compact) != diagram_service.canonicalize_spec(spec):
+            sys.exit(f"{name}: compact spec does not expand back to the same diagram")
+        full_text = json.dumps(spec)
+        compact_text = json.dumps(compact)
+        full_tokens, compact_tokens = count(full_text), count(compact_text)
+        totals[0] += full_tokens
+        totals[1] += compact_tokens
+        print(
+            f"{name:<10} {full_tokens:>10} {compact_tokens:>10} {1 - compact_tokens / full_tokens:>7.0%} "
+            f"{len(full_text):>9} {len(compact_text):>9}"
+        )
+    print(f"{'total':<10} {totals[0]:>10} {totals[1]:>10} {1 - totals[1] / totals[0]:>7.0%}")
+
+
+if __name__ == "__main__":
+    main()
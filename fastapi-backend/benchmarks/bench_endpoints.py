@@ -0,0 +1,138 @@
+"""
+Latency and failures when routing across several Azure OpenAI endpoints.
+
+Sends a steady stream of calls through the resilience policy of the Azure
+OpenAI service to three simulated endpoints, with time scaled down so the
+run takes seconds. One endpoint is fast, one slower, and the third slows
+down fivefold for a while and later stops answering altogether. The run
+compares weighted random routing with the pool's power-of-two-choices on
+expected latency and load, with ejection of failing endpoints. No Azure
+OpenAI calls are made.
+
+Run from the fastapi-backend directory:
+    python -m benchmarks.bench_endpoints
+"""
+
+import argparse
+import asyncio
+import random
+import time
+from typing import Any, Dict, List
+
+import httpx
+from openai import APIConnectionError
+
+from services.admission import AdaptiveLimit, AdmissionController
+from services.endpoint_pool import Endpoint, EndpointPool
+from services.resilience import CircuitBreaker, Resilience, RetryBudget
+
+_REQUEST = httpx.Request("POST", "https://example.openai.azure.com/")
+
+
+class RandomPool(EndpointPool):
+    """Weighted random routing without ejection, for comparison."""
+    
+    def pick(self, kind: str) -> Endpoint:
+        return self._rng.choices(self.endpoints, weights=[e.weight for e in self.endpoints])[0]
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile of a list of values."""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def run(balanced: bool, calls: int, rate: float, scale: float, seed: int) -> Dict[str, Any]:
+    """Send calls at a steady rate and collect latencies, failures and each endpoint's share."""
+    rng = random.Random(seed)
+    # Median latency of each endpoint in simulated seconds
+    medians = {"fast": 3.0, "slow": 5.0, "flaky": 3.0}
+    endpoints = [
+        Endpoint(
+            name=name,
+            url=f"https://{name}.openai.azure.com",
+            api_key="",
+            deployment="gpt",
+            text_deployment="gpt",
+            admission=AdmissionController(AdaptiveLimit(64, 1, 128), enabled=False),
+        )
+        for name in medians
+    ]
+    pool_type = EndpointPool if balanced else RandomPool
+    pool = pool_type(
+        endpoints, eject_seconds=30 * scale, eject_max_seconds=300 * scale,
+        decay_seconds=60 * scale, rng=random.Random(seed),
+    )
+    policy = Resilience(
+        deadline=60 * scale,
+        max_retries=2,
+        backoff=0.5 * scale,
+        backoff_max=8 * scale,
+        budget=RetryBudget(0.2, 1 / scale),
+        breaker=CircuitBreaker(5, 30 * scale),
+        hedge_enabled=False,
+    )
+    # The flaky endpoint is slow for a fifth of the run, then down for another fifth
+    duration = calls / rate
+    started = time.monotonic()
+    
+    async def attempt(remaining: float) -> None:
+        endpoint = pool.pick("diagram")
+        with pool.track(endpoint, "diagram"):
+            now = (time.monotonic() - started) / scale
+            seconds = rng.lognormvariate(0, 0.25) * medians[endpoint.name]
+            if endpoint.name == "flaky" and 0.2 * duration <= now < 0.4 * duration:
+                seconds *= 5
+            if endpoint.name == "flaky" and 0.6 * duration <= now < 0.8 * duration:
+                await asyncio.sleep(min(remaining, 10 * scale))
+                raise APIConnectionError(request=_REQUEST)
+            await asyncio.sleep(min(remaining, seconds * scale))
+    
+    latencies: List[float] = []
+    failed = 0
+    
+    async def one() -> None:
+        nonlocal failed
+        call_started = time.perf_counter()
+        try:
+            await policy.call(attempt, kind="diagram")
+            latencies.append((time.perf_counter() - call_started) / scale)
+        except Exception:
+            failed += 1
+    
+    tasks = []
+    for _ in range(calls):
+        tasks.append(asyncio.ensure_future(one()))
+        await asyncio.sleep(rng.expovariate(rate) * scale)
+    await asyncio.gather(*tasks)
+    requests = sum(endpoint.requests for endpoint in endpoints)
+    return {
+        "p50": percentile(latencies, 0.5),
+        "p95": percentile(latencies, 0.95),
+        "p99": percentile(latencies, 0.99),
+        "failed": failed / calls,
+        "shares": {endpoint.name: endpoint.requests / requests for endpoint in endpoints},
+    }
+
+
+def main() -> None:
+    """Run both routing policies and print a table."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--calls", type=int, default=2000)
+    parser.add_argument("--rate", type=float, default=5.0, help="Calls per simulated second")
+    parser.add_argument("--scale", type=float, default=0.005, help="Real seconds per simulated second")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    
+    print(f"{'routing':<9} {'p50 s':>7} {'p95 s':>7} {'p99 s':>7} {'failed':>7}   share fast/slow/flaky")
+    for balanced in (False, True):
+        stats = asyncio.run(run(balanced, args.calls, args.rate, args.scale, args.seed))
+        shares = "/".join(f"{share:.0%}" for share in stats["shares"].values())
+        print(
+            f"{'p2c' if balanced else 'random':<9} {stats['p50']:>7.2f} {stats['p95']:>7.2f} "
+            f"{stats['p99']:>7.2f} {stats['failed']:>7.1%}   {shares}"
+        )
+
+
+if __name__ == "__main__":
+    main()
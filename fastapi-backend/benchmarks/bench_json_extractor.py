@@ -0,0 +1,131 @@
+"""
+Throughput of DiagramSpec extraction from long model answers.
+
+Compares the original character-by-character scanner with the incremental
+extractor, both on complete responses and fed in streaming-sized chunks.
+
+Run from the fastapi-backend directory:
+    python -m benchmarks.bench_json_extractor
+"""
+
+import argparse
+import json
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from benchmarks.samples import make_model_output
+from services.json_extractor import IncrementalJSONExtractor, find_diagram_spec
+
+
+def legacy_extract_json_objects(text: str) -> List[Dict]:
+    """The pre-incremental DiagramService.extract_json_objects, kept for comparison."""
+    objects: List[Dict] = []
+    depth = 0
+    start = None
+    in_str = False
+    esc = False
+    for i, ch in enumerate(text or ""):
+        if ch == '"' and not esc:
+            in_str = not in_str
+        if ch == "\\" and not esc:
+            esc = True
+            continue
+        esc = False
+        if in_str:
+            continue
+        if ch == "{":
+            if depth == 0:
+                start = i
+            depth += 1
+        elif ch == "}":
+            depth -= 1
+            if depth == 0 and start is not None:
+                try:
+                    objects.append(json.loads(text[start : i + 1]))
+                except Exception:
+                    pass
+                start = None
+    return objects
+
+
+def legacy_extract_spec(text: str) -> Optional[Dict[str, Any]]:
+    """The pre-incremental DiagramService.extract_spec_from_text."""
+    for obj in legacy_extract_json_objects(text):
+        if isinstance(obj, dict) and "nodes" in obj and "edges" in obj:
+            return obj
+        if isinstance(obj, dict) and "arguments" in obj:
+            args = obj["arguments"]
+            if isinstance(args, str):
+                try:
+                    args = json.loads(args)
+                except Exception:
+                    args = None
+            if isinstance(args, dict) and "nodes" in args and "edges" in args:
+                return args
+    return None
+
+
+def streamed_extract_spec(text: str, chunk_size: int = 16) -> Optional[Dict[str, Any]]:
+    """Feed the text to the incremental extractor in model-delta sized chunks."""
+    extractor = IncrementalJSONExtractor(stop_at_spec=True)
+    for i in range(0, len(text), chunk_size):
+        extractor.feed(text[i : i + chunk_size])
+        if extractor.done:
+            break
+    return extractor.spec
+
+
+# Answers the extractors have disagreed on; every implementation must find
+# the same spec in them before anything is timed.
+REGRESSION_SAMPLES = [
+    'Use a "{" char. {"title":"t","nodes":[{"id":"a","label":"A"}],"edges":[]}',
+]
+
+
+def check_regressions(implementations: Dict[str, Callable[[str], Any]]) -> None:
+    """Assert every implementation finds the spec in each regression sample."""
+    for text in REGRESSION_SAMPLES:
+        expected = legacy_extract_spec(text)
+        assert expected is not None, f"no spec found in {text!r}"
+        for name, fn in implementations.items():
+            assert fn(text) == expected, f"{name} misses the spec in {text!r}"
+
+
+def best_of(fn: Callable[[str], Any], text: str, repeat: int) -> float:
+    """Best wall time in seconds over several runs."""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(text)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main() -> None:
+    """Run the benchmark and print a throughput table."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", default="100,500,2000", help="Response sizes in KB")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    
+    implementations = {
+        "legacy": legacy_extract_spec,
+        "incremental": find_diagram_spec,
+        "incremental (16-char chunks)": streamed_extract_spec,
+    }
+    check_regressions(implementations)
+    
+    print(f"{'size':>8} {'spec at':>8} {'implementation':<30} {'ms':>9} {'MB/s':>8}")
+    for kb in (int(s) for s in args.sizes.split(",")):
+        for position in ("middle", "end"):
+            text = make_model_output(kb * 1024, spec_position=position)
+            expected = legacy_extract_spec(text)
+            for name, fn in implementations.items():
+                assert fn(text) == expected, f"{name} disagrees with the legacy extractor"
+                seconds = best_of(fn, text, args.repeat)
+                mb_per_s = len(text) / seconds / 1e6
+                print(f"{kb:>6}KB {position:>8} {name:<30} {seconds * 1000:>9.2f} {mb_per_s:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+End-to-end render time of the mingrammer/diagrams engine versus direct DOT.
+
+Both engines render the same validated spec to PNG. Requires the Graphviz
+`dot` executable on PATH; Azure credentials are not needed.
+
+Run from the fastapi-backend directory:
+    python -m benchmarks.bench_render_engines
+"""
+
+import argparse
+import shutil
+import statistics
+import sys
+import time
+from typing import List
+
+from benchmarks.samples import make_spec
+from services.diagram import diagram_service
+from services.dot_renderer import dot_renderer
+
+
+def time_engine(engine: str, nodes: int, repeat: int) -> List[float]:
+    """Render a spec of the given size repeatedly and return wall times in seconds."""
+    edges = min(nodes * 2, 120)
+    clusters, spec_nodes, spec_edges, title, direction = diagram_service._validate_spec(
+        diagram_service.canonicalize_spec(make_spec(nodes, edges, clusters=max(1, nodes // 10)))
+    )
+    create = diagram_service._create_diagram_dot if engine == "dot" else diagram_service._create_diagram
+    # Warm icon resolution so both engines are measured on the render itself
+    for n in spec_nodes:
+        diagram_service._get_icon_class_with_fallback(n["icon"])
+    
+    timings: List[float] = []
+    for i in range(repeat):
+        started = time.perf_counter()
+        create(clusters, spec_nodes, spec_edges, title, direction, "png")
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def main() -> None:
+    """Run the benchmark and print a timing table."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", default="10,30,60", help="Node counts to render")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    
+    if shutil.which(dot_renderer.dot_binary) is None:
+        sys.exit("Graphviz 'dot' was not found on PATH; install Graphviz to run this benchmark.")
+    
+    print(f"{'nodes':>6} {'engine':<9} {'median ms':>10} {'min ms':>8} {'speedup':>8}")
+    for nodes in (int(s) for s in args.sizes.split(",")):
+        medians = {}
+        for engine in ("diagrams", "dot"):
+            timings = time_engine(engine, nodes, args.repeat)
+            medians[engine] = statistics.median(timings)
+            speedup = medians["diagrams"] / medians[engine]
+            print(
+                f"{nodes:>6} {engine:<9} {medians[engine] * 1000:>10.1f} "
+                f"{min(timings) * 1000:>8.1f} {speedup:>7.2f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Tail latency with hedged requests, and fail-fast behaviour during an outage.
+
+Runs the resilience policy of the Azure OpenAI service against a simulated
+upstream, with time scaled down so the run takes seconds. The latency part
+sends calls to an upstream with log-normal latencies and a few stragglers,
+with hedging off and on, and compares percentiles and the extra upstream
+load. The outage part sends calls to an upstream that only fails, with and
+without the circuit breaker. No Azure OpenAI calls are made.
+
+Run from the fastapi-backend directory:
+    python -m benchmarks.bench_resilience
+"""
+
+import argparse
+import asyncio
+import random
+import time
+from typing import Any, Dict, List
+
+import httpx
+from openai import APIConnectionError
+
+from services.resilience import CircuitBreaker, Resilience, RetryBudget
+
+_REQUEST = httpx.Request("POST", "https://example.openai.azure.com/")
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile of a list of values."""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def make_policy(hedge: bool, breaker_failures: int, scale: float) -> Resilience:
+    """Build the policy with the service defaults, durations scaled down."""
+    return Resilience(
+        deadline=60 * scale,
+        max_retries=2,
+        backoff=0.5 * scale,
+        backoff_max=8 * scale,
+        budget=RetryBudget(0.2, 1 / scale),
+        breaker=CircuitBreaker(breaker_failures, 30 * scale),
+        hedge_enabled=hedge,
+        hedge_min_delay=1 * scale,
+    )
+
+
+async def run_latency(hedge: bool, calls: int, concurrency: int, scale: float, seed: int) -> Dict[str, Any]:
+    """Send calls to a slow-tailed upstream and collect call latencies and upstream attempts."""
+    policy = make_policy(hedge, 5, scale)
+    rng = random.Random(seed)
+    attempts = 0
+    
+    async def upstream(remaining: float) -> None:
+        nonlocal attempts
+        attempts += 1
+        # Diagram completions: ~4 s median, and 3% stragglers stuck behind a slow replica
+        seconds = rng.lognormvariate(0, 0.25) * 4
+        if rng.random() < 0.03:
+            seconds *= 5
+        await asyncio.sleep(seconds * scale)
+    
+    latencies: List[float] = []
+    slots = asyncio.Semaphore(concurrency)
+    
+    async def one() -> None:
+        async with slots:
+            started = time.perf_counter()
+            await policy.call(upstream, kind="diagram")
+            latencies.append((time.perf_counter() - started) / scale)
+    
+    await asyncio.gather(*(one() for _ in range(calls)))
+    # The first calls run before hedging has enough latencies to go on
+    latencies = latencies[policy.hedge_min_samples:]
+    return {
+        "p50": percentile(latencies, 0.5),
+        "p95": percentile(latencies, 0.95),
+        "p99": percentile(latencies, 0.99),
+        "max": max(latencies),
+        "extra": attempts / calls - 1,
+    }
+
+
+async def run_outage(breaker: bool, calls: int, scale: float) -> Dict[str, Any]:
+    """Send calls, one after another, to an upstream that times out after a while."""
+    policy = make_policy(True, 5 if breaker else 10 ** 9, scale)
+    attempts = 0
+    
+    async def upstream(remaining: float) -> None:
+        nonlocal attempts
+        attempts += 1
+        await asyncio.sleep(min(remaining, 10 * scale))
+        raise APIConnectionError(request=_REQUEST)
+    
+    waited: List[float] = []
+    for _ in range(calls):
+        started = time.perf_counter()
+        try:
+            await policy.call(upstream)
+        except Exception:
+            pass
+        waited.append((time.perf_counter() - started) / scale)
+    return {"mean": sum(waited) / len(waited), "attempts": attempts}
+
+
+def main() -> None:
+    """Run both parts and print their tables."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--calls", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--scale", type=float, default=0.005, help="Real seconds per simulated second")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    
+    print(f"{'hedging':<8} {'p50 s':>7} {'p95 s':>7} {'p99 s':>7} {'max s':>7} {'extra calls':>12}")
+    for hedge in (False, True):
+        stats = asyncio.run(run_latency(hedge, args.calls, args.concurrency, args.scale, args.seed))
+        print(
+            f"{'on' if hedge else 'off':<8} {stats['p50']:>7.2f} {stats['p95']:>7.2f} {stats['p99']:>7.2f} "
+            f"{stats['max']:>7.2f} {stats['extra']:>12.1%}"
+        )
+    
+    print()
+    print(f"{'breaker':<8} {'calls':>6} {'mean wait s':>12} {'upstream attempts':>18}")
+    for breaker in (False, True):
+        stats = asyncio.run(run_outage(breaker, 50, args.scale))
+        print(f"{'on' if breaker else 'off':<8} {50:>6} {stats['mean']:>12.2f} {stats['attempts']:>18}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Cold-start cost of the application with and without start-up warm-up.
+
+Each mode runs in a fresh interpreter: it imports the application, starts
+it, waits for /ready and then times the first and second diagram render
+through the job queue. Requires the Graphviz `dot` executable on PATH; no
+Azure OpenAI calls are made.
+
+Run from the fastapi-backend directory:
+    python -m benchmarks.bench_startup
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+from typing import Any, Dict
+
+from benchmarks.samples import make_spec
+
+
+def run_child() -> None:
+    """Measure one start-up in this process and print the timings as JSON."""
+    started = time.perf_counter()
+    from fastapi.testclient import TestClient
+    from main import app
+    timings: Dict[str, Any] = {"import": time.perf_counter() - started}
+    
+    started = time.perf_counter()
+    with TestClient(app) as client:
+        while client.get("/ready").status_code != 200:
+            time.sleep(0.01)
+        timings["ready"] = time.perf_counter() - started
+        for name, seed in (("first render", 1), ("second render", 2)):
+            started = time.perf_counter()
+            job = client.post("/diagrams/jobs", json=make_spec(12, 16, seed=seed)).json()
+            while job["status"] not in ("succeeded", "failed", "cancelled"):
+                time.sleep(0.005)
+                job = client.get(f"/diagrams/jobs/{job['id']}").json()
+            timings[name] = time.perf_counter() - started
+        timings["steps"] = client.get("/ready").json()["steps"]
+    print(json.dumps(timings))
+
+
+def measure(warm_up: bool) -> Dict[str, Any]:
+    """Start the application in a fresh interpreter and collect its timings."""
+    env = dict(
+        os.environ,
+        WARMUP_ENABLED=str(warm_up),
+        WARMUP_CONNECT="False",
+        DIAGRAM_STORE_BACKEND="memory",
+        COMPLETION_CACHE_ENABLED="False",
+    )
+    # Nothing is sent to Azure OpenAI, but settings validation needs values
+    env.setdefault("AZURE_OPENAI_ENDPOINT", "https://example.openai.azure.com")
+    env.setdefault("AZURE_OPENAI_API_KEY", "unused")
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.bench_startup", "--child"],
+        env=env, check=True, capture_output=True, text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main() -> None:
+    """Run the benchmark and print a timing table."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        run_child()
+        return
+    
+    if shutil.which(os.getenv("GRAPHVIZ_DOT_BINARY", "dot")) is None:
+        sys.exit("Graphviz 'dot' was not found on PATH; install Graphviz to run this benchmark.")
+    
+    columns = ("import", "ready", "first render", "second render")
+    print(f"{'warm-up':<8} {'run':>3} " + " ".join(f"{c + ' ms':>16}" for c in columns))
+    for warm_up in (False, True):
+        for run in range(args.repeat):
+            timings = measure(warm_up)
+            print(
+                f"{'on' if warm_up else 'off':<8} {run + 1:>3} "
+                + " ".join(f"{timings[c] * 1000:>16.0f}" for c in columns)
+            )
+        if warm_up:
+            steps = ", ".join(f"{name} {step['seconds'] * 1000:.0f} ms" for name, step in timings["steps"].items())
+            print(f"warm-up steps (last run): {steps}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Synthetic but realistic inputs shared by the benchmarks.
+"""
+
+import json
+import random
+from typing import Any, Dict, List
+
+# Icons the model commonly emits, taken from the system prompt
+ICONS = [
+    "diagrams.azure.web.AppServices",
+    "diagrams.azure.database.SQLDatabases",
+    "diagrams.azure.ml.AzureOpenAI",
+    "diagrams.azure.web.Search",
+    "diagrams.azure.storage.BlobStorage",
+    "diagrams.azure.compute.FunctionApps",
+    "diagrams.azure.compute.ContainerApps",
+    "diagrams.azure.compute.KubernetesServices",
+    "diagrams.azure.security.KeyVaults",
+    "diagrams.azure.identity.ManagedIdentities",
+    "diagrams.azure.database.CosmosDb",
+    "diagrams.azure.integration.APIManagement",
+    "diagrams.azure.network.ApplicationGateway",
+    "diagrams.azure.network.VirtualNetworks",
+    "diagrams.azure.integration.ServiceBus",
+    "diagrams.azure.analytics.EventHubs",
+    "diagrams.azure.analytics.Databricks",
+    "diagrams.onprem.client.User",
+]
+
+PROSE = (
+    "Azure Front Door terminates TLS and routes traffic to the regional App Service "
+    "instances, while Private Endpoints keep data-plane traffic on the virtual network. "
+    "Use managed identities instead of connection strings wherever the service supports it. "
+)
+
+CODE_BLOCK = '''```bash
+az group create --name rg-demo --location westeurope
+az webapp config appsettings set --name app --settings KEY="${SECRET_VALUE" OTHER={value}
+for i in $(seq 1 3); do echo "{\\"replica\\": $i}"; done
+```
+'''
+
+PYTHON_BLOCK = '''```python
+def handler(req):
+    payload = {"status": "ok", "items": [x for x in range(10)]}
+    return json.dumps(payload)
+```
+'''
+
+
+def make_spec(nodes: int, edges: int, clusters: int = 4, direction: str = "LR", seed: int = 7) -> Dict[str, Any]:
+    """
+    Build a valid DiagramSpec of the requested size.
+    
+    Args:
+        nodes: Number of nodes
+        edges: Number of edges
+        clusters: Number of clusters nodes are spread over
+        direction: Layout direction
+        seed: Random seed for reproducible graphs
+    
+    Returns:
+        Diagram specification
+    """
+    rng = random.Random(seed)
+    cluster_ids = [f"c{i}" for i in range(clusters)]
+    spec_nodes: List[Dict[str, Any]] = []
+    for i in range(nodes):
+        node = {"id": f"n{i}", "label": f"Service {i}", "icon": ICONS[i % len(ICONS)]}
+        if cluster_ids and i % 3:
+            node["cluster"] = cluster_ids[i % len(cluster_ids)]
+        spec_nodes.append(node)
+    spec_edges = []
+    for i in range(edges):
+        src, tgt = rng.sample(range(nodes), 2) if nodes > 1 else (0, 0)
+        edge = {"source": f"n{src}", "target": f"n{tgt}"}
+        if i % 4 == 0:
+            edge["label"] = "HTTPS"
+        spec_edges.append(edge)
+    return {
+        "title": f"Architecture with {nodes} nodes",
+        "direction": direction,
+        "clusters": [{"id": c, "label": f"Layer {c}"} for c in cluster_ids],
+        "nodes": spec_nodes,
+        "edges": spec_edges,
+    }
+
+
+def make_model_output(target_bytes: int, spec_position: str = "end", seed: int = 7) -> str:
+    """
+    Build a long model answer mixing prose, code blocks and one fenced DiagramSpec.
+    
+    Args:
+        target_bytes: Approximate size of the generated text
+        spec_position: Where the spec goes: "start", "middle", "end" or "none"
+        seed: Random seed for reproducible text
+    
+    Returns:
+        Model output text
+    """
+    rng = random.Random(seed)
+    spec_block = "Here is the architecture:\n```json\n" + json.dumps(make_spec(40, 60), indent=2) + "\n```\n"
+    filler: List[str] = []
+    size = 0
+    while size < target_bytes:
+        piece = rng.choice([PROSE, PROSE, CODE_BLOCK, PYTHON_BLOCK])
+        filler.append(piece)
+        size += len(piece)
+    if spec_position == "start":
+        filler.insert(0, spec_block)
+    elif spec_position == "middle":
+        filler.insert(len(filler) // 2, spec_block)
+    elif spec_position == "end":
+        filler.append(spec_block)
+    return "".join(filler)
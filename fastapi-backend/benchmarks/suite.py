@@ -0,0 +1,227 @@
+"""
+Regression suite for the hot paths of spec extraction, validation and rendering.
+
+Every case is timed over several rounds and its fastest round compared with a
+saved baseline, as the minimum is the least noisy estimate for code that
+does not wait on anything; the run fails when a case got slower than the
+baseline by more than the threshold. Runs offline and needs no Azure credentials. Render
+cases need the Graphviz `dot` executable on PATH and are skipped without it.
+
+Baselines are only comparable on the machine they were recorded on, so
+record one before changing a hot path and compare against it afterwards.
+
+Run from the fastapi-backend directory:
+    python -m benchmarks.suite --save      # record benchmarks/baseline.json
+    python -m benchmarks.suite             # compare against it
+"""
+
+import argparse
+import json
+import platform
+import shutil
+import statistics
+import sys
+import timeit
+from pathlib import Path
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+from benchmarks.samples import ICONS, make_model_output, make_spec
+from config.settings import settings
+from services.diagram import diagram_service
+from services.dot_renderer import dot_renderer
+from services.icon_registry import IconRegistry, icon_registry
+from services.icon_search import icon_search
+from services.intent_router import intent_router
+from services.json_extractor import extract_json_objects
+
+DEFAULT_BASELINE = Path(__file__).with_name("baseline.json")
+
+# Icon paths the model gets slightly wrong; resolving them exercises the
+# alias and fuzzy-matching paths of the registry
+NEAR_MISS_ICONS = [
+    "diagrams.azure.database.CosmosDB",
+    "diagrams.azure.web.AppService",
+    "diagrams.azure.storage.BlobStorages",
+    "diagrams.azure.compute.AKS",
+    "diagrams.azure.ml.OpenAI",
+]
+
+
+class Case(NamedTuple):
+    """A named, zero-argument callable to time."""
+    name: str
+    fn: Callable[[], Any]
+    needs_dot: bool = False
+
+
+def build_cases() -> List[Case]:
+    """Prepare the inputs of every case up front so only the hot path is timed."""
+    cases: List[Case] = []
+    
+    # Extraction from model answers: a typical short answer, long answers with
+    # the spec in the middle or at the end, and a long answer without one
+    answers = {
+        "2kb_end": make_model_output(2 * 1024, spec_position="end"),
+        "100kb_middle": make_model_output(100 * 1024, spec_position="middle"),
+        "100kb_end": make_model_output(100 * 1024, spec_position="end"),
+        "100kb_none": make_model_output(100 * 1024, spec_position="none"),
+    }
+    for label, text in answers.items():
+        cases.append(Case(f"extract_json_objects/{label}", lambda text=text: extract_json_objects(text)))
+        cases.append(Case(
+            f"extract_spec_from_text/{label}",
+            lambda text=text: diagram_service.extract_spec_from_text(text),
+        ))
+    
+    # Intent routing runs in front of every stateless completion
+    prompts = {
+        "question": "What is the difference between Private Endpoint and Service Endpoint?",
+        "diagram": "Design an event-driven architecture with Event Hubs, Functions, Cosmos DB and Key Vault",
+    }
+    for label, text in prompts.items():
+        cases.append(Case(f"intent_router/{label}", lambda text=text: intent_router.diagram_probability(text)))
+    
+    # Validation up to the configured limits
+    for nodes, edges in ((10, 15), (30, 60), (settings.MAX_NODES, settings.MAX_EDGES)):
+        spec = diagram_service.canonicalize_spec(make_spec(nodes, edges))
+        cases.append(Case(
+            f"validate_spec/{nodes}n_{edges}e",
+            lambda spec=spec: diagram_service._validate_spec(spec),
+        ))
+    
+    # Icon resolution on a fresh registry (index build included) and a warm one
+    icons = ICONS + NEAR_MISS_ICONS
+    
+    def resolve_cold() -> None:
+        registry = IconRegistry(settings.ALLOWED_ICON_PREFIXES)
+        for path in icons:
+            registry.resolve(path)
+    
+    def resolve_warm() -> None:
+        for path in icons:
+            diagram_service._get_icon_class_with_fallback(path)
+    
+    icon_registry.load()
+    cases.append(Case("icons/cold", resolve_cold))
+    cases.append(Case("icons/warm", resolve_warm))
+    
+    # Icon retrieval for the prompt, on the index built once per process
+    icon_search.search("", 1)
+    for label, text in prompts.items():
+        cases.append(Case(
+            f"icon_search/{label}",
+            lambda text=text: icon_search.search(text, settings.ICON_RETRIEVAL_TOP_K),
+        ))
+    
+    # Rendering through mingrammer/diagrams at several sizes and directions
+    for nodes in (10, 30, settings.MAX_NODES):
+        for direction in ("LR", "TB"):
+            spec = make_spec(nodes, min(nodes * 2, settings.MAX_EDGES), clusters=max(1, nodes // 10), direction=direction)
+            validated = diagram_service._validate_spec(diagram_service.canonicalize_spec(spec))
+            cases.append(Case(
+                f"create_diagram/{nodes}n_{direction}",
+                lambda validated=validated: diagram_service._create_diagram(*validated, "png"),
+                needs_dot=True,
+            ))
+    
+    return cases
+
+
+def time_case(case: Case, rounds: int) -> Dict[str, float]:
+    """
+    Time a case.
+    
+    The number of calls per round is calibrated so a round takes at least
+    0.2 seconds, which keeps timer resolution out of fast cases.
+    
+    Args:
+        case: The case to time
+        rounds: Number of timed rounds
+    
+    Returns:
+        Median and minimum seconds per call, and the calls per round
+    """
+    timer = timeit.Timer(case.fn)
+    number, _ = timer.autorange()
+    per_call = [total / number for total in timer.repeat(repeat=rounds, number=number)]
+    return {"median": statistics.median(per_call), "min": min(per_call), "number": number}
+
+
+def machine_info() -> Dict[str, str]:
+    """Describe where the results were taken, to spot baselines from elsewhere."""
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+    }
+
+
+def load_baseline(path: Path) -> Optional[Dict[str, Any]]:
+    """Read a saved baseline, or None if there is none."""
+    if not path.exists():
+        return None
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def format_seconds(seconds: float) -> str:
+    """Format a duration with a unit that keeps a few significant digits."""
+    if seconds < 1e-3:
+        return f"{seconds * 1e6:.1f} µs"
+    if seconds < 1:
+        return f"{seconds * 1e3:.2f} ms"
+    return f"{seconds:.3f} s"
+
+
+def main() -> None:
+    """Run the suite, print a comparison table and exit non-zero on regressions."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE, help="Baseline JSON file")
+    parser.add_argument("--save", action="store_true", help="Write the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.25, help="Allowed slowdown, e.g. 0.25 for 25%%")
+    parser.add_argument("--rounds", type=int, default=5, help="Timed rounds per case")
+    parser.add_argument("-k", "--filter", default="", help="Only run cases whose name contains this")
+    args = parser.parse_args()
+    
+    has_dot = shutil.which(dot_renderer.dot_binary) is not None
+    baseline = load_baseline(args.baseline)
+    baseline_cases = baseline["cases"] if baseline else {}
+    if baseline and baseline.get("machine") != machine_info():
+        print(f"warning: {args.baseline} was recorded on a different machine or Python", file=sys.stderr)
+    
+    results: Dict[str, Dict[str, float]] = {}
+    regressions: List[str] = []
+    print(f"{'case':<38} {'best':>11} {'baseline':>11} {'change':>8}  status")
+    for case in build_cases():
+        if args.filter not in case.name:
+            continue
+        if case.needs_dot and not has_dot:
+            print(f"{case.name:<38} {'':>11} {'':>11} {'':>8}  skipped (Graphviz 'dot' not on PATH)")
+            continue
+        
+        result = time_case(case, args.rounds)
+        results[case.name] = result
+        previous = baseline_cases.get(case.name)
+        if previous is None:
+            print(f"{case.name:<38} {format_seconds(result['min']):>11} {'-':>11} {'-':>8}  new")
+            continue
+        change = result["min"] / previous["min"] - 1
+        status = "ok"
+        if change > args.threshold:
+            status = "REGRESSED"
+            regressions.append(case.name)
+        print(
+            f"{case.name:<38} {format_seconds(result['min']):>11} "
+            f"{format_seconds(previous['min']):>11} {change:>+8.1%}  {status}"
+        )
+    
+    if args.save:
+        # Keep baseline entries of cases that were filtered out or skipped
+        saved = {"machine": machine_info(), "cases": {**baseline_cases, **results}}
+        args.baseline.write_text(json.dumps(saved, indent=2, sort_keys=True) + "\n", encoding="utf-8")
+        print(f"\nSaved {len(results)} results to {args.baseline}")
+    elif regressions:
+        sys.exit(f"\n{len(regressions)} case(s) regressed by more than {args.threshold:.0%}: {', '.join(regressions)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,7 +2,9 @@
 System prompts for the Azure solutions assistant.
 """
 
-SYSTEM_PROMPT = """
+import hashlib
+
+_SYSTEM_PROMPT_TEMPLATE = """
 You are an Azure solutions assistant.
 
 Decide whether to CALL THE TOOL to render an AZURE ARCHITECTURE DIAGRAM:
@@ -11,7 +13,18 @@ Decide whether to CALL THE TOOL to render an AZURE ARCHITECTURE DIAGRAM:
 
 When calling the tool, produce a clear DiagramSpec:
 - Choose sensible clusters (e.g., "App Layer", "Data Layer", "LLM + Retrieval").
-- Use Azure icons via fully-qualified class paths from 'diagrams', e.g.:
+{icon_guidance}
+Defaults:
+- title: infer succinctly
+- direction: LR
+- Limit to <= 60 nodes and <= 120 edges.
+- Ensure edges reference existing node ids.
+- Keep labels short and helpful.
+- Include only services relevant to the user request.
+"""
+
+# Icon guidance listing common icons, sent when icon retrieval is disabled
+_ICON_GUIDANCE_LIST = """- Use Azure icons via fully-qualified class paths from 'diagrams', e.g.:
   - diagrams.azure.web.AppServices
   - diagrams.azure.database.SQLDatabases
   - diagrams.azure.ml.AzureOpenAI
@@ -36,16 +49,70 @@ When calling the tool, produce a clear DiagramSpec:
 - Also allowed for people/internet:
   - diagrams.onprem.client.User
   - diagrams.onprem.network.Internet
+"""
 
-Defaults:
-- title: infer succinctly
-- direction: LR
-- Limit to <= 60 nodes and <= 120 edges.
-- Ensure edges reference existing node ids.
-- Keep labels short and helpful.
-- Include only services relevant to the user request.
+# Icon guidance when the icons relevant to each prompt are retrieved and sent
+# right before it; the system prompt itself then never varies
+_ICON_GUIDANCE_RETRIEVED = """- Use Azure icons via fully-qualified class paths from 'diagrams', i.e. module
+  path plus class name. The icons most relevant to the request are listed right
+  before it, grouped by module; prefer those.
+- For people and the internet use diagrams.onprem.client.User and
+  diagrams.onprem.network.Internet.
+"""
+
+# Icon guidance for the compact tool spec (TOOL_SPEC_VERSION 2), whose tool
+# description lists the icon codes
+_ICON_GUIDANCE_CODES = """- Set node icons as the tool describes: an icon code, or a class name from
+  'diagrams' for services without a code. When icons relevant to the request
+  are listed right before it, prefer those.
+- For people and the internet use the user and internet codes.
 """
 
+SYSTEM_PROMPT = _SYSTEM_PROMPT_TEMPLATE.format(icon_guidance=_ICON_GUIDANCE_LIST)
+
+COMPACT_SYSTEM_PROMPT = _SYSTEM_PROMPT_TEMPLATE.format(icon_guidance=_ICON_GUIDANCE_RETRIEVED)
+
+ICON_CODE_SYSTEM_PROMPT = _SYSTEM_PROMPT_TEMPLATE.format(icon_guidance=_ICON_GUIDANCE_CODES)
+
+# Prefix of the message listing the icons retrieved for a prompt
+RELEVANT_ICONS_PREFIX = "Relevant icons: "
+
+# Identifies the system prompt in completion cache keys; changes with the text
+SYSTEM_PROMPT_VERSION = hashlib.sha256(SYSTEM_PROMPT.encode("utf-8")).hexdigest()[:12]
+COMPACT_SYSTEM_PROMPT_VERSION = hashlib.sha256(COMPACT_SYSTEM_PROMPT.encode("utf-8")).hexdigest()[:12]
+ICON_CODE_SYSTEM_PROMPT_VERSION = hashlib.sha256(ICON_CODE_SYSTEM_PROMPT.encode("utf-8")).hexdigest()[:12]
+
+# System prompt of prompts the intent router sends without the diagram tool;
+# it leaves out the tool instructions and icon list to keep the call lean
+TEXT_SYSTEM_PROMPT = """
+You are an Azure solutions assistant. Answer questions about Azure services,
+architecture and best practices clearly and concisely.
+"""
+
+TEXT_SYSTEM_PROMPT_VERSION = hashlib.sha256(TEXT_SYSTEM_PROMPT.encode("utf-8")).hexdigest()[:12]
+
+# Added to the system prompt in chat sessions
+_SESSION_INSTRUCTIONS = """
+This is an ongoing conversation. Earlier turns are included above the latest
+message, and the diagram currently on screen, if any, is given right before it
+as "Current diagram".
+- To change the current diagram, CALL edit_azure_architecture with only the
+  nodes, edges and clusters that are added, updated or removed. Reuse existing
+  node ids.
+- Only call render_azure_architecture for a new or completely different diagram.
+"""
+
+# System prompt of chat sessions. It never varies between requests, so the
+# prompt prefix stays identical and Azure OpenAI can reuse its prompt cache.
+SESSION_SYSTEM_PROMPT = SYSTEM_PROMPT + _SESSION_INSTRUCTIONS
+
+COMPACT_SESSION_SYSTEM_PROMPT = COMPACT_SYSTEM_PROMPT + _SESSION_INSTRUCTIONS
+
+ICON_CODE_SESSION_SYSTEM_PROMPT = ICON_CODE_SYSTEM_PROMPT + _SESSION_INSTRUCTIONS
+
+# Prefix of the message carrying a session's current diagram
+CURRENT_DIAGRAM_PREFIX = "Current diagram: "
+
 DIAGRAM_GENERATION_PROMPT = """
 Generate a comprehensive Azure architecture diagram based on the user's requirements.
 Focus on creating a well-structured, production-ready architecture that follows Azure best practices.
@@ -1,7 +1,11 @@
 """
 Application configuration and settings.
 """
+import json
 import os
+from typing import Any, Dict, List
+from urllib.parse import urlparse
+
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -16,25 +20,146 @@ class Settings:
     AZURE_OPENAI_API_KEY: str = os.getenv("AZURE_OPENAI_API_KEY", "")
     AZURE_OPENAI_API_VERSION: str = os.getenv("AZURE_OPENAI_API_VERSION", "2024-12-01-preview")
     AZURE_OPENAI_DEPLOYMENT: str = os.getenv("AZURE_OPENAI_DEPLOYMENT", "gpt-5-chat")
+    # JSON list of endpoints to spread requests over, see openai_endpoints()
+    AZURE_OPENAI_ENDPOINTS: str = os.getenv("AZURE_OPENAI_ENDPOINTS", "")
+    
+    # Azure OpenAI HTTP Client Configuration
+    AZURE_OPENAI_MAX_CONNECTIONS: int = int(os.getenv("AZURE_OPENAI_MAX_CONNECTIONS", "200"))
+    AZURE_OPENAI_MAX_KEEPALIVE_CONNECTIONS: int = int(os.getenv("AZURE_OPENAI_MAX_KEEPALIVE_CONNECTIONS", "50"))
+    AZURE_OPENAI_KEEPALIVE_EXPIRY: float = float(os.getenv("AZURE_OPENAI_KEEPALIVE_EXPIRY", "30"))
+    AZURE_OPENAI_TIMEOUT: float = float(os.getenv("AZURE_OPENAI_TIMEOUT", "60"))
+    AZURE_OPENAI_CONNECT_TIMEOUT: float = float(os.getenv("AZURE_OPENAI_CONNECT_TIMEOUT", "10"))
+    AZURE_OPENAI_MAX_RETRIES: int = int(os.getenv("AZURE_OPENAI_MAX_RETRIES", "2"))
+    
+    # Azure OpenAI Resilience Configuration
+    AZURE_OPENAI_RETRY_BACKOFF_SECONDS: float = float(os.getenv("AZURE_OPENAI_RETRY_BACKOFF_SECONDS", "0.5"))
+    AZURE_OPENAI_RETRY_BACKOFF_MAX_SECONDS: float = float(os.getenv("AZURE_OPENAI_RETRY_BACKOFF_MAX_SECONDS", "8"))
+    AZURE_OPENAI_RETRY_BUDGET_RATIO: float = float(os.getenv("AZURE_OPENAI_RETRY_BUDGET_RATIO", "0.2"))
+    AZURE_OPENAI_RETRY_BUDGET_MIN_PER_SECOND: float = float(os.getenv("AZURE_OPENAI_RETRY_BUDGET_MIN_PER_SECOND", "1"))
+    AZURE_OPENAI_HEDGE_ENABLED: bool = os.getenv("AZURE_OPENAI_HEDGE_ENABLED", "True").lower() == "true"
+    AZURE_OPENAI_HEDGE_QUANTILE: float = float(os.getenv("AZURE_OPENAI_HEDGE_QUANTILE", "0.95"))
+    AZURE_OPENAI_HEDGE_MIN_DELAY_SECONDS: float = float(os.getenv("AZURE_OPENAI_HEDGE_MIN_DELAY_SECONDS", "1"))
+    AZURE_OPENAI_HEDGE_MIN_SAMPLES: int = int(os.getenv("AZURE_OPENAI_HEDGE_MIN_SAMPLES", "20"))
+    AZURE_OPENAI_BREAKER_FAILURES: int = int(os.getenv("AZURE_OPENAI_BREAKER_FAILURES", "5"))
+    AZURE_OPENAI_BREAKER_RESET_SECONDS: float = float(os.getenv("AZURE_OPENAI_BREAKER_RESET_SECONDS", "30"))
+    
+    # Azure OpenAI Admission Control Configuration
+    AZURE_OPENAI_ADMISSION_ENABLED: bool = os.getenv("AZURE_OPENAI_ADMISSION_ENABLED", "True").lower() == "true"
+    AZURE_OPENAI_TPM_LIMIT: int = int(os.getenv("AZURE_OPENAI_TPM_LIMIT", "0"))
+    AZURE_OPENAI_RPM_LIMIT: int = int(os.getenv("AZURE_OPENAI_RPM_LIMIT", "0"))
+    AZURE_OPENAI_CONCURRENCY_INITIAL: int = int(os.getenv("AZURE_OPENAI_CONCURRENCY_INITIAL", "16"))
+    AZURE_OPENAI_CONCURRENCY_MIN: int = int(os.getenv("AZURE_OPENAI_CONCURRENCY_MIN", "1"))
+    AZURE_OPENAI_CONCURRENCY_MAX: int = int(os.getenv("AZURE_OPENAI_CONCURRENCY_MAX", "128"))
+    AZURE_OPENAI_LATENCY_TOLERANCE: float = float(os.getenv("AZURE_OPENAI_LATENCY_TOLERANCE", "2.0"))
+    AZURE_OPENAI_ADMISSION_QUEUE_DEPTH: int = int(os.getenv("AZURE_OPENAI_ADMISSION_QUEUE_DEPTH", "200"))
+    AZURE_OPENAI_ADMISSION_MAX_WAIT_SECONDS: float = float(os.getenv("AZURE_OPENAI_ADMISSION_MAX_WAIT_SECONDS", "15"))
+    AZURE_OPENAI_EXPECTED_COMPLETION_TOKENS: int = int(os.getenv("AZURE_OPENAI_EXPECTED_COMPLETION_TOKENS", "800"))
+    
+    # Azure OpenAI Endpoint Pool Configuration
+    AZURE_OPENAI_EJECT_FAILURES: int = int(os.getenv("AZURE_OPENAI_EJECT_FAILURES", "3"))
+    AZURE_OPENAI_EJECT_SECONDS: float = float(os.getenv("AZURE_OPENAI_EJECT_SECONDS", "30"))
+    AZURE_OPENAI_EJECT_MAX_SECONDS: float = float(os.getenv("AZURE_OPENAI_EJECT_MAX_SECONDS", "300"))
+    AZURE_OPENAI_LATENCY_DECAY_SECONDS: float = float(os.getenv("AZURE_OPENAI_LATENCY_DECAY_SECONDS", "60"))
+    
+    # Record/Replay Configuration
+    AZURE_OPENAI_MODE: str = os.getenv("AZURE_OPENAI_MODE", "live").lower()
+    AZURE_OPENAI_CASSETTE: str = os.getenv("AZURE_OPENAI_CASSETTE", "cassettes/azure_openai.jsonl")
+    REPLAY_LATENCY: str = os.getenv("REPLAY_LATENCY", "")
+    REPLAY_SEED: str = os.getenv("REPLAY_SEED", "")
+    
+    # Completion Cache Configuration
+    COMPLETION_CACHE_ENABLED: bool = os.getenv("COMPLETION_CACHE_ENABLED", "True").lower() == "true"
+    COMPLETION_CACHE_TTL_SECONDS: float = float(os.getenv("COMPLETION_CACHE_TTL_SECONDS", "3600"))
+    COMPLETION_CACHE_MAX_BYTES: int = int(os.getenv("COMPLETION_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+    CLIENT_DISCONNECT_POLL_SECONDS: float = float(os.getenv("CLIENT_DISCONNECT_POLL_SECONDS", "0.5"))
+    
+    # Intent Router Configuration
+    INTENT_ROUTER_ENABLED: bool = os.getenv("INTENT_ROUTER_ENABLED", "True").lower() == "true"
+    INTENT_ROUTER_THRESHOLD: float = float(os.getenv("INTENT_ROUTER_THRESHOLD", "0.3"))
+    INTENT_ROUTER_MODEL: str = os.getenv("INTENT_ROUTER_MODEL", "")
+    AZURE_OPENAI_TEXT_DEPLOYMENT: str = os.getenv("AZURE_OPENAI_TEXT_DEPLOYMENT", "")
+    
+    # Batch Chat Configuration
+    CHAT_BATCH_MAX_PROMPTS: int = int(os.getenv("CHAT_BATCH_MAX_PROMPTS", "50"))
+    CHAT_BATCH_LLM_CONCURRENCY: int = int(os.getenv("CHAT_BATCH_LLM_CONCURRENCY", "8"))
+    CHAT_BATCH_RENDER_CONCURRENCY: int = int(os.getenv("CHAT_BATCH_RENDER_CONCURRENCY", "2"))
+    
+    # Chat Session Configuration
+    SESSION_MAX_COUNT: int = int(os.getenv("SESSION_MAX_COUNT", "1000"))
+    SESSION_TTL_SECONDS: float = float(os.getenv("SESSION_TTL_SECONDS", "3600"))
+    SESSION_HISTORY_MAX_TOKENS: int = int(os.getenv("SESSION_HISTORY_MAX_TOKENS", "4000"))
     
     # Application Configuration
     DEBUG: bool = os.getenv("DEBUG", "False").lower() == "true"
     MAX_NODES: int = int(os.getenv("MAX_NODES", "60"))
     MAX_EDGES: int = int(os.getenv("MAX_EDGES", "120"))
+    SPEC_AUTO_REPAIR: bool = os.getenv("SPEC_AUTO_REPAIR", "True").lower() == "true"
     DIAGRAM_OUTPUT_DIR: str = os.getenv("DIAGRAM_OUTPUT_DIR", "static/diagrams")
     
+    # Diagram Store Configuration
+    DIAGRAM_STORE_BACKEND: str = os.getenv("DIAGRAM_STORE_BACKEND", "local")
+    DIAGRAM_STORE_MAX_BYTES: int = int(os.getenv("DIAGRAM_STORE_MAX_BYTES", str(512 * 1024 * 1024)))
+    DIAGRAM_STORE_MAX_AGE_SECONDS: float = float(os.getenv("DIAGRAM_STORE_MAX_AGE_SECONDS", str(7 * 24 * 3600)))
+    
+    # Render Engine Configuration
+    RENDER_ENGINE: str = os.getenv("RENDER_ENGINE", "diagrams")
+    GRAPHVIZ_DOT_BINARY: str = os.getenv("GRAPHVIZ_DOT_BINARY", "dot")
+    DIAGRAM_PREVIEW_DPI: int = int(os.getenv("DIAGRAM_PREVIEW_DPI", "48"))
+    SVG_INLINE_ICONS: bool = os.getenv("SVG_INLINE_ICONS", "True").lower() == "true"
+    
+    # Render Pool Configuration
+    RENDER_POOL_SIZE: int = int(os.getenv("RENDER_POOL_SIZE", "2"))
+    RENDER_QUEUE_DEPTH: int = int(os.getenv("RENDER_QUEUE_DEPTH", "8"))
+    RENDER_TIMEOUT_SECONDS: float = float(os.getenv("RENDER_TIMEOUT_SECONDS", "60"))
+    RENDER_RETRY_AFTER_SECONDS: int = int(os.getenv("RENDER_RETRY_AFTER_SECONDS", "5"))
+    RENDER_POOL_START_METHOD: str = os.getenv("RENDER_POOL_START_METHOD", "spawn")
+    
+    # Diagram Job Queue Configuration
+    DIAGRAM_JOB_WORKERS: int = int(os.getenv("DIAGRAM_JOB_WORKERS", "2"))
+    DIAGRAM_JOB_MAX_PENDING: int = int(os.getenv("DIAGRAM_JOB_MAX_PENDING", "100"))
+    DIAGRAM_JOB_TTL_SECONDS: float = float(os.getenv("DIAGRAM_JOB_TTL_SECONDS", "900"))
+    
+    # Warm-up Configuration
+    WARMUP_ENABLED: bool = os.getenv("WARMUP_ENABLED", "True").lower() == "true"
+    WARMUP_CONNECT: bool = os.getenv("WARMUP_CONNECT", "True").lower() == "true"
+    
+    # Metrics Configuration
+    METRICS_ENABLED: bool = os.getenv("METRICS_ENABLED", "True").lower() == "true"
+    SERVER_TIMING_ENABLED: bool = os.getenv("SERVER_TIMING_ENABLED", "True").lower() == "true"
+    
     # Icon Configuration
     FALLBACK_ICON: str = "diagrams.azure.general.Resource"
     ANNOTATE_FALLBACK: bool = True
     ALLOWED_ICON_PREFIXES: tuple = ("diagrams.azure.", "diagrams.onprem.")
+    ICON_STRICT_WHITELIST: bool = os.getenv("ICON_STRICT_WHITELIST", "False").lower() == "true"
+    ICON_RETRIEVAL_ENABLED: bool = os.getenv("ICON_RETRIEVAL_ENABLED", "True").lower() == "true"
+    ICON_RETRIEVAL_TOP_K: int = int(os.getenv("ICON_RETRIEVAL_TOP_K", "12"))
+    TOOL_SPEC_VERSION: int = int(os.getenv("TOOL_SPEC_VERSION", "2"))
     
     @classmethod
     def validate(cls) -> None:
         """Validate required settings."""
-        required_settings = [
-            "AZURE_OPENAI_ENDPOINT",
-            "AZURE_OPENAI_API_KEY",
-        ]
+        if cls.AZURE_OPENAI_MODE not in ("live", "record", "replay"):
+            raise ValueError(
+                f"Invalid AZURE_OPENAI_MODE '{cls.AZURE_OPENAI_MODE}' (expected live, record or replay)"
+            )
+        
+        # Replay serves recorded completions and never contacts Azure; a pool
+        # of endpoints replaces the single endpoint and key
+        endpoints = cls.openai_endpoints()
+        required_settings = []
+        if cls.AZURE_OPENAI_MODE != "replay" and not cls.AZURE_OPENAI_ENDPOINTS:
+            required_settings = [
+                "AZURE_OPENAI_ENDPOINT",
+                "AZURE_OPENAI_API_KEY",
+            ]
+        elif cls.AZURE_OPENAI_MODE != "replay":
+            for endpoint in endpoints:
+                if not endpoint["api_key"]:
+                    raise ValueError(
+                        f"Endpoint '{endpoint['name']}' in AZURE_OPENAI_ENDPOINTS has no api_key "
+                        "and AZURE_OPENAI_API_KEY is not set"
+                    )
         
         missing = []
         for setting in required_settings:
@@ -43,6 +168,59 @@ class Settings:
         
         if missing:
             raise ValueError(f"Missing required environment variables: {', '.join(missing)}")
+    
+    @classmethod
+    def openai_endpoints(cls) -> List[Dict[str, Any]]:
+        """
+        Get the Azure OpenAI endpoints that requests are spread over.
+        
+        AZURE_OPENAI_ENDPOINTS holds a JSON list of objects with an
+        `endpoint` URL and, optionally, `name`, `api_key`, `deployment`,
+        `text_deployment`, `weight`, `tpm_limit` and `rpm_limit`; missing
+        fields fall back to the single-endpoint settings. Without it, the
+        pool is AZURE_OPENAI_ENDPOINT alone.
+        
+        Returns:
+            One dict per endpoint with every field filled in
+        
+        Raises:
+            ValueError: If AZURE_OPENAI_ENDPOINTS is malformed
+        """
+        if not cls.AZURE_OPENAI_ENDPOINTS:
+            entries: List[Any] = [{"endpoint": cls.AZURE_OPENAI_ENDPOINT}]
+        else:
+            try:
+                entries = json.loads(cls.AZURE_OPENAI_ENDPOINTS)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"AZURE_OPENAI_ENDPOINTS is not valid JSON: {e}") from e
+            if not isinstance(entries, list) or not entries:
+                raise ValueError("AZURE_OPENAI_ENDPOINTS must be a non-empty JSON list")
+        
+        endpoints: List[Dict[str, Any]] = []
+        for index, entry in enumerate(entries):
+            if not isinstance(entry, dict) or (cls.AZURE_OPENAI_ENDPOINTS and not entry.get("endpoint")):
+                raise ValueError(f"AZURE_OPENAI_ENDPOINTS[{index}] must be an object with an 'endpoint' URL")
+            deployment = entry.get("deployment") or cls.AZURE_OPENAI_DEPLOYMENT
+            host = urlparse(entry["endpoint"]).hostname or "default"
+            endpoint = {
+                "name": str(entry.get("name") or f"{host}/{deployment}"),
+                "endpoint": entry["endpoint"],
+                "api_key": entry.get("api_key") or cls.AZURE_OPENAI_API_KEY,
+                "deployment": deployment,
+                "text_deployment": (
+                    entry.get("text_deployment") or entry.get("deployment")
+                    or cls.AZURE_OPENAI_TEXT_DEPLOYMENT or deployment
+                ),
+                "weight": float(entry.get("weight", 1)),
+                "tpm_limit": int(entry.get("tpm_limit", cls.AZURE_OPENAI_TPM_LIMIT)),
+                "rpm_limit": int(entry.get("rpm_limit", cls.AZURE_OPENAI_RPM_LIMIT)),
+            }
+            if endpoint["weight"] <= 0:
+                raise ValueError(f"AZURE_OPENAI_ENDPOINTS[{index}] weight must be positive")
+            if any(other["name"] == endpoint["name"] for other in endpoints):
+                raise ValueError(f"AZURE_OPENAI_ENDPOINTS has two endpoints named '{endpoint['name']}'")
+            endpoints.append(endpoint)
+        return endpoints
 
 
 # Global settings instance
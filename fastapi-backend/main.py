@@ -3,13 +3,85 @@ Azure OpenAI Diagram Service - FastAPI Application
 A professional, modular FastAPI application for generating Azure architecture diagrams.
 """
 
+import time
+
+# Taken before anything else is imported, to measure the application's import time
+_import_started = time.perf_counter()
+
+import asyncio
+import contextlib
+from contextlib import asynccontextmanager
 from pathlib import Path
+from typing import List
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 
 from config.settings import settings
-from api.endpoints import chat_endpoint, download_endpoint
+from api.middleware import MetricsMiddleware
+from api.endpoints import (
+    chat_endpoint,
+    chat_stream_endpoint,
+    chat_batch_endpoint,
+    download_endpoint,
+    diagram_file_endpoint,
+    diagram_spec_endpoint,
+    patch_diagram_endpoint,
+    create_diagram_job_endpoint,
+    diagram_job_endpoint,
+    cancel_diagram_job_endpoint,
+    cache_stats_endpoint,
+    llm_endpoints_endpoint,
+    create_session_endpoint,
+    session_endpoint,
+    delete_session_endpoint,
+    metrics_endpoint,
+    readiness_endpoint,
+)
+from services.azure_openai import azure_openai_service
+from services.diagram_jobs import diagram_jobs
+from services.icon_registry import icon_registry
+from services.icon_search import icon_search
+from services.render_pool import render_pool
+from services.warmup import WarmUpStep, warm_up
+
+
+def warm_up_steps() -> List[WarmUpStep]:
+    """Get the start-up warm-up steps for the current settings."""
+    steps: List[WarmUpStep] = [
+        ("icon_registry", lambda: asyncio.to_thread(icon_registry.load)),
+        ("render_pool", render_pool.warm_up),
+        ("azure_openai", lambda: azure_openai_service.warm_up(connect=settings.WARMUP_CONNECT)),
+    ]
+    if settings.ICON_RETRIEVAL_ENABLED:
+        steps.append(("icon_index", lambda: asyncio.to_thread(icon_search.build)))
+    return steps
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Manage resources that live for the duration of the application."""
+    # Validate configuration
+    settings.validate()
+    
+    # Services create their expensive parts on first use; warming them up in
+    # the background lets the server answer probes at once, and /ready tells
+    # when the first diagram no longer pays for them
+    warm_up_task = None
+    if settings.WARMUP_ENABLED:
+        warm_up_task = asyncio.create_task(warm_up.run(warm_up_steps()))
+    else:
+        warm_up.skip()
+    yield
+    if warm_up_task is not None:
+        warm_up_task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await warm_up_task
+    
+    # Release pooled Azure OpenAI connections, job workers and render workers on shutdown
+    await azure_openai_service.aclose()
+    await diagram_jobs.shutdown()
+    render_pool.shutdown()
 
 
 def create_application() -> FastAPI:
@@ -19,9 +91,6 @@ def create_application() -> FastAPI:
     Returns:
         Configured FastAPI application instance
     """
-    # Validate configuration
-    settings.validate()
-    
     # Create FastAPI app
     app = FastAPI(
         title="Azure OpenAI Diagram Service",
@@ -29,6 +98,7 @@ def create_application() -> FastAPI:
         version="1.0.0",
         docs_url="/docs" if settings.DEBUG else None,
         redoc_url="/redoc" if settings.DEBUG else None,
+        lifespan=lifespan,
     )
     
     # Configure CORS
@@ -40,16 +110,39 @@ def create_application() -> FastAPI:
         allow_headers=["*"],
     )
     
+    # Time requests and their stages
+    if settings.METRICS_ENABLED:
+        app.add_middleware(MetricsMiddleware, server_timing=settings.SERVER_TIMING_ENABLED)
+    
     # Ensure static directory exists
     static_path = Path(settings.DIAGRAM_OUTPUT_DIR)
     static_path.mkdir(parents=True, exist_ok=True)
     
+    # Diagrams are served from the diagram store; this route is registered
+    # ahead of the static mount so it takes precedence for their URLs
+    app.get("/static/diagrams/{filename}", summary="View generated diagram")(diagram_file_endpoint)
+    
     # Mount static files
     app.mount("/static", StaticFiles(directory="static"), name="static")
     
     # Register routes
     app.post("/chat", summary="Chat with Azure AI Assistant")(chat_endpoint)
+    app.post("/chat/stream", summary="Stream a chat response as Server-Sent Events")(chat_stream_endpoint)
+    app.post("/chat/batch", summary="Answer several prompts concurrently")(chat_batch_endpoint)
     app.get("/download/{filename}", summary="Download generated diagram")(download_endpoint)
+    app.post("/diagrams/jobs", status_code=202, summary="Queue a diagram for background rendering")(create_diagram_job_endpoint)
+    app.get("/diagrams/jobs/{job_id}", summary="Diagram job status")(diagram_job_endpoint)
+    app.post("/diagrams/jobs/{job_id}/cancel", summary="Cancel a diagram job")(cancel_diagram_job_endpoint)
+    app.get("/diagrams/{diagram_id}", summary="Spec of a rendered diagram")(diagram_spec_endpoint)
+    app.patch("/diagrams/{diagram_id}", summary="Edit a diagram with a JSON Patch")(patch_diagram_endpoint)
+    app.post("/sessions", status_code=201, summary="Start a chat session")(create_session_endpoint)
+    app.get("/sessions/{session_id}", summary="Chat session history and current diagram")(session_endpoint)
+    app.delete("/sessions/{session_id}", status_code=204, summary="End a chat session")(delete_session_endpoint)
+    app.get("/cache/stats", summary="Completion cache statistics")(cache_stats_endpoint)
+    app.get("/llm/endpoints", summary="Azure OpenAI endpoint routing statistics")(llm_endpoints_endpoint)
+    app.get("/ready", summary="Readiness after start-up warm-up")(readiness_endpoint)
+    if settings.METRICS_ENABLED:
+        app.get("/metrics", summary="Prometheus metrics")(metrics_endpoint)
     
     # Root endpoint
     @app.get("/", summary="API Health Check")
@@ -67,6 +160,7 @@ def create_application() -> FastAPI:
 
 # Create the application instance
 app = create_application()
+warm_up.import_seconds = time.perf_counter() - _import_started
 
 
 if __name__ == "__main__":
@@ -0,0 +1,145 @@
+"""
+Typed DiagramSpec models, mirroring the render_azure_architecture tool in schemas/tools.py.
+"""
+
+from typing import Any, Dict, Iterator, List, Literal, Optional, Tuple
+
+from pydantic import BaseModel, ConfigDict, Field, ValidationError
+
+from config.settings import settings
+
+# Labels are cut to this length when a spec is canonicalized
+MAX_LABEL_LENGTH = 120
+
+
+class SpecValidationError(ValueError):
+    """A diagram specification that failed validation, with every problem found in it."""
+    
+    def __init__(self, errors: List[str]):
+        """
+        Initialize the error.
+        
+        Args:
+            errors: One message per problem, prefixed with its location,
+                e.g. "nodes[3].id: Field required"
+        """
+        super().__init__("Invalid diagram spec: " + "; ".join(errors))
+        self.errors = errors
+
+
+class ClusterSpec(BaseModel):
+    """A group of nodes drawn inside one box."""
+    model_config = ConfigDict(extra="ignore")
+    
+    id: str = Field(..., min_length=1)
+    label: Optional[str] = Field(None, max_length=MAX_LABEL_LENGTH)
+
+
+class NodeSpec(BaseModel):
+    """A resource drawn with an icon."""
+    model_config = ConfigDict(extra="ignore")
+    
+    id: str = Field(..., min_length=1)
+    label: Optional[str] = Field(None, max_length=MAX_LABEL_LENGTH)
+    icon: str = Field(..., min_length=1, description="diagrams class path")
+    cluster: Optional[str] = Field(None, description="Id of the cluster the node is drawn in")
+
+
+class EdgeSpec(BaseModel):
+    """A connection between two nodes."""
+    model_config = ConfigDict(extra="ignore")
+    
+    source: str = Field(..., min_length=1)
+    target: str = Field(..., min_length=1)
+    label: Optional[str] = Field(None, max_length=MAX_LABEL_LENGTH)
+
+
+class DiagramSpec(BaseModel):
+    """A full diagram specification."""
+    model_config = ConfigDict(extra="ignore")
+    
+    title: str = "Azure Architecture"
+    direction: Literal["LR", "TB", "RL", "BT"] = "LR"
+    clusters: List[ClusterSpec] = Field(default_factory=list)
+    nodes: List[NodeSpec] = Field(default_factory=list, max_length=settings.MAX_NODES)
+    edges: List[EdgeSpec] = Field(default_factory=list, max_length=settings.MAX_EDGES)
+
+
+def validate_diagram_spec(spec: Any) -> DiagramSpec:
+    """
+    Validate a diagram specification in one pass.
+    
+    Field errors come from the DiagramSpec model; duplicate ids and edges to
+    unknown nodes are checked on the raw spec, so they are reported together
+    with field errors instead of only after those are fixed. Nodes may name
+    clusters that are not declared: those are drawn as clusters labelled
+    with their id.
+    
+    Args:
+        spec: The diagram specification
+    
+    Returns:
+        The validated model
+    
+    Raises:
+        SpecValidationError: With every problem found
+    """
+    errors: List[str] = []
+    model: Optional[DiagramSpec] = None
+    try:
+        model = DiagramSpec.model_validate(spec)
+    except ValidationError as e:
+        errors.extend(_format_error(error) for error in e.errors())
+    if isinstance(spec, dict):
+        errors.extend(reference_errors(spec))
+    if errors or model is None:
+        raise SpecValidationError(errors)
+    return model
+
+
+def reference_errors(spec: Dict[str, Any]) -> List[str]:
+    """
+    Find duplicate ids and edges to unknown nodes.
+    
+    Args:
+        spec: The diagram specification; malformed items are skipped
+    
+    Returns:
+        One message per problem
+    """
+    errors: List[str] = []
+    for key in ("clusters", "nodes"):
+        seen = set()
+        for index, item in _items(spec, key):
+            item_id = item.get("id")
+            if not isinstance(item_id, str) or not item_id:
+                continue
+            if item_id in seen:
+                errors.append(f"{key}[{index}].id: Duplicate id '{item_id}'")
+            seen.add(item_id)
+    
+    node_ids = {n.get("id") for _, n in _items(spec, "nodes")}
+    for index, edge in _items(spec, "edges"):
+        for end in ("source", "target"):
+            ref = edge.get(end)
+            if isinstance(ref, str) and ref and ref not in node_ids:
+                errors.append(f"edges[{index}].{end}: Unknown node '{ref}'")
+    return errors
+
+
+def _items(spec: Dict[str, Any], key: str) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    """Enumerate the object items of a spec list, skipping anything else."""
+    items = spec.get(key)
+    if not isinstance(items, list):
+        return
+    for index, item in enumerate(items):
+        if isinstance(item, dict):
+            yield index, item
+
+
+def _format_error(error: Dict[str, Any]) -> str:
+    """Format a pydantic error as "nodes[3].id: message"."""
+    location = ""
+    for part in error.get("loc", ()):
+        location += f"[{part}]" if isinstance(part, int) else (f".{part}" if location else str(part))
+    return f"{location or 'spec'}: {error['msg']}"
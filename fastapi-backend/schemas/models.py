@@ -2,19 +2,21 @@
 Request and response models for the API.
 """
 
-from typing import Optional, Union
+from typing import List, Optional, Union
 from pydantic import BaseModel, Field
 
 
 class ChatRequest(BaseModel):
     """Request model for chat endpoint."""
     prompt: str = Field(..., description="User prompt/question", min_length=1)
+    session_id: Optional[str] = Field(None, description="Chat session to continue, from POST /sessions")
 
 
 class TextResponse(BaseModel):
     """Response model for text-based answers."""
     type: str = Field(default="text", description="Response type")
     answer: str = Field(..., description="Assistant's text response")
+    session_id: Optional[str] = Field(None, description="Chat session the answer belongs to")
 
 
 class DiagramSummary(BaseModel):
@@ -32,9 +34,24 @@ class DiagramResponse(BaseModel):
     answer: str = Field(default="Diagram generated.", description="Status message")
     url: str = Field(..., description="URL to access the generated diagram")
     download: str = Field(..., description="Download URL for the diagram")
+    format: str = Field(default="png", description="Diagram format: png, preview, svg or pdf")
     summary: Optional[DiagramSummary] = Field(None, description="Diagram summary information")
+    id: Optional[str] = Field(None, description="Diagram id, for reading and patching its spec under /diagrams/{id}")
+    repairs: List[str] = Field(default_factory=list, description="Problems in the spec that were fixed automatically")
     raw: Optional[str] = Field(None, description="Raw tool call content (for debugging)")
     saved: Optional[str] = Field(None, description="Local file path where diagram is saved")
+    session_id: Optional[str] = Field(None, description="Chat session the diagram belongs to")
+
+
+class DiagramJobResponse(BaseModel):
+    """Response model for diagrams handed to the background job queue."""
+    type: str = Field(default="diagram_job", description="Response type")
+    answer: str = Field(default="Diagram rendering queued.", description="Status message")
+    job: str = Field(..., description="Diagram job id")
+    status: str = Field(..., description="Job status at submission time")
+    status_url: str = Field(..., description="URL to poll for the job status and result")
+    raw: Optional[str] = Field(None, description="Raw tool call content (for debugging)")
+    session_id: Optional[str] = Field(None, description="Chat session the diagram belongs to")
 
 
 class ErrorResponse(BaseModel):
@@ -43,4 +60,4 @@ class ErrorResponse(BaseModel):
 
 
 # Union type for all possible responses
-ChatResponse = Union[TextResponse, DiagramResponse]
\ No newline at end of file
+ChatResponse = Union[TextResponse, DiagramResponse, DiagramJobResponse]
\ No newline at end of file
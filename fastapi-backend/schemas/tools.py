@@ -4,9 +4,41 @@ Tool definitions for Azure OpenAI function calling.
 
 from typing import Dict, Any, List
 
+from services.compact_spec import ICON_CODES
 
-def get_diagram_tool_definition() -> List[Dict[str, Any]]:
-    """Get the diagram rendering tool definition for Azure OpenAI."""
+# Tool spec versions: 1 is the full DiagramSpec, 2 the compact dialect of
+# services.compact_spec with terse keys and icon codes
+TOOL_SPEC_VERSIONS = (1, 2)
+
+ICON_CODES_DESCRIPTION = (
+    "Icon codes: " + ", ".join(f"{code}={path.rpartition('.')[2]}" for code, path in ICON_CODES.items()) + "."
+)
+
+
+def get_diagram_tool_definition(compact: bool = False, spec_version: int = 1) -> List[Dict[str, Any]]:
+    """
+    Get the diagram rendering tool definition for Azure OpenAI.
+    
+    Args:
+        compact: Leave the icon examples out of the node description, for
+            requests that list the icons relevant to the prompt instead
+        spec_version: 1 for the full DiagramSpec, 2 for the compact dialect
+    
+    Raises:
+        ValueError: If the spec version is unknown
+    """
+    if spec_version not in TOOL_SPEC_VERSIONS:
+        raise ValueError(f"Unknown tool spec version {spec_version} (expected 1 or 2)")
+    if spec_version == 2:
+        return [_compact_diagram_tool_definition()]
+    if compact:
+        nodes_description = "Nodes to draw. Each node.icon MUST be a diagrams class path, e.g. 'diagrams.azure.web.AppServices'."
+    else:
+        nodes_description = (
+            "Nodes to draw. Each node.icon MUST be a diagrams class path like "
+            "'diagrams.azure.web.AppServices', 'diagrams.azure.database.SQLDatabases', "
+            "'diagrams.azure.ml.AzureOpenAI', or 'diagrams.onprem.client.User'."
+        )
     return [
         {
             "type": "function",
@@ -36,11 +68,7 @@ def get_diagram_tool_definition() -> List[Dict[str, Any]]:
                         },
                         "nodes": {
                             "type": "array",
-                            "description": (
-                                "Nodes to draw. Each node.icon MUST be a diagrams class path like "
-                                "'diagrams.azure.web.AppServices', 'diagrams.azure.database.SQLDatabases', "
-                                "'diagrams.azure.ml.AzureOpenAI', or 'diagrams.onprem.client.User'."
-                            ),
+                            "description": nodes_description,
                             "items": {
                                 "type": "object",
                                 "properties": {
@@ -70,4 +98,134 @@ def get_diagram_tool_definition() -> List[Dict[str, Any]]:
                 }
             }
         }
-    ]
\ No newline at end of file
+    ]
+
+
+def _compact_diagram_tool_definition() -> Dict[str, Any]:
+    """Get the diagram rendering tool in the compact dialect (tool spec version 2)."""
+    strings = {"type": "array", "items": {"type": "string"}}
+    return {
+        "type": "function",
+        "function": {
+            "name": "render_azure_architecture",
+            "description": (
+                "Render an Azure architecture diagram using mingrammer/diagrams from a compact spec. "
+                "Call this when the user asks for an Azure architecture/diagram/visual/drawing."
+            ),
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "t": {"type": "string", "description": "Title. Keep it short."},
+                    "d": {"type": "string", "enum": ["LR", "TB", "RL", "BT"], "description": "Direction (default LR)."},
+                    "c": {"type": "array", "description": "Clusters: [id, label].", "items": strings},
+                    "n": {
+                        "type": "array",
+                        "description": (
+                            "Nodes: [id, icon, label, cluster]; label and cluster are optional. "
+                            "icon is an icon code or, for other services, a diagrams class name such as "
+                            "'EventGridDomains'. " + ICON_CODES_DESCRIPTION
+                        ),
+                        "items": strings
+                    },
+                    "e": {
+                        "type": "array",
+                        "description": "Edges: [source id, target id, label]; label is optional.",
+                        "items": strings
+                    }
+                },
+                "required": ["n"]
+            }
+        }
+    }
+
+
+def get_diagram_edit_tool_definition(spec_version: int = 1) -> Dict[str, Any]:
+    """
+    Get the tool definition for editing the diagram of a chat session.
+    
+    Args:
+        spec_version: See get_diagram_tool_definition(); with 2, icons may be
+            given as icon codes
+    """
+    if spec_version == 2:
+        icon_description = "icon code or diagrams class name, as for render_azure_architecture"
+    else:
+        icon_description = "diagrams class path, e.g. 'diagrams.azure.database.CacheForRedis'"
+    node_properties = {
+        "id": {"type": "string"},
+        "label": {"type": "string"},
+        "icon": {"type": "string", "description": icon_description},
+        "cluster": {"type": "string"}
+    }
+    edge_properties = {
+        "source": {"type": "string"},
+        "target": {"type": "string"},
+        "label": {"type": "string"}
+    }
+    return {
+        "type": "function",
+        "function": {
+            "name": "edit_azure_architecture",
+            "description": (
+                "Change the current diagram of this conversation. List only what changes; "
+                "everything not mentioned is kept. Prefer this over re-rendering the whole diagram "
+                "when the user asks to add, remove, rename or reconnect parts of it."
+            ),
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "title": {"type": "string", "description": "New title, if it changes."},
+                    "direction": {"type": "string", "enum": ["LR", "TB", "RL", "BT"]},
+                    "add_clusters": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "properties": {"id": {"type": "string"}, "label": {"type": "string"}},
+                            "required": ["id"]
+                        }
+                    },
+                    "remove_clusters": {
+                        "type": "array",
+                        "description": "Cluster ids to remove; their nodes are kept outside any cluster.",
+                        "items": {"type": "string"}
+                    },
+                    "add_nodes": {
+                        "type": "array",
+                        "items": {"type": "object", "properties": node_properties, "required": ["id", "icon"]}
+                    },
+                    "update_nodes": {
+                        "type": "array",
+                        "description": "Existing nodes by id with only the fields that change.",
+                        "items": {"type": "object", "properties": node_properties, "required": ["id"]}
+                    },
+                    "remove_nodes": {
+                        "type": "array",
+                        "description": "Node ids to remove, together with their edges.",
+                        "items": {"type": "string"}
+                    },
+                    "add_edges": {
+                        "type": "array",
+                        "items": {"type": "object", "properties": edge_properties, "required": ["source", "target"]}
+                    },
+                    "remove_edges": {
+                        "type": "array",
+                        "items": {"type": "object", "properties": edge_properties, "required": ["source", "target"]}
+                    }
+                }
+            }
+        }
+    }
+
+
+def get_session_tool_definitions(compact: bool = False, spec_version: int = 1) -> List[Dict[str, Any]]:
+    """
+    Get the tools offered in chat sessions.
+    
+    Both tools are always sent, whether or not the session has a diagram yet,
+    so the tool block stays identical across the turns of a session.
+    
+    Args:
+        compact: See get_diagram_tool_definition()
+        spec_version: See get_diagram_tool_definition()
+    """
+    return get_diagram_tool_definition(compact, spec_version) + [get_diagram_edit_tool_definition(spec_version)]
\ No newline at end of file
@@ -0,0 +1,532 @@
+"""
+Token-aware admission control with an adaptive concurrency limit for Azure OpenAI requests.
+"""
+
+import asyncio
+import contextlib
+import json
+import math
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Deque, Dict, Iterator, Optional, Tuple
+
+from openai import APIStatusError
+
+from services.metrics import LLM_ADMISSIONS, LLM_THROTTLED, record_stage
+from services.resilience import retry_after_seconds
+
+# Priorities, most urgent first: interactive requests are admitted ahead of batch work
+INTERACTIVE = "interactive"
+BATCH = "batch"
+PRIORITIES = (INTERACTIVE, BATCH)
+
+# Rough size of a token in characters of JSON, for estimating prompt tokens
+CHARS_PER_TOKEN = 4
+
+_priority: ContextVar[str] = ContextVar("llm_priority", default=INTERACTIVE)
+
+
+@contextlib.contextmanager
+def admission_priority(priority: str) -> Iterator[None]:
+    """
+    Set the priority of the Azure OpenAI requests made within a block.
+    
+    Tasks started in the block inherit the priority.
+    
+    Args:
+        priority: INTERACTIVE or BATCH
+    """
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority() -> str:
+    """Get the priority of requests made by the current task."""
+    return _priority.get()
+
+
+class AdmissionRejectedError(Exception):
+    """Raised when a request is shed or waits too long for admission."""
+    
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """
+    Client-side copy of a per-minute quota.
+    
+    The bucket refills at the quota's rate and holds `burst_seconds` worth
+    of it, since Azure OpenAI enforces quotas over short windows rather
+    than whole minutes. A request larger than the bucket waits for a full
+    bucket and leaves it in debt, which later requests wait out.
+    """
+    
+    def __init__(self, per_minute: float, burst_seconds: float = 10.0):
+        """
+        Initialize a full bucket.
+        
+        Args:
+            per_minute: Quota per minute
+            burst_seconds: Seconds of quota the bucket holds
+        """
+        self.rate = per_minute / 60
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+    
+    def available(self) -> float:
+        """Get the tokens in the bucket; negative while in debt."""
+        self._refill()
+        return self.tokens
+    
+    def time_until(self, cost: float) -> float:
+        """Get the seconds until a request of the given cost can be taken."""
+        missing = min(cost, self.capacity) - self.available()
+        return max(0.0, missing / self.rate)
+    
+    def take(self, cost: float) -> None:
+        """Take a request's cost from the bucket."""
+        self._refill()
+        self.tokens -= cost
+    
+    def adjust(self, tokens: float) -> None:
+        """Give back (or, if negative, take) tokens once a request's actual cost is known."""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + tokens)
+    
+    def drain(self) -> None:
+        """Empty the bucket after the upstream said the quota is used up."""
+        self._refill()
+        self.tokens = min(self.tokens, 0.0)
+    
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+
+class AdaptiveLimit:
+    """
+    Concurrency limit adjusted by additive increase, multiplicative decrease (AIMD).
+    
+    A successful request raises the limit by 1/limit, so by about one per
+    round trip of a full window, as long as the limit is in use. A 429, or
+    a latency more than `latency_tolerance` times the usual latency of its
+    kind, cuts the limit by `backoff`. Requests admitted before the last cut
+    do not count towards another, so one burst of 429s cuts the limit once.
+    """
+    
+    def __init__(
+        self,
+        initial: int,
+        minimum: int,
+        maximum: int,
+        latency_tolerance: float = 2.0,
+        backoff: float = 0.5,
+        min_samples: int = 20
+    ):
+        """
+        Initialize the limit.
+        
+        Args:
+            initial: Starting limit
+            minimum: Lowest limit
+            maximum: Highest limit
+            latency_tolerance: Multiple of the usual latency that counts as
+                overload; 0 turns latency signals off
+            backoff: Factor the limit is multiplied by on overload
+            min_samples: Latencies of a kind observed before they are judged
+        """
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = float(min(self.maximum, max(self.minimum, initial)))
+        self.latency_tolerance = latency_tolerance
+        self.backoff = backoff
+        self.min_samples = min_samples
+        self.baselines: Dict[str, Tuple[float, int]] = {}
+        self._decreased_at = float("-inf")
+    
+    @property
+    def current(self) -> int:
+        """The limit as a number of concurrent requests."""
+        return max(self.minimum, int(self.limit))
+    
+    def on_success(self, kind: str, latency: float, admitted_at: float, saturated: bool) -> None:
+        """
+        Adjust the limit after a successful request.
+        
+        Args:
+            kind: Kind of request; kinds have separate usual latencies
+            latency: Seconds the request took
+            admitted_at: monotonic() time the request was admitted
+            saturated: Whether at least half the limit was in use when it was admitted
+        """
+        average, samples = self.baselines.get(kind, (latency, 0))
+        # Slow-moving average, so a latency spike stands out against it
+        self.baselines[kind] = (average + (latency - average) * 0.05, samples + 1)
+        if (
+            self.latency_tolerance > 0
+            and samples >= self.min_samples
+            and latency > average * self.latency_tolerance
+        ):
+            self.on_overload(admitted_at)
+        elif saturated:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+    
+    def on_overload(self, admitted_at: float) -> None:
+        """Cut the limit after a request admitted at `admitted_at` was throttled or slow."""
+        if admitted_at < self._decreased_at:
+            return
+        self.limit = max(self.minimum, self.limit * self.backoff)
+        self._decreased_at = time.monotonic()
+
+
+class Ticket:
+    """An admitted request, to be passed to AdmissionController.release() when it ends."""
+    
+    __slots__ = ("priority", "kind", "tokens", "admitted_at", "saturated", "usage_tokens", "released")
+    
+    def __init__(self, priority: str, kind: str, tokens: int, saturated: bool):
+        self.priority = priority
+        self.kind = kind
+        self.tokens = tokens
+        self.admitted_at = time.monotonic()
+        self.saturated = saturated
+        # Set from the completion's usage, to correct the quota estimate
+        self.usage_tokens: Optional[Tuple[int, int]] = None
+        self.released = False
+
+
+class _Waiter:
+    """A request queued for admission."""
+    
+    __slots__ = ("priority", "kind", "tokens", "future")
+    
+    def __init__(self, priority: str, kind: str, tokens: int, future: asyncio.Future):
+        self.priority = priority
+        self.kind = kind
+        self.tokens = tokens
+        self.future = future
+
+
+class AdmissionController:
+    """
+    Admits Azure OpenAI requests within the deployment's quotas and an adaptive concurrency limit.
+    
+    Each request's token cost is estimated from its messages and tool
+    schema plus the completion length usually seen for its kind, and taken
+    from client-side TPM and RPM buckets before it is sent, so requests wait
+    here instead of being answered with 429s. Estimates are corrected with
+    the usage Azure reports. Requests that cannot go yet queue by priority,
+    interactive before batch and first come, first served within one; when
+    the queue is full the newest lower-priority request is shed, or the
+    arriving one rejected. A 429 pauses admission for its Retry-After,
+    empties the TPM bucket and cuts the concurrency limit.
+    """
+    
+    def __init__(
+        self,
+        limit: AdaptiveLimit,
+        tpm_limit: float = 0,
+        rpm_limit: float = 0,
+        queue_depth: int = 200,
+        max_wait: float = 15.0,
+        expected_completion_tokens: int = 800,
+        enabled: bool = True
+    ):
+        """
+        Initialize the controller.
+        
+        Args:
+            limit: Adaptive concurrency limit
+            tpm_limit: Deployment's tokens-per-minute quota; 0 for none
+            rpm_limit: Deployment's requests-per-minute quota; 0 for none
+            queue_depth: Most requests waiting for admission
+            max_wait: Longest wait for admission in seconds
+            expected_completion_tokens: Completion length assumed for a kind
+                of request until completions of that kind have been seen
+            enabled: Whether requests are controlled at all
+        """
+        self.limit = limit
+        self.tpm = TokenBucket(tpm_limit) if tpm_limit > 0 else None
+        self.rpm = TokenBucket(rpm_limit) if rpm_limit > 0 else None
+        self.queue_depth = max(0, queue_depth)
+        self.max_wait = max_wait
+        self.expected_completion_tokens = expected_completion_tokens
+        self.enabled = enabled
+        self.in_flight = 0
+        self.queues: Dict[str, Deque[_Waiter]] = {priority: deque() for priority in PRIORITIES}
+        self.completion_tokens: Dict[str, float] = {}
+        self._paused_until = 0.0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tools_chars: Dict[int, Tuple[Any, int]] = {}
+    
+    def queued(self, priority: Optional[str] = None) -> int:
+        """Get the number of queued requests, of one priority or in total."""
+        if priority is not None:
+            return len(self.queues[priority])
+        return sum(len(queue) for queue in self.queues.values())
+    
+    def paused_for(self) -> float:
+        """Get the seconds admission stays paused after a 429."""
+        return max(0.0, self._paused_until - time.monotonic())
+    
+    def estimate_tokens(self, request: Dict[str, Any], kind: str) -> int:
+        """
+        Estimate what a request costs against the TPM quota.
+        
+        Args:
+            request: Chat completion request
+            kind: Kind of request, for its expected completion length
+        
+        Returns:
+            Estimated prompt plus completion tokens
+        """
+        chars = len(json.dumps(request.get("messages", []), separators=(",", ":"), ensure_ascii=False))
+        tools = request.get("tools")
+        if tools:
+            # Tool schemas are the same objects on every request; size them once
+            cached = self._tools_chars.get(id(tools))
+            if cached is None or cached[0] is not tools:
+                cached = (tools, len(json.dumps(tools, separators=(",", ":"))))
+                self._tools_chars[id(tools)] = cached
+            chars += cached[1]
+        completion = self.completion_tokens.get(kind, self.expected_completion_tokens)
+        if request.get("max_tokens"):
+            completion = min(completion, request["max_tokens"])
+        return math.ceil(chars / CHARS_PER_TOKEN + completion)
+    
+    async def acquire(self, request: Dict[str, Any], kind: str, priority: Optional[str] = None) -> Ticket:
+        """
+        Wait until a request may be sent.
+        
+        Args:
+            request: Chat completion request
+            kind: Kind of request, e.g. "diagram"
+            priority: INTERACTIVE or BATCH (defaults to the current task's)
+        
+        Returns:
+            Ticket to pass to release() when the request ends
+        
+        Raises:
+            AdmissionRejectedError: If the request was shed or waited too long
+        """
+        priority = priority or current_priority()
+        tokens = self.estimate_tokens(request, kind)
+        if not self.enabled:
+            return Ticket(priority, kind, tokens, False)
+        
+        if not self._waiting_ahead(priority) and self._admit_delay(tokens) == 0:
+            LLM_ADMISSIONS.inc(priority=priority, outcome="admitted")
+            return self._grant(priority, kind, tokens)
+        
+        if self.queued() >= self.queue_depth:
+            victim = self._newest_below(priority)
+            if victim is None:
+                LLM_ADMISSIONS.inc(priority=priority, outcome="rejected")
+                raise AdmissionRejectedError("Too many Azure OpenAI requests queued", self._retry_after())
+            self.queues[victim.priority].remove(victim)
+            LLM_ADMISSIONS.inc(priority=victim.priority, outcome="shed")
+            victim.future.set_exception(
+                AdmissionRejectedError("Shed in favour of a more urgent request", self._retry_after())
+            )
+        
+        waiter = _Waiter(priority, kind, tokens, asyncio.get_running_loop().create_future())
+        self.queues[priority].append(waiter)
+        self._dispatch()
+        started = time.monotonic()
+        try:
+            await asyncio.wait({waiter.future}, timeout=self.max_wait)
+        except BaseException:
+            self._abandon(waiter)
+            raise
+        finally:
+            record_stage("admission", time.monotonic() - started)
+        if not waiter.future.done():
+            self._abandon(waiter)
+            LLM_ADMISSIONS.inc(priority=priority, outcome="timeout")
+            raise AdmissionRejectedError(
+                f"No Azure OpenAI capacity within {self.max_wait:g}s", self._retry_after()
+            )
+        return waiter.future.result()
+    
+    def release(self, ticket: Ticket, latency: Optional[float] = None, error: Optional[BaseException] = None) -> None:
+        """
+        Return a request's slot and learn from how it went.
+        
+        Args:
+            ticket: The request's ticket; releasing twice has no effect
+            latency: Seconds the request took, if it succeeded
+            error: The error it failed with, if any
+        """
+        if ticket.released:
+            return
+        ticket.released = True
+        if not self.enabled:
+            return
+        self.in_flight -= 1
+        if isinstance(error, APIStatusError) and error.status_code == 429:
+            LLM_THROTTLED.inc()
+            retry_after = retry_after_seconds(error)
+            if retry_after is None:
+                retry_after = 1.0
+            self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+            if self.tpm is not None:
+                self.tpm.drain()
+            self.limit.on_overload(ticket.admitted_at)
+        elif latency is not None:
+            self.limit.on_success(ticket.kind, latency, ticket.admitted_at, ticket.saturated)
+        
+        if ticket.usage_tokens is not None:
+            prompt_tokens, completion_tokens = ticket.usage_tokens
+            if self.tpm is not None:
+                self.tpm.adjust(ticket.tokens - prompt_tokens - completion_tokens)
+            expected = self.completion_tokens.get(ticket.kind, self.expected_completion_tokens)
+            self.completion_tokens[ticket.kind] = expected + (completion_tokens - expected) * 0.1
+        self._dispatch()
+    
+    @contextlib.asynccontextmanager
+    async def admit(
+        self,
+        request: Dict[str, Any],
+        kind: str,
+        priority: Optional[str] = None
+    ) -> AsyncIterator[Ticket]:
+        """
+        Run a request once admitted, releasing it when the block exits.
+        
+        Set `usage_tokens` on the ticket to (prompt, completion) tokens from
+        the completion's usage so the estimate is corrected.
+        
+        Args:
+            request: Chat completion request
+            kind: Kind of request
+            priority: INTERACTIVE or BATCH (defaults to the current task's)
+        """
+        ticket = await self.acquire(request, kind, priority)
+        try:
+            yield ticket
+        except asyncio.CancelledError:
+            self.release(ticket)
+            raise
+        except Exception as e:
+            self.release(ticket, error=e)
+            raise
+        self.release(ticket, latency=time.monotonic() - ticket.admitted_at)
+    
+    def _abandon(self, waiter: _Waiter) -> None:
+        """Take a request that stopped waiting out of the queue, or give back what it was granted."""
+        if not waiter.future.done():
+            self.queues[waiter.priority].remove(waiter)
+            waiter.future.cancel()
+            # It may have been holding up the requests behind it
+            self._dispatch()
+        elif not waiter.future.cancelled() and waiter.future.exception() is None:
+            self.release(waiter.future.result())
+    
+    def _waiting_ahead(self, priority: str) -> bool:
+        """Whether requests of the same or a higher priority are queued."""
+        for queued_priority in PRIORITIES:
+            if self.queues[queued_priority]:
+                return True
+            if queued_priority == priority:
+                return False
+        return False
+    
+    def _newest_below(self, priority: str) -> Optional[_Waiter]:
+        """Get the most recently queued request of a lower priority, to shed."""
+        for queued_priority in reversed(PRIORITIES):
+            if queued_priority == priority:
+                return None
+            if self.queues[queued_priority]:
+                return self.queues[queued_priority][-1]
+        return None
+    
+    def _admit_delay(self, tokens: int) -> Optional[float]:
+        """Get the seconds until a request may be sent, or None while the concurrency limit is reached."""
+        if self.in_flight >= self.limit.current:
+            return None
+        delay = self.paused_for()
+        if self.tpm is not None:
+            delay = max(delay, self.tpm.time_until(tokens))
+        if self.rpm is not None:
+            delay = max(delay, self.rpm.time_until(1))
+        return delay
+    
+    def _grant(self, priority: str, kind: str, tokens: int) -> Ticket:
+        """Take a request's slot and quota."""
+        if self.tpm is not None:
+            self.tpm.take(tokens)
+        if self.rpm is not None:
+            self.rpm.take(1)
+        ticket = Ticket(priority, kind, tokens, saturated=self.in_flight * 2 >= self.limit.current)
+        self.in_flight += 1
+        return ticket
+    
+    def _dispatch(self) -> None:
+        """Admit queued requests in priority order while there is room."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while True:
+            waiter = next((queue[0] for queue in self.queues.values() if queue), None)
+            if waiter is None:
+                return
+            delay = self._admit_delay(waiter.tokens)
+            if delay is None:
+                # release() dispatches again
+                return
+            if delay > 0:
+                self._timer = asyncio.get_running_loop().call_later(delay, self._dispatch)
+                return
+            self.queues[waiter.priority].popleft()
+            LLM_ADMISSIONS.inc(priority=waiter.priority, outcome="queued")
+            waiter.future.set_result(self._grant(waiter.priority, waiter.kind, waiter.tokens))
+    
+    def _retry_after(self) -> int:
+        """Whole seconds a rejected client should wait before trying again."""
+        delay = self.paused_for()
+        if self.tpm is not None:
+            delay = max(delay, self.tpm.time_until(self.tpm.capacity / 2))
+        return max(1, math.ceil(delay))
+
+
+class AdmittedStream:
+    """Passes a stream through and releases its admission ticket when it is closed."""
+    
+    def __init__(self, stream: Any, controller: AdmissionController, ticket: Ticket):
+        """
+        Initialize the stream.
+        
+        Args:
+            stream: The live AsyncStream of chunks
+            controller: Controller the ticket came from
+            ticket: The stream's ticket
+        """
+        self.stream = stream
+        self.controller = controller
+        self.ticket = ticket
+        self._finished = False
+    
+    def __aiter__(self) -> AsyncIterator[Any]:
+        return self._chunks()
+    
+    async def close(self) -> None:
+        """Close the live stream and release the ticket."""
+        try:
+            await self.stream.close()
+        finally:
+            latency = time.monotonic() - self.ticket.admitted_at if self._finished else None
+            self.controller.release(self.ticket, latency=latency)
+    
+    async def _chunks(self) -> AsyncIterator[Any]:
+        async for chunk in self.stream:
+            yield chunk
+        # Only streams read to the end tell how long a stream takes
+        self._finished = True
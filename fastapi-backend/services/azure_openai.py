@@ -2,54 +2,489 @@
 Azure OpenAI service for handling chat completions and tool calls.
 """
 
+import asyncio
 import json
-from typing import Dict, Any, Optional
-from openai import AzureOpenAI
+import hashlib
+import time
+from typing import Dict, Any, List, Optional, Tuple
+
+import httpx
+from openai import AsyncAzureOpenAI, DefaultAsyncHttpxClient
+from openai.types.chat import ChatCompletion
 
 from config.settings import settings
-from config.prompts import SYSTEM_PROMPT
-from schemas.tools import get_diagram_tool_definition
+from config.prompts import (
+    COMPACT_SESSION_SYSTEM_PROMPT,
+    COMPACT_SYSTEM_PROMPT,
+    COMPACT_SYSTEM_PROMPT_VERSION,
+    CURRENT_DIAGRAM_PREFIX,
+    ICON_CODE_SESSION_SYSTEM_PROMPT,
+    ICON_CODE_SYSTEM_PROMPT,
+    ICON_CODE_SYSTEM_PROMPT_VERSION,
+    RELEVANT_ICONS_PREFIX,
+    SESSION_SYSTEM_PROMPT,
+    SYSTEM_PROMPT,
+    SYSTEM_PROMPT_VERSION,
+    TEXT_SYSTEM_PROMPT,
+    TEXT_SYSTEM_PROMPT_VERSION,
+)
+from schemas.tools import get_diagram_tool_definition, get_session_tool_definitions
+from services.cassette import Cassette, LatencyModel, RecordingStream, ReplayStream
+from services.completion_cache import CompletionCache
+from services.icon_search import relevant_icons
+from services.admission import PRIORITIES, AdaptiveLimit, AdmissionController, AdmittedStream
+from services.endpoint_pool import EJECTED, HEALTHY, THROTTLED, Endpoint, EndpointPool
+from services.metrics import LLM_TOKENS, metrics
+from services.resilience import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, Resilience, RetryBudget
 
 
 class AzureOpenAIService:
     """Service for handling Azure OpenAI interactions."""
     
     def __init__(self):
-        """Initialize the Azure OpenAI client."""
-        self.client = AzureOpenAI(
-            api_key=settings.AZURE_OPENAI_API_KEY,
-            api_version=settings.AZURE_OPENAI_API_VERSION,
-            azure_endpoint=settings.AZURE_OPENAI_ENDPOINT,
+        """
+        Initialize the service; clients and their connection pool are created on first use.
+        
+        In replay mode (AZURE_OPENAI_MODE=replay) no client is created and
+        completions are served from the cassette, so no credentials are needed.
+        """
+        self.mode = settings.AZURE_OPENAI_MODE
+        self.cassette: Optional[Cassette] = None
+        if self.mode in ("record", "replay"):
+            self.cassette = Cassette(settings.AZURE_OPENAI_CASSETTE)
+        self.replay_latency = LatencyModel.parse(
+            settings.REPLAY_LATENCY, int(settings.REPLAY_SEED) if settings.REPLAY_SEED else None
+        )
+        
+        self.http_client: Optional[httpx.AsyncClient] = None
+        
+        # With icon retrieval the icon examples leave the system prompt and
+        # tool schema; the icons relevant to each prompt are sent with it.
+        # Tool spec version 2 has the model write the compact spec dialect,
+        # whose icon codes replace the examples as well.
+        self.icon_retrieval = settings.ICON_RETRIEVAL_ENABLED
+        self.spec_version = settings.TOOL_SPEC_VERSION
+        self.tools = get_diagram_tool_definition(self.icon_retrieval, self.spec_version)
+        self.session_tools = get_session_tool_definitions(self.icon_retrieval, self.spec_version)
+        if self.spec_version == 2:
+            self.system_prompt = ICON_CODE_SYSTEM_PROMPT
+            self.session_system_prompt = ICON_CODE_SESSION_SYSTEM_PROMPT
+            system_prompt_version = ICON_CODE_SYSTEM_PROMPT_VERSION
+            if self.icon_retrieval:
+                system_prompt_version += f":k{settings.ICON_RETRIEVAL_TOP_K}"
+        elif self.icon_retrieval:
+            self.system_prompt = COMPACT_SYSTEM_PROMPT
+            self.session_system_prompt = COMPACT_SESSION_SYSTEM_PROMPT
+            system_prompt_version = f"{COMPACT_SYSTEM_PROMPT_VERSION}:k{settings.ICON_RETRIEVAL_TOP_K}"
+        else:
+            self.system_prompt = SYSTEM_PROMPT
+            self.session_system_prompt = SESSION_SYSTEM_PROMPT
+            system_prompt_version = SYSTEM_PROMPT_VERSION
+        
+        # Cache keys change whenever the system prompt or tool schema does
+        tools_digest = hashlib.sha256(
+            json.dumps(self.tools, sort_keys=True).encode("utf-8")
+        ).hexdigest()[:12]
+        self.prompt_version = f"{system_prompt_version}:{tools_digest}"
+        self.text_deployment = settings.AZURE_OPENAI_TEXT_DEPLOYMENT or settings.AZURE_OPENAI_DEPLOYMENT
+        self.cache: Optional[CompletionCache] = None
+        if settings.COMPLETION_CACHE_ENABLED:
+            self.cache = CompletionCache(
+                ttl_seconds=settings.COMPLETION_CACHE_TTL_SECONDS,
+                max_bytes=settings.COMPLETION_CACHE_MAX_BYTES,
+            )
+        
+        # Deadlines, retries, hedging and the circuit breaker; the SDK's own
+        # retries are turned off so they stay within the deadline and budget
+        self.resilience = Resilience(
+            deadline=settings.AZURE_OPENAI_TIMEOUT,
+            max_retries=settings.AZURE_OPENAI_MAX_RETRIES,
+            backoff=settings.AZURE_OPENAI_RETRY_BACKOFF_SECONDS,
+            backoff_max=settings.AZURE_OPENAI_RETRY_BACKOFF_MAX_SECONDS,
+            budget=RetryBudget(
+                settings.AZURE_OPENAI_RETRY_BUDGET_RATIO, settings.AZURE_OPENAI_RETRY_BUDGET_MIN_PER_SECOND
+            ),
+            breaker=CircuitBreaker(
+                settings.AZURE_OPENAI_BREAKER_FAILURES, settings.AZURE_OPENAI_BREAKER_RESET_SECONDS
+            ),
+            hedge_enabled=settings.AZURE_OPENAI_HEDGE_ENABLED,
+            hedge_quantile=settings.AZURE_OPENAI_HEDGE_QUANTILE,
+            hedge_min_delay=settings.AZURE_OPENAI_HEDGE_MIN_DELAY_SECONDS,
+            hedge_min_samples=settings.AZURE_OPENAI_HEDGE_MIN_SAMPLES,
+        )
+        
+        # Every attempt, retries and hedges included, goes to the endpoint the
+        # pool picks and is admitted against that deployment's quotas and
+        # adaptive concurrency limit
+        self.pool = EndpointPool(
+            [
+                Endpoint(
+                    name=config["name"],
+                    url=config["endpoint"],
+                    api_key=config["api_key"],
+                    deployment=config["deployment"],
+                    text_deployment=config["text_deployment"],
+                    admission=self._create_admission(config["tpm_limit"], config["rpm_limit"]),
+                    weight=config["weight"],
+                )
+                for config in settings.openai_endpoints()
+            ],
+            eject_failures=settings.AZURE_OPENAI_EJECT_FAILURES,
+            eject_seconds=settings.AZURE_OPENAI_EJECT_SECONDS,
+            eject_max_seconds=settings.AZURE_OPENAI_EJECT_MAX_SECONDS,
+            decay_seconds=settings.AZURE_OPENAI_LATENCY_DECAY_SECONDS,
+        )
+    
+    @staticmethod
+    def _create_admission(tpm_limit: int, rpm_limit: int) -> AdmissionController:
+        """Create the admission control of one deployment."""
+        return AdmissionController(
+            limit=AdaptiveLimit(
+                settings.AZURE_OPENAI_CONCURRENCY_INITIAL,
+                settings.AZURE_OPENAI_CONCURRENCY_MIN,
+                settings.AZURE_OPENAI_CONCURRENCY_MAX,
+                latency_tolerance=settings.AZURE_OPENAI_LATENCY_TOLERANCE,
+            ),
+            tpm_limit=tpm_limit,
+            rpm_limit=rpm_limit,
+            queue_depth=settings.AZURE_OPENAI_ADMISSION_QUEUE_DEPTH,
+            max_wait=settings.AZURE_OPENAI_ADMISSION_MAX_WAIT_SECONDS,
+            expected_completion_tokens=settings.AZURE_OPENAI_EXPECTED_COMPLETION_TOKENS,
+            enabled=settings.AZURE_OPENAI_ADMISSION_ENABLED,
+        )
+    
+    def client_for(self, endpoint: Endpoint) -> AsyncAzureOpenAI:
+        """Get the Azure OpenAI client of an endpoint, creating the clients on first use."""
+        if endpoint.client is None:
+            self._create_clients()
+        return endpoint.client
+    
+    async def warm_up(self, connect: bool = True) -> None:
+        """
+        Create the clients and, optionally, open a connection to each endpoint.
+        
+        Connecting ahead of the first prompt takes the TCP and TLS handshakes
+        off its latency; the connections stay in the keep-alive pool that
+        completions use.
+        
+        In replay mode the cassette is read instead, so the first prompt
+        does not wait for it.
+        
+        Args:
+            connect: Whether to open pooled connections now
+        """
+        if self.mode == "replay":
+            await self.cassette.load()
+            return
+        for endpoint in self.pool.endpoints:
+            self.client_for(endpoint)
+        if not connect or self.http_client is None:
+            return
+        # The requests are unauthenticated, so any status will do; only the
+        # connections they leave in the pool matter
+        await asyncio.gather(*(
+            self.http_client.head(endpoint.url, timeout=settings.AZURE_OPENAI_CONNECT_TIMEOUT)
+            for endpoint in self.pool.endpoints
+        ))
+    
+    def _create_clients(self) -> None:
+        """Create a client per endpoint, all on one shared connection pool."""
+        self.http_client = DefaultAsyncHttpxClient(
+            limits=httpx.Limits(
+                max_connections=settings.AZURE_OPENAI_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.AZURE_OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=settings.AZURE_OPENAI_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(
+                settings.AZURE_OPENAI_TIMEOUT,
+                connect=settings.AZURE_OPENAI_CONNECT_TIMEOUT,
+            ),
         )
-        self.tools = get_diagram_tool_definition()
+        for endpoint in self.pool.endpoints:
+            if endpoint.client is None:
+                endpoint.client = AsyncAzureOpenAI(
+                    api_key=endpoint.api_key,
+                    api_version=settings.AZURE_OPENAI_API_VERSION,
+                    azure_endpoint=endpoint.url,
+                    max_retries=0,
+                    http_client=self.http_client,
+                )
     
-    def create_chat_completion(
+    async def create_chat_completion(
         self, 
         user_prompt: str, 
-        temperature: float = 0.2
+        temperature: float = 0.2,
+        timeout: Optional[float] = None,
+        use_cache: bool = True,
+        with_tools: bool = True
     ) -> Any:
         """
         Create a chat completion with Azure OpenAI.
         
+        The request runs on the shared async connection pool, so awaiting it
+        does not block the event loop. Cancelling the awaiting task aborts the
+        underlying HTTP request. When the completion cache is enabled, repeated
+        prompts are answered from memory and identical in-flight requests share
+        one upstream call. Upstream calls are retried, hedged and failed fast
+        as described in services.resilience, go to the endpoint chosen as
+        described in services.endpoint_pool, and wait for admission within
+        that deployment's quotas as described in services.admission; batch
+        work sets a lower priority with admission_priority().
+        
         Args:
             user_prompt: The user's prompt/question
             temperature: Sampling temperature for response generation
+            timeout: Deadline in seconds, retries and hedges included
+                (defaults to AZURE_OPENAI_TIMEOUT)
+            use_cache: Whether the completion cache may serve this request
+            with_tools: Whether to offer the diagram tool; without it the
+                request uses the short text-only system prompt and
+                AZURE_OPENAI_TEXT_DEPLOYMENT
+            
+        Returns:
+            The completion response from Azure OpenAI
+        
+        Raises:
+            AdmissionRejectedError: If the request was shed or waited too long for quota
+            CircuitOpenError: If Azure OpenAI keeps failing
+            DeadlineExceededError: If no answer arrived within the deadline
+        """
+        if self.cache is None or not use_cache:
+            return await self._request_completion(user_prompt, temperature, timeout, with_tools)
+        
+        if with_tools:
+            key = self.cache.make_key(
+                user_prompt, self.prompt_version, settings.AZURE_OPENAI_DEPLOYMENT, temperature
+            )
+        else:
+            key = self.cache.make_key(
+                user_prompt, TEXT_SYSTEM_PROMPT_VERSION, self.text_deployment, temperature
+            )
+        return await self.cache.get_or_create(
+            key, lambda: self._request_completion(user_prompt, temperature, timeout, with_tools)
+        )
+    
+    async def _request_completion(
+        self, 
+        user_prompt: str, 
+        temperature: float, 
+        timeout: Optional[float],
+        with_tools: bool = True
+    ) -> Any:
+        """Send a chat completion request to Azure OpenAI, or replay a recorded one."""
+        return await self._send_request(self._build_request(user_prompt, temperature, with_tools), timeout)
+    
+    async def create_session_completion(
+        self, 
+        history: List[Dict[str, str]], 
+        current_spec: Optional[str], 
+        user_prompt: str, 
+        temperature: float = 0.2,
+        timeout: Optional[float] = None
+    ) -> Any:
+        """
+        Create a chat completion for one turn of a chat session.
+        
+        The system prompt and tools are the same for every turn and are
+        followed by the history, so consecutive turns share a long identical
+        prompt prefix. The current diagram comes last, right before the new
+        message, and the model can answer with the edit tool instead of
+        repeating the whole spec. Session turns bypass the completion cache.
+        
+        Args:
+            history: Earlier user and assistant messages of the session
+            current_spec: Compact JSON of the session's diagram, if any
+            user_prompt: The user's new message
+            temperature: Sampling temperature for response generation
+            timeout: Deadline in seconds, retries and hedges included
+                (defaults to AZURE_OPENAI_TIMEOUT)
             
         Returns:
             The completion response from Azure OpenAI
         """
-        messages = [
-            {"role": "system", "content": SYSTEM_PROMPT},
+        messages: List[Dict[str, str]] = [{"role": "system", "content": self.session_system_prompt}]
+        messages.extend(history)
+        if current_spec is not None:
+            messages.append({"role": "system", "content": CURRENT_DIAGRAM_PREFIX + current_spec})
+        messages.extend(self._icon_messages(user_prompt))
+        messages.append({"role": "user", "content": user_prompt})
+        request = {
+            "model": settings.AZURE_OPENAI_DEPLOYMENT,
+            "messages": messages,
+            "tools": self.session_tools,
+            "tool_choice": "auto",
+            "temperature": temperature,
+        }
+        return await self._send_request(request, timeout, kind="session")
+    
+    async def _send_request(
+        self, 
+        request: Dict[str, Any], 
+        timeout: Optional[float], 
+        kind: Optional[str] = None
+    ) -> Any:
+        """
+        Send a completion request, or replay a recorded one, and count its tokens.
+        
+        Replayed requests go through the resilience policy as well, so replay
+        latency models exercise hedging and deadlines; they use no quota and
+        skip admission.
+        """
+        # Hedging waits on the latency of similar requests, and admission
+        # expects their completion length: diagrams are much longer answers than text
+        kind = kind or ("diagram" if "tools" in request else "text")
+        
+        async def attempt(remaining: float) -> Any:
+            if self.mode == "replay":
+                return await self._replay_completion(request)
+            endpoint = self.pool.pick(kind)
+            async with endpoint.admission.admit(request, kind) as ticket:
+                started = time.perf_counter()
+                with self.pool.track(endpoint, kind):
+                    completion = await self.client_for(endpoint).chat.completions.create(
+                        **self._for_endpoint(request, endpoint), **self._request_options(remaining)
+                    )
+                ticket.usage_tokens = self._usage_tokens(completion)
+            if self.mode == "record":
+                await self.cassette.record(
+                    request, completion.model_dump(mode="json"), (time.perf_counter() - started) * 1000
+                )
+            return completion
+        
+        completion = await self.resilience.call(attempt, kind=kind, deadline=timeout)
+        self._record_usage(completion)
+        return completion
+    
+    async def _replay_completion(self, request: Dict[str, Any]) -> ChatCompletion:
+        """
+        Serve a completion from the cassette after the configured latency.
+        
+        Raises:
+            CassetteMissError: If the request was never recorded
+        """
+        entry = await self.cassette.lookup(request)
+        await asyncio.sleep(self.replay_latency.sample(entry.get("latency_ms")))
+        return ChatCompletion.model_validate(entry["response"])
+    
+    async def stream_chat_completion(
+        self, 
+        user_prompt: str, 
+        temperature: float = 0.2,
+        timeout: Optional[float] = None,
+        with_tools: bool = True
+    ) -> Any:
+        """
+        Start a streaming chat completion with Azure OpenAI.
+        
+        Streaming responses bypass the completion cache.
+        
+        Args:
+            user_prompt: The user's prompt/question
+            temperature: Sampling temperature for response generation
+            timeout: Deadline in seconds for the stream to start, retries
+                included (defaults to AZURE_OPENAI_TIMEOUT)
+            with_tools: Whether to offer the diagram tool, see create_chat_completion()
+            
+        Returns:
+            Async stream of completion chunks; close it when done
+        """
+        request = self._build_request(user_prompt, temperature, with_tools)
+        if self.mode == "replay":
+            entry = await self.cassette.lookup(request)
+            completion = ChatCompletion.model_validate(entry["response"])
+            return ReplayStream(completion, self.replay_latency.sample(entry.get("latency_ms")))
+        
+        async def attempt(remaining: float) -> Any:
+            endpoint = self.pool.pick("stream")
+            ticket = await endpoint.admission.acquire(request, "stream")
+            try:
+                # Latency until the stream starts is what routing compares
+                with self.pool.track(endpoint, "stream"):
+                    stream = await self.client_for(endpoint).chat.completions.create(
+                        **self._for_endpoint(request, endpoint), stream=True, **self._request_options(remaining)
+                    )
+            except BaseException as e:
+                endpoint.admission.release(ticket, error=e)
+                raise
+            # The stream holds its admission until it is closed
+            return AdmittedStream(stream, endpoint.admission, ticket)
+        
+        # Retrying is safe until the first chunk arrives; streams are not hedged
+        started = time.perf_counter()
+        stream = await self.resilience.call(attempt, kind="stream", deadline=timeout, hedge=False)
+        if self.mode == "record":
+            return RecordingStream(stream, self.cassette, request, started)
+        return stream
+    
+    def _record_usage(self, completion: Any) -> None:
+        """Count the tokens reported in a completion's `usage` field."""
+        usage = getattr(completion, "usage", None)
+        if usage is None:
+            return
+        LLM_TOKENS.inc(getattr(usage, "prompt_tokens", 0) or 0, kind="prompt")
+        LLM_TOKENS.inc(getattr(usage, "completion_tokens", 0) or 0, kind="completion")
+        details = getattr(usage, "prompt_tokens_details", None)
+        LLM_TOKENS.inc(getattr(details, "cached_tokens", 0) or 0, kind="cached_prompt")
+    
+    def _usage_tokens(self, completion: Any) -> Optional[Tuple[int, int]]:
+        """Get the (prompt, completion) tokens reported in a completion's `usage` field."""
+        usage = getattr(completion, "usage", None)
+        if usage is None:
+            return None
+        return (getattr(usage, "prompt_tokens", 0) or 0, getattr(usage, "completion_tokens", 0) or 0)
+    
+    def _build_request(self, user_prompt: str, temperature: float, with_tools: bool = True) -> Dict[str, Any]:
+        """Build the completion request; in record/replay mode its hash is the cassette key."""
+        if not with_tools:
+            return {
+                "model": self.text_deployment,
+                "messages": [
+                    {"role": "system", "content": TEXT_SYSTEM_PROMPT},
+                    {"role": "user", "content": user_prompt},
+                ],
+                "temperature": temperature,
+            }
+        return {
+            "model": settings.AZURE_OPENAI_DEPLOYMENT,
+            "messages": self._build_messages(user_prompt),
+            "tools": self.tools,
+            "tool_choice": "auto",
+            "temperature": temperature,
+        }
+    
+    def _build_messages(self, user_prompt: str) -> List[Dict[str, str]]:
+        """Build the message list sent to the model."""
+        return [
+            {"role": "system", "content": self.system_prompt},
+            *self._icon_messages(user_prompt),
             {"role": "user", "content": user_prompt},
         ]
+    
+    def _icon_messages(self, user_prompt: str) -> List[Dict[str, str]]:
+        """
+        List the icons relevant to a prompt, placed right before it.
         
-        return self.client.chat.completions.create(
-            model=settings.AZURE_OPENAI_DEPLOYMENT,
-            messages=messages,
-            tools=self.tools,
-            tool_choice="auto",
-            temperature=temperature,
-        )
+        Coming after the fixed system prompt and tools, the list does not
+        disturb the prompt prefix that Azure OpenAI caches.
+        """
+        if not self.icon_retrieval:
+            return []
+        icons = relevant_icons(user_prompt, codes=self.spec_version == 2)
+        return [{"role": "system", "content": RELEVANT_ICONS_PREFIX + icons}]
+    
+    def _for_endpoint(self, request: Dict[str, Any], endpoint: Endpoint) -> Dict[str, Any]:
+        """
+        Address a request to an endpoint's deployment.
+        
+        Requests name the primary deployment, which completion cache and
+        cassette keys are built from; every endpoint must serve the same model.
+        """
+        deployment = endpoint.deployment if "tools" in request else endpoint.text_deployment
+        return dict(request, model=deployment)
+    
+    def _request_options(self, timeout: float) -> Dict[str, Any]:
+        """Build per-attempt request options; the timeout is what is left of the call's deadline."""
+        return {"timeout": timeout}
     
     def extract_tool_call_args(self, tool_call: Any) -> Optional[Dict[str, Any]]:
         """
@@ -66,7 +501,101 @@ class AzureOpenAIService:
             return json.loads(args_json)
         except json.JSONDecodeError:
             return None
+    
+    async def aclose(self) -> None:
+        """Close the clients and release pooled connections."""
+        for endpoint in self.pool.endpoints:
+            if endpoint.client is not None:
+                await endpoint.client.close()
+                endpoint.client = None
+        self.http_client = None
 
 
 # Global service instance
-azure_openai_service = AzureOpenAIService()
\ No newline at end of file
+azure_openai_service = AzureOpenAIService()
+
+metrics.gauge(
+    "diagram_service_completion_cache",
+    "Completion cache lookups and occupancy",
+    ("stat",),
+    lambda: {
+        (stat,): azure_openai_service.cache.stats()[stat]
+        for stat in ("hits", "misses", "coalesced", "entries", "bytes")
+    } if azure_openai_service.cache else {},
+)
+metrics.gauge(
+    "diagram_service_llm_circuit_state",
+    "State of the Azure OpenAI circuit breaker: 1 for the current state",
+    ("state",),
+    lambda: {
+        (state,): float(azure_openai_service.resilience.breaker.state == state)
+        for state in (CLOSED, HALF_OPEN, OPEN)
+    },
+)
+metrics.gauge(
+    "diagram_service_llm_hedge_delay_seconds",
+    "Latency after which an Azure OpenAI request is hedged, per kind of request",
+    ("kind",),
+    lambda: {
+        (kind,): delay
+        for kind, delay in (
+            (kind, azure_openai_service.resilience.hedge_delay(kind))
+            for kind in azure_openai_service.resilience.latencies
+        )
+        if delay is not None
+    },
+)
+metrics.gauge(
+    "diagram_service_llm_concurrency",
+    "Adaptive concurrency limit of Azure OpenAI requests and the requests in flight, per endpoint",
+    ("endpoint", "stat"),
+    lambda: {
+        key: value
+        for endpoint in azure_openai_service.pool.endpoints
+        for key, value in (
+            ((endpoint.name, "limit"), endpoint.admission.limit.current),
+            ((endpoint.name, "in_flight"), endpoint.admission.in_flight),
+        )
+    },
+)
+metrics.gauge(
+    "diagram_service_llm_admission_queue",
+    "Azure OpenAI requests waiting for admission, per endpoint and priority",
+    ("endpoint", "priority"),
+    lambda: {
+        (endpoint.name, priority): endpoint.admission.queued(priority)
+        for endpoint in azure_openai_service.pool.endpoints
+        for priority in PRIORITIES
+    },
+)
+metrics.gauge(
+    "diagram_service_llm_quota_available",
+    "Tokens and requests left in the client-side copies of each deployment's TPM and RPM quotas",
+    ("endpoint", "quota"),
+    lambda: {
+        (endpoint.name, quota): bucket.available()
+        for endpoint in azure_openai_service.pool.endpoints
+        for quota, bucket in (("tpm", endpoint.admission.tpm), ("rpm", endpoint.admission.rpm))
+        if bucket is not None
+    },
+)
+metrics.gauge(
+    "diagram_service_llm_endpoint_state",
+    "State of each Azure OpenAI endpoint: 1 for the current state",
+    ("endpoint", "state"),
+    lambda: {
+        (endpoint.name, state): float(endpoint.state() == state)
+        for endpoint in azure_openai_service.pool.endpoints
+        for state in (HEALTHY, THROTTLED, EJECTED)
+    },
+)
+metrics.gauge(
+    "diagram_service_llm_endpoint_latency_seconds",
+    "Expected latency of each Azure OpenAI endpoint that routing compares, per kind of request",
+    ("endpoint", "kind"),
+    lambda: {
+        (endpoint.name, kind): endpoint.latency(kind, azure_openai_service.pool.decay_seconds)
+        for endpoint in azure_openai_service.pool.endpoints
+        for kind in list(endpoint.latencies)
+    },
+)
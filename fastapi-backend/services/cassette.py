@@ -0,0 +1,332 @@
+"""
+Recording and replay of Azure OpenAI chat completions for offline runs.
+"""
+
+import asyncio
+import hashlib
+import json
+import random
+import threading
+import time
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+# Characters of content or tool arguments per replayed stream chunk
+REPLAY_CHUNK_CHARS = 16
+
+
+class CassetteMissError(LookupError):
+    """Raised in replay mode when no completion was recorded for a request."""
+    
+    def __init__(self, key: str):
+        super().__init__(f"No recorded completion for request {key[:12]}; record it first")
+        self.key = key
+
+
+class LatencyModel:
+    """Delay added before a replayed completion is returned."""
+    
+    def __init__(self, kind: str = "none", params: Optional[List[float]] = None, seed: Optional[int] = None):
+        """
+        Initialize the model.
+        
+        Args:
+            kind: "none", "recorded", "fixed", "uniform", "normal" or "lognormal"
+            params: Parameters of the distribution in milliseconds, see parse()
+            seed: Seed for reproducible delays
+        """
+        self.kind = kind
+        self.params = params or []
+        self._rng = random.Random(seed)
+    
+    @classmethod
+    def parse(cls, spec: str, seed: Optional[int] = None) -> "LatencyModel":
+        """
+        Parse a latency specification.
+        
+        Accepted forms (milliseconds): empty or `none`, `recorded` (the latency
+        measured while recording), `fixed:800`, `uniform:300,1200`,
+        `normal:800,150` (mean, standard deviation) and `lognormal:800,0.5`
+        (median, sigma of the underlying normal).
+        
+        Args:
+            spec: The specification
+            seed: Seed for reproducible delays
+        
+        Returns:
+            The latency model
+        
+        Raises:
+            ValueError: If the specification is malformed
+        """
+        kind, _, raw_params = (spec or "none").strip().lower().partition(":")
+        expected = {"none": 0, "recorded": 0, "fixed": 1, "uniform": 2, "normal": 2, "lognormal": 2}
+        if kind not in expected:
+            raise ValueError(f"Unknown replay latency '{spec}' (expected one of {', '.join(expected)})")
+        try:
+            params = [float(p) for p in raw_params.split(",")] if raw_params else []
+        except ValueError:
+            raise ValueError(f"Invalid replay latency parameters in '{spec}'") from None
+        if len(params) != expected[kind]:
+            raise ValueError(f"Replay latency '{kind}' takes {expected[kind]} parameter(s), got '{spec}'")
+        return cls(kind, params, seed)
+    
+    def sample(self, recorded_ms: Optional[float] = None) -> float:
+        """
+        Draw a delay.
+        
+        Args:
+            recorded_ms: Latency measured when the completion was recorded
+        
+        Returns:
+            Delay in seconds
+        """
+        if self.kind == "recorded":
+            ms = recorded_ms or 0.0
+        elif self.kind == "fixed":
+            ms = self.params[0]
+        elif self.kind == "uniform":
+            ms = self._rng.uniform(*self.params)
+        elif self.kind == "normal":
+            ms = self._rng.gauss(*self.params)
+        elif self.kind == "lognormal":
+            median, sigma = self.params
+            ms = median * self._rng.lognormvariate(0.0, sigma)
+        else:
+            ms = 0.0
+        return max(0.0, ms) / 1000
+
+
+class Cassette:
+    """
+    Completions keyed by a hash of the full request, kept in a JSON Lines file.
+    
+    Each line holds one recording; when a request was recorded more than once
+    the last recording wins.
+    """
+    
+    def __init__(self, path: str):
+        """
+        Initialize the cassette; the file is read by load() or on first lookup.
+        
+        Args:
+            path: JSON Lines file to read recordings from and append them to
+        """
+        self.path = Path(path)
+        self._entries: Optional[Dict[str, Dict[str, Any]]] = None
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def request_key(request: Dict[str, Any]) -> str:
+        """
+        Hash a request.
+        
+        Args:
+            request: Model, messages, tools and sampling parameters
+        
+        Returns:
+            Hex digest identifying the request
+        """
+        canonical = json.dumps(request, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+    
+    async def load(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Read the recordings file on a worker thread, once.
+        
+        Returns:
+            The recordings by request key
+        """
+        if self._entries is not None:
+            return self._entries
+        return await asyncio.to_thread(self._load)
+    
+    async def lookup(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Find the recording for a request, loading the file if needed.
+        
+        Args:
+            request: The request that would be sent to Azure OpenAI
+        
+        Returns:
+            The recording, with `response` and `latency_ms`
+        
+        Raises:
+            CassetteMissError: If the request was never recorded
+        """
+        key = self.request_key(request)
+        entry = (await self.load()).get(key)
+        if entry is None:
+            raise CassetteMissError(key)
+        return entry
+    
+    async def record(self, request: Dict[str, Any], response: Dict[str, Any], latency_ms: float) -> None:
+        """
+        Append a recording, writing the file on a worker thread to keep disk
+        latency off the event loop.
+        
+        Args:
+            request: The request that was sent
+            response: The completion, as returned by `model_dump(mode="json")`
+            latency_ms: How long the request took
+        """
+        entry = {
+            "key": self.request_key(request),
+            "recorded_at": time.time(),
+            "latency_ms": round(latency_ms, 1),
+            # The tool schema is part of the key but not repeated on every line
+            "request": {name: value for name, value in request.items() if name != "tools"},
+            "response": response,
+        }
+        await asyncio.to_thread(self._append, entry)
+    
+    def __len__(self) -> int:
+        return len(self._load())
+    
+    def _append(self, entry: Dict[str, Any]) -> None:
+        """Append a recording to the file and the loaded recordings."""
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with self.path.open("a", encoding="utf-8") as f:
+                f.write(line)
+            if self._entries is not None:
+                self._entries[entry["key"]] = entry
+    
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        """Read the recordings file, skipping lines that are not recordings."""
+        with self._lock:
+            if self._entries is None:
+                entries: Dict[str, Dict[str, Any]] = {}
+                if self.path.exists():
+                    with self.path.open(encoding="utf-8") as f:
+                        for line in f:
+                            try:
+                                entry = json.loads(line)
+                            except json.JSONDecodeError:
+                                continue
+                            if isinstance(entry, dict) and isinstance(entry.get("key"), str):
+                                entries[entry["key"]] = entry
+                # Published only once complete, so a failed read is retried
+                self._entries = entries
+            return self._entries
+
+
+class ReplayStream:
+    """Replays a recorded completion as a stream of chunks, like AsyncStream."""
+    
+    def __init__(self, completion: ChatCompletion, delay: float):
+        """
+        Initialize the stream.
+        
+        Args:
+            completion: The recorded completion
+            delay: Seconds to wait before the first chunk
+        """
+        self.completion = completion
+        self.delay = delay
+    
+    def __aiter__(self) -> AsyncIterator[ChatCompletionChunk]:
+        return self._chunks()
+    
+    async def close(self) -> None:
+        """Nothing to release; present for parity with AsyncStream."""
+    
+    async def _chunks(self) -> AsyncIterator[ChatCompletionChunk]:
+        await asyncio.sleep(self.delay)
+        choice = self.completion.choices[0]
+        message = choice.message
+        yield self._chunk({"role": "assistant", "content": ""})
+        content = message.content or ""
+        for i in range(0, len(content), REPLAY_CHUNK_CHARS):
+            yield self._chunk({"content": content[i : i + REPLAY_CHUNK_CHARS]})
+        for index, tool_call in enumerate(message.tool_calls or []):
+            yield self._chunk({"tool_calls": [{
+                "index": index,
+                "id": tool_call.id,
+                "type": "function",
+                "function": {"name": tool_call.function.name, "arguments": ""},
+            }]})
+            arguments = tool_call.function.arguments or ""
+            for i in range(0, len(arguments), REPLAY_CHUNK_CHARS):
+                yield self._chunk({"tool_calls": [{
+                    "index": index,
+                    "function": {"arguments": arguments[i : i + REPLAY_CHUNK_CHARS]},
+                }]})
+        yield self._chunk({}, finish_reason=choice.finish_reason)
+    
+    def _chunk(self, delta: Dict[str, Any], finish_reason: Optional[str] = None) -> ChatCompletionChunk:
+        """Build one chunk of the replayed stream."""
+        return ChatCompletionChunk.model_validate({
+            "id": self.completion.id,
+            "object": "chat.completion.chunk",
+            "created": self.completion.created,
+            "model": self.completion.model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        })
+
+
+class RecordingStream:
+    """Passes a live stream through and records the assembled completion at its end."""
+    
+    def __init__(self, stream: Any, cassette: Cassette, request: Dict[str, Any], started: float):
+        """
+        Initialize the stream.
+        
+        Args:
+            stream: The live AsyncStream of chunks
+            cassette: Where the completion is recorded
+            request: The request that started the stream
+            started: perf_counter() value when the request was sent
+        """
+        self.stream = stream
+        self.cassette = cassette
+        self.request = request
+        self.started = started
+    
+    def __aiter__(self) -> AsyncIterator[Any]:
+        return self._chunks()
+    
+    async def close(self) -> None:
+        """Close the live stream."""
+        await self.stream.close()
+    
+    async def _chunks(self) -> AsyncIterator[Any]:
+        first = None
+        content: List[str] = []
+        tool_calls: Dict[int, Dict[str, Any]] = {}
+        finish_reason = None
+        async for chunk in self.stream:
+            first = first or chunk
+            yield chunk
+            if not chunk.choices:
+                continue
+            choice = chunk.choices[0]
+            finish_reason = choice.finish_reason or finish_reason
+            if choice.delta.content:
+                content.append(choice.delta.content)
+            for tool_call in choice.delta.tool_calls or []:
+                call = tool_calls.setdefault(tool_call.index, {
+                    "id": None, "type": "function", "function": {"name": "", "arguments": ""},
+                })
+                call["id"] = tool_call.id or call["id"]
+                if tool_call.function is not None:
+                    call["function"]["name"] += tool_call.function.name or ""
+                    call["function"]["arguments"] += tool_call.function.arguments or ""
+        
+        # Only streams read to the end are recorded
+        if first is None:
+            return
+        message: Dict[str, Any] = {"role": "assistant", "content": "".join(content) or None}
+        if tool_calls:
+            message["tool_calls"] = [tool_calls[i] for i in sorted(tool_calls)]
+        response = {
+            "id": first.id,
+            "object": "chat.completion",
+            "created": first.created,
+            "model": first.model,
+            "choices": [{"index": 0, "message": message, "finish_reason": finish_reason or "stop"}],
+        }
+        await self.cassette.record(self.request, response, (time.perf_counter() - self.started) * 1000)
@@ -0,0 +1,170 @@
+"""
+Compact DiagramSpec dialect written by the model to save output tokens.
+
+The compact form uses one-letter keys and positional arrays instead of
+objects, and short icon codes instead of class paths:
+
+    {"t": "RAG chat", "d": "LR",
+     "c": [["app", "App Layer"]],
+     "n": [["web", "app", "Web App", "app"], ["llm", "oai", "Azure OpenAI"]],
+     "e": [["web", "llm", "prompts"]]}
+
+Nodes are [id, icon, label?, cluster?], clusters [id, label?] and edges
+[source, target, label?]. DiagramService expands it back into the full
+form before validation, so everything after the model only sees full specs.
+"""
+
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Short icon codes, mostly the Azure resource abbreviations of the Cloud
+# Adoption Framework. Codes are part of the tool schema: never change or reuse
+# one, only add new ones.
+ICON_CODES: Dict[str, str] = {
+    "user": "diagrams.onprem.client.User",
+    "internet": "diagrams.onprem.network.Internet",
+    "app": "diagrams.azure.web.AppServices",
+    "func": "diagrams.azure.compute.FunctionApps",
+    "ca": "diagrams.azure.compute.ContainerApps",
+    "aks": "diagrams.azure.compute.KubernetesServices",
+    "cr": "diagrams.azure.compute.ContainerRegistries",
+    "vm": "diagrams.azure.compute.VM",
+    "sql": "diagrams.azure.database.SQLDatabases",
+    "cosmos": "diagrams.azure.database.CosmosDb",
+    "redis": "diagrams.azure.database.CacheForRedis",
+    "blob": "diagrams.azure.storage.BlobStorage",
+    "st": "diagrams.azure.storage.StorageAccounts",
+    "dls": "diagrams.azure.storage.DataLakeStorage",
+    "kv": "diagrams.azure.security.KeyVaults",
+    "id": "diagrams.azure.identity.ManagedIdentities",
+    "entra": "diagrams.azure.identity.ActiveDirectory",
+    "apim": "diagrams.azure.integration.APIManagement",
+    "logic": "diagrams.azure.integration.LogicApps",
+    "sbns": "diagrams.azure.integration.ServiceBus",
+    "evgt": "diagrams.azure.integration.EventGridTopics",
+    "evh": "diagrams.azure.analytics.EventHubs",
+    "adf": "diagrams.azure.analytics.DataFactories",
+    "dbw": "diagrams.azure.analytics.Databricks",
+    "synw": "diagrams.azure.analytics.SynapseAnalytics",
+    "oai": "diagrams.azure.ml.AzureOpenAI",
+    "srch": "diagrams.azure.web.Search",
+    "agw": "diagrams.azure.network.ApplicationGateway",
+    "afd": "diagrams.azure.network.FrontDoors",
+    "afw": "diagrams.azure.network.Firewall",
+    "lb": "diagrams.azure.network.LoadBalancers",
+    "vnet": "diagrams.azure.network.VirtualNetworks",
+    "pep": "diagrams.azure.network.PrivateEndpoint",
+    "appi": "diagrams.azure.monitor.ApplicationInsights",
+    "log": "diagrams.azure.monitor.LogAnalyticsWorkspaces",
+}
+
+_CODES_BY_PATH: Dict[str, str] = {path: code for code, path in ICON_CODES.items()}
+
+
+def is_compact_spec(spec: Any) -> bool:
+    """Whether a spec is written in the compact dialect."""
+    return isinstance(spec, dict) and "n" in spec and "nodes" not in spec
+
+
+def icon_code(path: str) -> str:
+    """Get the icon code of a class path, or its class name if it has none."""
+    return _CODES_BY_PATH.get(path) or path.rpartition(".")[2]
+
+
+def expand_icon(icon: Any, lookup_name: Optional[Callable[[str], Optional[str]]] = None) -> Any:
+    """
+    Expand an icon code or bare class name into a class path.
+    
+    Args:
+        icon: Icon code (`sql`), class name (`SQLDatabases`) or class path
+        lookup_name: Resolves a bare class name to a class path
+    
+    Returns:
+        The class path, or the icon unchanged if it is already a path or
+        cannot be expanded (validation then falls back as for any bad icon)
+    """
+    if not isinstance(icon, str):
+        return icon
+    icon = icon.strip()
+    if not icon or "." in icon:
+        return icon
+    path = ICON_CODES.get(icon.lower())
+    if path is None and lookup_name is not None:
+        path = lookup_name(icon)
+    return path or icon
+
+
+def expand_compact_spec(
+    spec: Dict[str, Any], lookup_name: Optional[Callable[[str], Optional[str]]] = None
+) -> Dict[str, Any]:
+    """
+    Expand a compact spec into the full DiagramSpec form.
+    
+    Args:
+        spec: Spec in the compact dialect
+        lookup_name: Resolves bare class names used as icons, see expand_icon()
+    
+    Returns:
+        The full spec
+    
+    Raises:
+        ValueError: If a cluster, node or edge is not an array
+    """
+    clusters = [_expand_item(item, ("id", "label"), "cluster") for item in spec.get("c") or []]
+    nodes = [_expand_item(item, ("id", "icon", "label", "cluster"), "node") for item in spec.get("n") or []]
+    edges = [_expand_item(item, ("source", "target", "label"), "edge") for item in spec.get("e") or []]
+    for node in nodes:
+        if "icon" in node:
+            node["icon"] = expand_icon(node["icon"], lookup_name)
+    full: Dict[str, Any] = {"clusters": clusters, "nodes": nodes, "edges": edges}
+    if spec.get("t"):
+        full["title"] = spec["t"]
+    if spec.get("d"):
+        full["direction"] = spec["d"]
+    return full
+
+
+def compact_spec(spec: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Write a full spec in the compact dialect; the inverse of expand_compact_spec().
+    
+    Icons without a code are written as their class name.
+    
+    Args:
+        spec: Spec in the full form
+    
+    Returns:
+        The compact spec
+    """
+    compact: Dict[str, Any] = {}
+    if spec.get("title"):
+        compact["t"] = spec["title"]
+    if spec.get("direction"):
+        compact["d"] = spec["direction"]
+    if spec.get("clusters"):
+        compact["c"] = [_compact_item(c, ("id", "label")) for c in spec["clusters"]]
+    nodes = []
+    for node in spec.get("nodes") or []:
+        icon = str(node.get("icon") or "")
+        node = dict(node, icon=icon_code(icon))
+        nodes.append(_compact_item(node, ("id", "icon", "label", "cluster")))
+    compact["n"] = nodes
+    if spec.get("edges"):
+        compact["e"] = [_compact_item(e, ("source", "target", "label")) for e in spec["edges"]]
+    return compact
+
+
+def _expand_item(item: Any, keys: Tuple[str, ...], kind: str) -> Dict[str, Any]:
+    """Turn a positional array into an object; objects are passed through."""
+    if isinstance(item, dict):
+        return dict(item)
+    if not isinstance(item, list):
+        raise ValueError(f"Compact {kind} must be an array like [{', '.join(keys)}], got {item!r}")
+    return {key: value for key, value in zip(keys, item) if value not in (None, "")}
+
+
+def _compact_item(item: Dict[str, Any], keys: Tuple[str, ...]) -> List[Any]:
+    """Turn an object into a positional array, dropping trailing empty fields."""
+    values = [item.get(key) or "" for key in keys]
+    while values and values[-1] == "":
+        values.pop()
+    return values
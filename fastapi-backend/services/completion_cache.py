@@ -0,0 +1,155 @@
+"""
+In-memory cache for chat completions with request coalescing.
+"""
+
+import hashlib
+import json
+import re
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, NamedTuple
+
+from services.singleflight import SingleFlight
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+class _CacheEntry(NamedTuple):
+    """A cached completion with its accounted size and expiry time."""
+    value: Any
+    size: int
+    expires_at: float
+
+
+class CompletionCache:
+    """TTL cache with LRU-by-bytes eviction for completion responses."""
+    
+    def __init__(self, ttl_seconds: float, max_bytes: int):
+        """
+        Initialize the cache.
+        
+        Args:
+            ttl_seconds: How long a completion stays valid
+            max_bytes: Upper bound for the serialized size of all entries
+        """
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, _CacheEntry]" = OrderedDict()
+        self._bytes = 0
+        self._flights = SingleFlight()
+        self.hits = 0
+        self.misses = 0
+    
+    @staticmethod
+    def normalize_prompt(prompt: str) -> str:
+        """
+        Normalize a prompt so trivially different phrasings share an entry.
+        
+        Case, surrounding and repeated whitespace, and trailing punctuation are
+        ignored.
+        
+        Args:
+            prompt: Raw user prompt
+        
+        Returns:
+            Normalized prompt text
+        """
+        return _WHITESPACE.sub(" ", prompt or "").strip().casefold().rstrip(" .!?;:")
+    
+    def make_key(
+        self,
+        prompt: str,
+        system_prompt_version: str,
+        deployment: str,
+        temperature: float
+    ) -> str:
+        """
+        Build the cache key for a completion request.
+        
+        Args:
+            prompt: Raw user prompt
+            system_prompt_version: Identifier of the system prompt and tools in use
+            deployment: Azure OpenAI deployment name
+            temperature: Sampling temperature
+        
+        Returns:
+            Hex digest cache key
+        """
+        material = json.dumps(
+            [self.normalize_prompt(prompt), system_prompt_version, deployment, round(temperature, 4)],
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+    
+    async def get_or_create(self, key: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Get a cached completion, or create it once for all concurrent callers.
+        
+        Args:
+            key: Cache key from make_key
+            factory: Coroutine factory performing the real completion call
+        
+        Returns:
+            The cached or freshly created completion
+        """
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry.expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry.value
+            self._remove(key)
+        
+        if not self._flights.in_flight(key):
+            self.misses += 1
+        return await self._flights.do(key, lambda: self._create_and_store(key, factory))
+    
+    def stats(self) -> Dict[str, Any]:
+        """Get hit/miss counters and occupancy."""
+        lookups = self.hits + self.misses + self._flights.coalesced
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self._flights.coalesced,
+            "hit_ratio": round((self.hits + self._flights.coalesced) / lookups, 4) if lookups else 0.0,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl_seconds,
+        }
+    
+    def clear(self) -> None:
+        """Drop every cached completion."""
+        self._entries.clear()
+        self._bytes = 0
+    
+    async def _create_and_store(self, key: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """Run the factory and cache its result."""
+        value = await factory()
+        self._store(key, value)
+        return value
+    
+    def _store(self, key: str, value: Any) -> None:
+        """Insert an entry, evicting least recently used ones to fit max_bytes."""
+        size = self._measure(value)
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        while self._entries and self._bytes + size > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+        self._entries[key] = _CacheEntry(value, size, time.monotonic() + self.ttl_seconds)
+        self._bytes += size
+    
+    def _remove(self, key: str) -> None:
+        """Remove an entry and release its bytes."""
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+    
+    @staticmethod
+    def _measure(value: Any) -> int:
+        """Estimate an entry's size from its serialized form."""
+        if hasattr(value, "model_dump_json"):
+            return len(value.model_dump_json().encode("utf-8"))
+        return len(json.dumps(value, default=str).encode("utf-8"))
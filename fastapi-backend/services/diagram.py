@@ -2,13 +2,76 @@
 Diagram rendering service using mingrammer/diagrams.
 """
 
+import asyncio
+import os
 import json
+import hashlib
+import logging
+import tempfile
 import time
-import importlib
 from pathlib import Path
-from typing import Dict, Any, Optional, List, Tuple, Set
+from typing import Dict, Any, FrozenSet, NamedTuple, Optional, List, Tuple
 
 from config.settings import settings
+from schemas.diagram_spec import MAX_LABEL_LENGTH, SpecValidationError, validate_diagram_spec
+from services.compact_spec import expand_compact_spec, expand_icon, is_compact_spec
+from services.diagram_store import diagram_store, is_safe_name
+from services.dot_renderer import dot_renderer, inline_svg_images
+from services.icon_registry import icon_registry
+from services.json_extractor import extract_json_objects, find_diagram_spec
+from services.metrics import FALLBACK_ICONS, RENDER_ERRORS, metrics, record_stage, timed
+from services.render_pool import RenderQueueFullError, RenderTimeoutError, render_pool
+from services.singleflight import SingleFlight
+from services.spec_repair import repair_spec
+
+logger = logging.getLogger(__name__)
+
+# Bump when a change to rendering would make previously cached images stale
+RENDER_CACHE_VERSION = "2"
+
+DIRECTIONS = ("LR", "TB", "RL", "BT")
+
+# "diagrams" drives mingrammer/diagrams; "dot" compiles DOT and pipes it to Graphviz
+RENDER_ENGINES = ("diagrams", "dot")
+
+# Graph attributes shared by both render engines
+GRAPH_ATTR = {"pad": "0.2", "splines": "ortho"}
+
+
+class OutputFormat(NamedTuple):
+    """How a diagram output format is rendered and served."""
+    suffix: str
+    graphviz_format: str
+    media_type: str
+
+
+# Variants of a diagram share its content-addressed base name and differ by suffix
+DIAGRAM_FORMATS: Dict[str, OutputFormat] = {
+    "png": OutputFormat(".png", "png", "image/png"),
+    "preview": OutputFormat(".preview.png", "png", "image/png"),
+    "svg": OutputFormat(".svg", "svg", "image/svg+xml"),
+    "pdf": OutputFormat(".pdf", "pdf", "application/pdf"),
+}
+
+# Suffix of the file recording the spec a diagram was rendered from
+SPEC_SUFFIX = ".json"
+
+
+def _render_in_worker(spec: Dict[str, Any], engine: str, output_format: str) -> Dict[str, Any]:
+    """
+    Render entry point executed inside a render pool worker process.
+    
+    Workers only produce the image; storing it is left to the parent process,
+    which owns the diagram store's index. Metrics recorded in the worker are
+    returned with the result and replayed by the parent.
+    """
+    with metrics.capture() as events:
+        try:
+            result = {"ok": True, "image": diagram_service.render_image(spec, engine, output_format)}
+        except Exception as e:
+            result = {"ok": False, "error": repr(e)}
+    result["metrics"] = events
+    return result
 
 
 class DiagramService:
@@ -16,38 +79,412 @@ class DiagramService:
     
     def __init__(self):
         """Initialize the diagram service."""
-        self.output_dir = Path(settings.DIAGRAM_OUTPUT_DIR)
-        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.store = diagram_store
         
         # Icon validation settings
         self.allowed_icon_prefixes = settings.ALLOWED_ICON_PREFIXES
         self.fallback_icon = settings.FALLBACK_ICON
         self.annotate_fallback = settings.ANNOTATE_FALLBACK
-        self.strict_whitelist: Optional[Set[str]] = None
+        self.preview_dpi = settings.DIAGRAM_PREVIEW_DPI
+        self.svg_inline_icons = settings.SVG_INLINE_ICONS
+        self.strict_whitelist_enabled = settings.ICON_STRICT_WHITELIST
+        self._strict_whitelist: Optional[FrozenSet[str]] = None
+        self.auto_repair = settings.SPEC_AUTO_REPAIR
+        
+        # Concurrent renders of the same spec share one computation
+        self._render_flights = SingleFlight()
+    
+    @property
+    def strict_whitelist(self) -> Optional[FrozenSet[str]]:
+        """Icon classes allowed by ICON_STRICT_WHITELIST, indexed on first use; None when off."""
+        if self.strict_whitelist_enabled and self._strict_whitelist is None:
+            # Restrict icons to the classes that actually exist under the prefixes
+            self._strict_whitelist = icon_registry.paths()
+        return self._strict_whitelist
     
     def render_diagram(
         self, 
         spec: Dict[str, Any], 
-        base_filename_prefix: str = "azure_arch"
+        base_filename_prefix: str = "azure_arch",
+        engine: Optional[str] = None,
+        output_format: str = "png"
     ) -> Dict[str, Any]:
         """
         Render a diagram from a specification.
         
+        Only the requested format is rendered. The canonical spec is stored
+        next to the image so other formats can be produced later on demand.
+        
         Args:
             spec: The diagram specification
             base_filename_prefix: Prefix for the output filename
+            engine: Render engine name (defaults to RENDER_ENGINE)
+            output_format: One of DIAGRAM_FORMATS
             
         Returns:
-            Dictionary containing render results
+            Dictionary containing render results, with the `repairs` made to
+            the spec; an invalid spec fails with every problem in `errors`
         """
         try:
-            clusters, nodes, edges, title, direction = self._validate_spec(spec)
-            return self._create_diagram(
-                clusters, nodes, edges, title, direction, base_filename_prefix
+            engine = self._engine(engine)
+            self._output_format(output_format)
+            with timed("validate"):
+                canonical, repairs = self.prepare_spec(spec)
+                clusters, nodes, edges, title, direction = self._spec_parts(canonical)
+            base_name = self._base_name(
+                base_filename_prefix, engine, clusters, nodes, edges, title, direction
+            )
+            cached = self._cached_result(
+                base_name, output_format, clusters, nodes, edges, title, direction
             )
+            if cached:
+                return dict(cached, repairs=repairs)
+            image = self.render_image(canonical, engine, output_format)
+            self._store_render(base_name, base_filename_prefix, engine, canonical, output_format, image)
+            result = self._build_result(base_name, output_format, clusters, nodes, edges, title, direction)
+            return dict(result, repairs=repairs)
+        except SpecValidationError as e:
+            RENDER_ERRORS.inc(reason="invalid_spec")
+            return {"ok": False, "error": str(e), "errors": e.errors}
         except Exception as e:
+            RENDER_ERRORS.inc(reason="error")
             return {"ok": False, "error": repr(e)}
     
+    async def render_diagram_async(
+        self, 
+        spec: Dict[str, Any], 
+        base_filename_prefix: str = "azure_arch",
+        engine: Optional[str] = None,
+        output_format: str = "png"
+    ) -> Dict[str, Any]:
+        """
+        Render a diagram on the render process pool without blocking the event loop.
+        
+        mingrammer/diagrams keeps the active diagram and cluster in module-level
+        context, so renders are isolated in worker processes rather than threads.
+        Images are content-addressed: a spec that was already rendered is served
+        from the diagram store, and concurrent renders of the same spec share
+        one worker job.
+        
+        Args:
+            spec: The diagram specification
+            base_filename_prefix: Prefix for the output filename
+            engine: Render engine name (defaults to RENDER_ENGINE)
+            output_format: One of DIAGRAM_FORMATS
+            
+        Returns:
+            Dictionary containing render results, with the `repairs` made to
+            the spec; an invalid spec fails with every problem in `errors`
+            
+        Raises:
+            RenderQueueFullError: If the render pool is saturated
+            RenderTimeoutError: If the render exceeds its time budget
+        """
+        try:
+            engine = self._engine(engine)
+            suffix = self._output_format(output_format).suffix
+            with timed("validate"):
+                canonical, repairs = self.prepare_spec(spec)
+                clusters, nodes, edges, title, direction = self._spec_parts(canonical)
+            base_name = self._base_name(
+                base_filename_prefix, engine, clusters, nodes, edges, title, direction
+            )
+        except SpecValidationError as e:
+            RENDER_ERRORS.inc(reason="invalid_spec")
+            return {"ok": False, "error": str(e), "errors": e.errors}
+        except ValueError as e:
+            # Unknown engine or format, or a malformed compact spec
+            RENDER_ERRORS.inc(reason="invalid_spec")
+            return {"ok": False, "error": str(e)}
+        except Exception:
+            RENDER_ERRORS.inc(reason="internal")
+            logger.exception("Failed to prepare a diagram spec for rendering")
+            return {"ok": False, "error": "Internal error while preparing the diagram"}
+        
+        # The diagram store reads and writes the disk; keep that off the event loop
+        cached = await asyncio.to_thread(
+            self._cached_result, base_name, output_format, clusters, nodes, edges, title, direction
+        )
+        if cached:
+            return dict(cached, repairs=repairs)
+        
+        async def render_and_store() -> Dict[str, Any]:
+            started = time.perf_counter()
+            try:
+                rendered = await render_pool.run(_render_in_worker, canonical, engine, output_format)
+            except RenderQueueFullError:
+                RENDER_ERRORS.inc(reason="queue_full")
+                raise
+            except RenderTimeoutError:
+                RENDER_ERRORS.inc(reason="timeout")
+                raise
+            events = rendered.pop("metrics", [])
+            metrics.replay(events)
+            # Whatever the worker did not account for was spent waiting for
+            # a free worker and shipping the spec and image between processes
+            worker_seconds = sum(event[2] for event in events if event[0] == "stage")
+            record_stage("render_queue", max(0.0, time.perf_counter() - started - worker_seconds))
+            if not rendered["ok"]:
+                RENDER_ERRORS.inc(reason="error")
+                return rendered
+            await asyncio.to_thread(
+                self._store_render,
+                base_name, base_filename_prefix, engine, canonical, output_format, rendered["image"]
+            )
+            return self._build_result(base_name, output_format, clusters, nodes, edges, title, direction)
+        
+        # Callers sharing a render may have sent specs that needed different repairs
+        result = await self._render_flights.do(base_name + suffix, render_and_store)
+        return dict(result, repairs=repairs) if result.get("ok") else result
+    
+    def render_image(self, canonical: Dict[str, Any], engine: str, output_format: str) -> bytes:
+        """
+        Render a canonical specification to image bytes without storing it.
+        
+        Args:
+            canonical: Specification produced by canonicalize_spec
+            engine: Render engine name
+            output_format: One of DIAGRAM_FORMATS
+            
+        Returns:
+            The rendered image
+        """
+        fmt = self._output_format(output_format)
+        clusters, nodes, edges, title, direction = self._validate_spec(canonical)
+        with timed("icons"):
+            # Resolve icons up front so the render below only hits the registry cache
+            fallbacks = sum(1 for n in nodes if self._get_icon_class_with_fallback(n["icon"])[1])
+        FALLBACK_ICONS.inc(fallbacks)
+        create = self._create_diagram_dot if engine == "dot" else self._create_diagram
+        with timed("render"):
+            image = create(clusters, nodes, edges, title, direction, output_format)
+            if fmt.graphviz_format == "svg" and self.svg_inline_icons:
+                image = inline_svg_images(image)
+        return image
+    
+    async def render_variant_async(self, base_name: str, output_format: str) -> Optional[Dict[str, Any]]:
+        """
+        Render another format of an already rendered diagram.
+        
+        Args:
+            base_name: Content-addressed filename without suffix
+            output_format: One of DIAGRAM_FORMATS
+            
+        Returns:
+            Dictionary containing render results, or None if the spec behind
+            the diagram is unknown
+        """
+        stored = await asyncio.to_thread(self.load_spec, base_name)
+        if stored is None:
+            return None
+        return await self.render_diagram_async(
+            stored["spec"], stored["prefix"], stored["engine"], output_format
+        )
+    
+    def variant_name(self, base_name: str, output_format: str) -> str:
+        """
+        Get the artifact name a diagram variant is stored under.
+        
+        Args:
+            base_name: Content-addressed filename without suffix
+            output_format: One of DIAGRAM_FORMATS
+            
+        Returns:
+            Artifact name in the diagram store
+        """
+        return f"{base_name}{self._output_format(output_format).suffix}"
+    
+    def parse_filename(self, filename: str) -> Optional[Tuple[str, str]]:
+        """
+        Split a diagram filename into its base name and output format.
+        
+        Args:
+            filename: Diagram filename, e.g. `azure_arch_<hash>.preview.png`
+            
+        Returns:
+            Tuple of (base_name, output_format), or None if the name does not
+            belong to a diagram variant
+        """
+        if not is_safe_name(filename):
+            return None
+        # Longest suffix first so ".preview.png" is not mistaken for ".png"
+        for output_format, fmt in sorted(DIAGRAM_FORMATS.items(), key=lambda item: -len(item[1].suffix)):
+            if filename.endswith(fmt.suffix):
+                base_name = filename[:-len(fmt.suffix)]
+                if base_name and not base_name.startswith("."):
+                    return base_name, output_format
+                return None
+        return None
+    
+    def load_spec(self, base_name: str) -> Optional[Dict[str, Any]]:
+        """
+        Load the canonical spec a diagram was rendered from.
+        
+        Args:
+            base_name: Content-addressed filename without suffix
+            
+        Returns:
+            Dictionary with `spec`, `prefix` and `engine`, or None if unknown
+        """
+        found = self.store.get(f"{base_name}{SPEC_SUFFIX}")
+        if found is None:
+            return None
+        try:
+            stored = json.loads(found[1].decode("utf-8"))
+        except ValueError:
+            return None
+        if not isinstance(stored, dict) or not isinstance(stored.get("spec"), dict):
+            return None
+        return stored
+    
+    def canonicalize_spec(self, spec: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Build the canonical form of a diagram specification.
+        
+        Compact specs (see services.compact_spec) are expanded and icon codes
+        turned into class paths. Labels and ids are trimmed, labels cut to
+        MAX_LABEL_LENGTH, empty optional fields dropped, the direction
+        defaulted, and nodes, edges and clusters sorted, so specs that only
+        differ in ordering, whitespace or dialect map to the same cache key.
+        
+        Args:
+            spec: The diagram specification
+            
+        Items that are not objects are left out; use prepare_spec to have
+        them reported.
+        
+        Returns:
+            A new, canonicalized specification
+        
+        Raises:
+            ValueError: If a compact spec is malformed
+        """
+        cleaned = self._clean_spec(spec)
+        for key in ("clusters", "nodes", "edges"):
+            cleaned[key] = self._object_items(cleaned[key])
+        return self._sort_spec(cleaned)
+    
+    def prepare_spec(
+        self, 
+        spec: Dict[str, Any], 
+        repair: Optional[bool] = None
+    ) -> Tuple[Dict[str, Any], List[str]]:
+        """
+        Repair if enabled, validate and canonicalize a diagram specification.
+        
+        Repair (see services.spec_repair) and validation run before sorting,
+        so limits keep the first nodes and edges the model wrote and errors
+        point at items by their position in the submitted spec.
+        
+        Args:
+            spec: The diagram specification
+            repair: Whether to repair the spec (defaults to SPEC_AUTO_REPAIR)
+            
+        Returns:
+            Tuple of (canonical specification, descriptions of the repairs made)
+        
+        Raises:
+            SpecValidationError: If the spec is not an object, or with every
+                problem left in the spec
+            ValueError: If a compact spec is malformed
+        """
+        cleaned = self._clean_spec(spec)
+        repairs: List[str] = []
+        if self.auto_repair if repair is None else repair:
+            cleaned, repairs = repair_spec(cleaned, settings.MAX_NODES, settings.MAX_EDGES, self.fallback_icon)
+        validate_diagram_spec(cleaned)
+        return self._sort_spec(cleaned), repairs
+    
+    def _clean_spec(self, spec: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Expand, trim and default a specification without reordering it.
+        
+        Lists and items of the wrong type are kept as they are, so that
+        validation reports them at their position in the submitted spec.
+        
+        Raises:
+            SpecValidationError: If the spec is not an object
+            ValueError: If a compact spec is malformed
+        """
+        if not isinstance(spec, dict):
+            raise SpecValidationError(["Spec must be an object"])
+        if is_compact_spec(spec):
+            spec = expand_compact_spec(spec, icon_registry.lookup_name)
+        
+        direction = str(spec.get("direction") or "LR").strip().upper()
+        if direction not in DIRECTIONS:
+            direction = "LR"
+        
+        clusters = self._canonical_items(spec.get("clusters"), ("id", "label"))
+        nodes = self._canonical_items(spec.get("nodes"), ("id", "label", "icon", "cluster"))
+        for node in self._object_items(nodes):
+            if isinstance(node.get("icon"), str):
+                node["icon"] = expand_icon(node["icon"], icon_registry.lookup_name)
+        edges = self._canonical_items(spec.get("edges"), ("source", "target", "label"))
+        for items in (clusters, nodes, edges):
+            for item in self._object_items(items):
+                if isinstance(item.get("label"), str):
+                    item["label"] = item["label"][:MAX_LABEL_LENGTH]
+        
+        return {
+            "title": str(spec.get("title") or "").strip() or "Azure Architecture",
+            "direction": direction,
+            "clusters": clusters,
+            "nodes": nodes,
+            "edges": edges,
+        }
+    
+    def _sort_spec(self, spec: Dict[str, Any]) -> Dict[str, Any]:
+        """Sort the clusters, nodes and edges of a cleaned specification in place."""
+        spec["clusters"].sort(key=lambda c: str(c.get("id", "")))
+        spec["nodes"].sort(key=lambda n: str(n.get("id", "")))
+        spec["edges"].sort(key=lambda e: (str(e.get("source", "")), str(e.get("target", "")), str(e.get("label", ""))))
+        return spec
+    
+    def spec_cache_key(
+        self, 
+        clusters: List, 
+        nodes: List, 
+        edges: List, 
+        title: str, 
+        direction: str,
+        engine: str = "diagrams"
+    ) -> str:
+        """
+        Hash a validated, canonical specification into a render cache key.
+        
+        Settings that change the rendered image are part of the key, so toggling
+        them never serves a stale image.
+        
+        Args:
+            clusters: Canonical cluster definitions
+            nodes: Canonical node definitions
+            edges: Canonical edge definitions
+            title: Diagram title
+            direction: Layout direction
+            engine: Render engine producing the image
+            
+        Returns:
+            Hex digest identifying the rendered image
+        """
+        material = {
+            "version": RENDER_CACHE_VERSION,
+            "engine": engine,
+            "fallback_icon": self.fallback_icon,
+            "annotate_fallback": self.annotate_fallback,
+            "preview_dpi": self.preview_dpi,
+            "svg_inline_icons": self.svg_inline_icons,
+            "spec": {
+                "title": title,
+                "direction": direction,
+                "clusters": clusters,
+                "nodes": nodes,
+                "edges": edges,
+            },
+        }
+        blob = json.dumps(material, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+        return hashlib.sha256(blob.encode("utf-8")).hexdigest()[:24]
+    
     def extract_json_objects(self, text: str) -> List[Dict]:
         """
         Extract top-level JSON objects from arbitrary text.
@@ -58,103 +495,42 @@ class DiagramService:
         Returns:
             List of parsed JSON objects
         """
-        objects: List[Dict] = []
-        depth = 0
-        start = None
-        in_str = False
-        esc = False
-        
-        for i, ch in enumerate(text or ""):
-            if ch == '"' and not esc:
-                in_str = not in_str
-            if ch == "\\" and not esc:
-                esc = True
-                continue
-            esc = False
-            if in_str:
-                continue
-            if ch == "{":
-                if depth == 0:
-                    start = i
-                depth += 1
-            elif ch == "}":
-                depth -= 1
-                if depth == 0 and start is not None:
-                    chunk = (text or "")[start : i + 1]
-                    try:
-                        objects.append(json.loads(chunk))
-                    except Exception:
-                        pass
-                    start = None
-        return objects
+        return extract_json_objects(text)
     
     def extract_spec_from_text(self, content: str) -> Optional[Dict[str, Any]]:
         """
         Extract diagram specification from text content.
         
+        Scanning stops at the first object that carries a DiagramSpec, either
+        directly or in a tool-call style `arguments` field.
+        
         Args:
             content: Text content containing diagram specification
             
         Returns:
             Diagram specification dict or None if not found
         """
-        for obj in self.extract_json_objects(content or ""):
-            if isinstance(obj, dict) and "nodes" in obj and "edges" in obj:
-                return obj
-            if isinstance(obj, dict) and "arguments" in obj:
-                args = obj["arguments"]
-                if isinstance(args, str):
-                    try:
-                        args = json.loads(args)
-                    except Exception:
-                        args = None
-                if isinstance(args, dict) and "nodes" in args and "edges" in args:
-                    return args
-        return None
+        return find_diagram_spec(content)
     
     def _validate_spec(self, spec: Dict[str, Any]) -> Tuple[List, List, List, str, str]:
         """
-        Validate and normalize diagram specification.
+        Validate a canonical diagram specification against the DiagramSpec model.
         
         Args:
-            spec: The diagram specification to validate
+            spec: The canonical specification to validate
             
         Returns:
             Tuple of (clusters, nodes, edges, title, direction)
-        """
-        title = spec.get("title") or "Azure Architecture"
-        direction = spec.get("direction") or "LR"
-        if direction not in ("LR", "TB", "RL", "BT"):
-            direction = "LR"
         
-        clusters = spec.get("clusters") or []
-        nodes = spec.get("nodes") or []
-        edges = spec.get("edges") or []
-        
-        # Validate limits
-        if len(nodes) > settings.MAX_NODES:
-            raise ValueError(f"Too many nodes (limit {settings.MAX_NODES}).")
-        if len(edges) > settings.MAX_EDGES:
-            raise ValueError(f"Too many edges (limit {settings.MAX_EDGES}).")
-        
-        # Validate node IDs are unique
-        ids = set()
-        for n in nodes:
-            nid = n["id"]
-            if nid in ids:
-                raise ValueError(f"Duplicate node id: {nid}")
-            ids.add(nid)
-            if "label" in n and n["label"]:
-                n["label"] = n["label"][:120]
-        
-        # Validate edges reference existing nodes
-        for e in edges:
-            if e["source"] not in ids or e["target"] not in ids:
-                raise ValueError(f"Edge refers to unknown node(s): {e}")
-            if "label" in e and e["label"]:
-                e["label"] = e["label"][:120]
-        
-        return clusters, nodes, edges, title, direction
+        Raises:
+            SpecValidationError: With every problem found in the spec
+        """
+        validate_diagram_spec(spec)
+        return self._spec_parts(spec)
+    
+    def _spec_parts(self, canonical: Dict[str, Any]) -> Tuple[List, List, List, str, str]:
+        """Split a validated, canonical specification into (clusters, nodes, edges, title, direction)."""
+        return canonical["clusters"], canonical["nodes"], canonical["edges"], canonical["title"], canonical["direction"]
     
     def _create_diagram(
         self, 
@@ -163,38 +539,55 @@ class DiagramService:
         edges: List, 
         title: str, 
         direction: str, 
-        base_filename_prefix: str
-    ) -> Dict[str, Any]:
+        output_format: str = "png"
+    ) -> bytes:
         """
         Create the actual diagram using mingrammer/diagrams.
         
+        mingrammer/diagrams only renders to files, so it works in a temporary
+        directory that is removed, intermediate files included, afterwards.
+        
         Args:
             clusters: List of cluster definitions
             nodes: List of node definitions
             edges: List of edge definitions
             title: Diagram title
             direction: Layout direction
-            base_filename_prefix: Filename prefix
+            output_format: One of DIAGRAM_FORMATS
             
         Returns:
-            Dictionary with creation results
+            The rendered image
         """
+        with tempfile.TemporaryDirectory(prefix="diagram-") as tmp:
+            return self._create_diagram_in(tmp, clusters, nodes, edges, title, direction, output_format)
+    
+    def _create_diagram_in(
+        self, 
+        tmp_dir: str, 
+        clusters: List, 
+        nodes: List, 
+        edges: List, 
+        title: str, 
+        direction: str, 
+        output_format: str
+    ) -> bytes:
+        """Render with mingrammer/diagrams inside a scratch directory."""
         from diagrams import Diagram, Cluster, Edge
         
-        stamp = int(time.time())
-        base_name = f"{base_filename_prefix}_{stamp}"
-        file_png = self.output_dir / f"{base_name}.png"
+        fmt = self._output_format(output_format)
+        stem = os.path.join(tmp_dir, "diagram")
         
         cluster_objs: Dict[str, Any] = {}
         node_objs: Dict[str, Any] = {}
         
+        # mingrammer/diagrams appends the Graphviz format to the filename
         with Diagram(
             title,
-            filename=str(self.output_dir / base_name),
-            outformat="png",
+            filename=stem,
+            outformat=fmt.graphviz_format,
             show=False,
             direction=direction,
-            graph_attr={"pad": "0.2", "splines": "ortho"}
+            graph_attr=self._graph_attr(output_format)
         ):
             # Create clusters
             for c in clusters:
@@ -242,13 +635,198 @@ class DiagramService:
                 else:
                     src >> tgt
         
-        if not file_png.exists():
-            return {"ok": False, "error": "Diagram not produced"}
+        file_out = Path(f"{stem}.{fmt.graphviz_format}")
+        if not file_out.exists():
+            raise RuntimeError("Diagram not produced")
+        return file_out.read_bytes()
+    
+    def _create_diagram_dot(
+        self, 
+        clusters: List, 
+        nodes: List, 
+        edges: List, 
+        title: str, 
+        direction: str, 
+        output_format: str = "png"
+    ) -> bytes:
+        """
+        Create the diagram by compiling DOT directly and piping it through Graphviz.
+        
+        Uses the same icons and styling as mingrammer/diagrams, but skips its
+        global-context object model and the intermediate `.dot` file: the image
+        comes back in memory without touching the disk.
+        
+        Args:
+            clusters: List of cluster definitions
+            nodes: List of node definitions
+            edges: List of edge definitions
+            title: Diagram title
+            direction: Layout direction
+            output_format: One of DIAGRAM_FORMATS
+            
+        Returns:
+            The rendered image
+        """
+        fmt = self._output_format(output_format)
+        source = dot_renderer.compile(
+            clusters, nodes, edges, title, direction,
+            resolve_icon=self._get_icon_class_with_fallback,
+            annotate_fallback=self.annotate_fallback,
+            graph_attr=self._graph_attr(output_format),
+        )
+        return dot_renderer.render(source, fmt.graphviz_format, timeout=settings.RENDER_TIMEOUT_SECONDS)
+    
+    def _store_render(
+        self, 
+        base_name: str, 
+        prefix: str, 
+        engine: str, 
+        canonical: Dict[str, Any], 
+        output_format: str, 
+        image: bytes
+    ) -> None:
+        """
+        Store a rendered image, together with the spec behind it so other
+        formats can be rendered later.
+        """
+        spec_name = f"{base_name}{SPEC_SUFFIX}"
+        with timed("store"):
+            if self.store.stat(spec_name) is None:
+                stored = {"prefix": prefix, "engine": engine, "spec": canonical}
+                self.store.put(spec_name, json.dumps(stored, ensure_ascii=False).encode("utf-8"))
+            self.store.put(self.variant_name(base_name, output_format), image)
+    
+    def _graph_attr(self, output_format: str) -> Dict[str, str]:
+        """Get the graph attributes for an output format; previews render at a lower DPI."""
+        if output_format == "preview":
+            return {**GRAPH_ATTR, "dpi": str(self.preview_dpi)}
+        return GRAPH_ATTR
+    
+    def _output_format(self, output_format: str) -> OutputFormat:
+        """
+        Look up an output format.
+        
+        Args:
+            output_format: Requested format name
+            
+        Returns:
+            The format description
+        """
+        fmt = DIAGRAM_FORMATS.get(output_format)
+        if fmt is None:
+            raise ValueError(
+                f"Unknown output format '{output_format}' (expected one of {', '.join(DIAGRAM_FORMATS)})"
+            )
+        return fmt
+    
+    def _engine(self, engine: Optional[str]) -> str:
+        """
+        Resolve the render engine for a request.
+        
+        Args:
+            engine: Requested engine name, or None for the configured default
+            
+        Returns:
+            A valid engine name
+        """
+        engine = (engine or settings.RENDER_ENGINE).lower()
+        if engine not in RENDER_ENGINES:
+            raise ValueError(f"Unknown render engine '{engine}' (expected one of {', '.join(RENDER_ENGINES)})")
+        return engine
+    
+    def _canonical_items(self, items: Any, keys: Tuple[str, ...]) -> Any:
+        """
+        Copy spec items keeping only known keys, with strings trimmed.
         
+        Args:
+            items: Raw list of clusters, nodes or edges
+            keys: Keys that affect rendering
+            
+        Returns:
+            List of cleaned item dictionaries; a value that is not a list,
+            and items that are not objects, are returned unchanged
+        """
+        if items is None:
+            return []
+        if not isinstance(items, list):
+            return items
+        cleaned: List[Any] = []
+        for item in items:
+            if not isinstance(item, dict):
+                cleaned.append(item)
+                continue
+            entry: Dict[str, Any] = {}
+            for key in keys:
+                value = item.get(key)
+                if isinstance(value, str):
+                    value = value.strip()
+                if value not in (None, ""):
+                    entry[key] = value
+            cleaned.append(entry)
+        return cleaned
+    
+    def _object_items(self, items: Any) -> List[Dict[str, Any]]:
+        """Get the object items of a cleaned list, skipping anything else."""
+        if not isinstance(items, list):
+            return []
+        return [item for item in items if isinstance(item, dict)]
+    
+    def _base_name(
+        self, 
+        prefix: str, 
+        engine: str, 
+        clusters: List, 
+        nodes: List, 
+        edges: List, 
+        title: str, 
+        direction: str
+    ) -> str:
+        """Get the content-addressed output filename (without extension)."""
+        return f"{prefix}_{self.spec_cache_key(clusters, nodes, edges, title, direction, engine)}"
+    
+    def _cached_result(
+        self, 
+        base_name: str, 
+        output_format: str, 
+        clusters: List, 
+        nodes: List, 
+        edges: List, 
+        title: str, 
+        direction: str
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Get the result for an already rendered image, skipping Graphviz.
+        
+        Returns:
+            Render result dictionary, or None on a cache miss
+        """
+        if self.store.stat(self.variant_name(base_name, output_format)) is None:
+            return None
+        result = self._build_result(base_name, output_format, clusters, nodes, edges, title, direction)
+        result["cached"] = True
+        return result
+    
+    def _build_result(
+        self, 
+        base_name: str, 
+        output_format: str, 
+        clusters: List, 
+        nodes: List, 
+        edges: List, 
+        title: str, 
+        direction: str
+    ) -> Dict[str, Any]:
+        """Build the render result dictionary for a stored image."""
+        filename = self.variant_name(base_name, output_format)
+        local_path = self.store.local_path(filename)
         return {
             "ok": True,
-            "path": str(file_png),
-            "url": f"/static/diagrams/{file_png.name}",
+            "id": base_name,
+            "filename": filename,
+            "path": str(local_path) if local_path else None,
+            "url": f"/static/diagrams/{filename}",
+            "format": output_format,
+            "media_type": DIAGRAM_FORMATS[output_format].media_type,
             "summary": {
                 "title": title,
                 "direction": direction,
@@ -258,28 +836,25 @@ class DiagramService:
             },
         }
     
-    def _import_icon_class_or_none(self, qualified_path: str) -> Optional[Any]:
+    def _fallback_icon_class(self) -> Any:
         """
-        Import an icon class by its qualified path.
+        Get the generic icon class used when a requested icon is unavailable.
         
-        Args:
-            qualified_path: Fully qualified class path
-            
         Returns:
-            The imported class or None if import fails
+            The fallback icon class
         """
-        try:
-            parts = qualified_path.split(".")
-            module_path, class_name = ".".join(parts[:-1]), parts[-1]
-            mod = importlib.import_module(module_path)
-            return getattr(mod, class_name, None)
-        except Exception:
-            return None
+        cls = icon_registry.get(self.fallback_icon)
+        if cls is None:
+            raise RuntimeError(f"Fallback icon '{self.fallback_icon}' could not be imported.")
+        return cls
     
     def _get_icon_class_with_fallback(self, qualified_path: str) -> Tuple[Any, bool]:
         """
         Get icon class with fallback to default if not found.
         
+        Near-miss paths (wrong case, plural or module, common aliases) are
+        corrected through the icon registry instead of falling back.
+        
         Args:
             qualified_path: Fully qualified class path
             
@@ -288,28 +863,17 @@ class DiagramService:
         """
         # Check prefix allowlist
         if not qualified_path.startswith(self.allowed_icon_prefixes):
-            cls = self._import_icon_class_or_none(self.fallback_icon)
-            if cls is None:
-                raise RuntimeError(f"Fallback icon '{self.fallback_icon}' could not be imported.")
-            return cls, True
+            return self._fallback_icon_class(), True
+        
+        resolution = icon_registry.resolve(qualified_path)
+        if resolution is None:
+            return self._fallback_icon_class(), True
         
         # Check strict allowlist if configured
-        if self.strict_whitelist is not None and qualified_path not in self.strict_whitelist:
-            cls = self._import_icon_class_or_none(self.fallback_icon)
-            if cls is None:
-                raise RuntimeError(f"Fallback icon '{self.fallback_icon}' could not be imported.")
-            return cls, True
-        
-        # Try to import the requested icon
-        cls = self._import_icon_class_or_none(qualified_path)
-        if cls is not None:
-            return cls, False
-        
-        # Fall back to default icon
-        cls = self._import_icon_class_or_none(self.fallback_icon)
-        if cls is None:
-            raise RuntimeError(f"Fallback icon '{self.fallback_icon}' could not be imported.")
-        return cls, True
+        if self.strict_whitelist is not None and resolution.path not in self.strict_whitelist:
+            return self._fallback_icon_class(), True
+        
+        return resolution.cls, False
 
 
 # Global service instance
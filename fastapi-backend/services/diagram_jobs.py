@@ -0,0 +1,291 @@
+"""
+In-process job queue for rendering diagrams in the background.
+"""
+
+import asyncio
+import contextvars
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from config.settings import settings
+from services.diagram import diagram_service
+from services.metrics import metrics
+from services.render_pool import RenderQueueFullError
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+
+FINISHED_STATES = (JOB_SUCCEEDED, JOB_FAILED, JOB_CANCELLED)
+
+
+class JobQueueFullError(Exception):
+    """Raised when too many diagram jobs are waiting to be rendered."""
+    
+    def __init__(self, retry_after: int):
+        super().__init__("Too many diagram jobs are queued, please retry shortly")
+        self.retry_after = retry_after
+
+
+class DiagramJob:
+    """A diagram render request tracked from submission until it expires."""
+    
+    def __init__(self, spec: Dict[str, Any], engine: Optional[str], output_format: str):
+        """
+        Initialize a queued job.
+        
+        Args:
+            spec: The diagram specification
+            engine: Render engine override
+            output_format: Format the diagram is rendered in
+        """
+        self.id = uuid.uuid4().hex
+        self.spec = spec
+        self.engine = engine
+        self.output_format = output_format
+        self.status = JOB_QUEUED
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.errors: Optional[List[str]] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.expires_at: Optional[float] = None
+        self._task: Optional["asyncio.Task[Dict[str, Any]]"] = None
+    
+    @property
+    def finished(self) -> bool:
+        """Whether the job has reached a final state."""
+        return self.status in FINISHED_STATES
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Describe the job for API responses.
+        
+        Returns:
+            Job status, timing in milliseconds, and the result once done
+        """
+        now = time.time()
+        started = self.started_at or self.finished_at
+        timing = {
+            "queued_ms": round(((started or now) - self.created_at) * 1000, 1),
+            "render_ms": round(((self.finished_at or now) - self.started_at) * 1000, 1) if self.started_at else None,
+            "total_ms": round(((self.finished_at or now) - self.created_at) * 1000, 1),
+        }
+        data: Dict[str, Any] = {
+            "id": self.id,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "expires_at": self.expires_at,
+            "timing": timing,
+        }
+        if self.result is not None:
+            filename = self.result["filename"]
+            data["result"] = {
+                "id": self.result["id"],
+                "url": self.result["url"],
+                "download": f"/download/{filename}",
+                "format": self.result["format"],
+                "summary": self.result["summary"],
+                "cached": bool(self.result.get("cached")),
+                "repairs": self.result.get("repairs") or [],
+            }
+        if self.error is not None:
+            data["error"] = self.error
+        if self.errors is not None:
+            data["errors"] = self.errors
+        return data
+
+
+class DiagramJobQueue:
+    """Bounded FIFO of diagram jobs served by a fixed set of worker tasks."""
+    
+    def __init__(self):
+        """Initialize limits from settings; workers start with the first job."""
+        self.workers = max(1, settings.DIAGRAM_JOB_WORKERS)
+        self.max_pending = max(1, settings.DIAGRAM_JOB_MAX_PENDING)
+        self.ttl_seconds = settings.DIAGRAM_JOB_TTL_SECONDS
+        self.retry_after = settings.RENDER_RETRY_AFTER_SECONDS
+        self._jobs: "OrderedDict[str, DiagramJob]" = OrderedDict()
+        self._queue: Optional["asyncio.Queue[DiagramJob]"] = None
+        # Jobs waiting for a worker; cancelled jobs still in the queue do not count
+        self._pending = 0
+        self._worker_tasks: List["asyncio.Task[None]"] = []
+    
+    def submit(
+        self,
+        spec: Dict[str, Any],
+        engine: Optional[str] = None,
+        output_format: str = "png"
+    ) -> DiagramJob:
+        """
+        Queue a diagram for rendering.
+        
+        Args:
+            spec: The diagram specification
+            engine: Render engine override
+            output_format: Format the diagram is rendered in
+        
+        Returns:
+            The queued job
+        
+        Raises:
+            JobQueueFullError: If DIAGRAM_JOB_MAX_PENDING jobs are already waiting
+        """
+        self._expire()
+        self._ensure_workers()
+        if self._pending >= self.max_pending:
+            raise JobQueueFullError(self.retry_after)
+        
+        job = DiagramJob(spec, engine, output_format)
+        self._jobs[job.id] = job
+        self._queue.put_nowait(job)
+        self._pending += 1
+        return job
+    
+    def get(self, job_id: str) -> Optional[DiagramJob]:
+        """
+        Look up a job.
+        
+        Args:
+            job_id: Job identifier returned by submit
+        
+        Returns:
+            The job, or None if it is unknown or has expired
+        """
+        self._expire()
+        return self._jobs.get(job_id)
+    
+    def cancel(self, job_id: str) -> Optional[DiagramJob]:
+        """
+        Cancel a queued or running job; finished jobs are left untouched.
+        
+        A render already handed to a worker process runs to completion there,
+        but its result is discarded for this job.
+        
+        Args:
+            job_id: Job identifier returned by submit
+        
+        Returns:
+            The job, or None if it is unknown or has expired
+        """
+        job = self.get(job_id)
+        if job is None or job.finished:
+            return job
+        if job.status == JOB_QUEUED:
+            self._pending -= 1
+        if job._task is not None:
+            job._task.cancel()
+        self._finish(job, JOB_CANCELLED)
+        return job
+    
+    def stats(self) -> Dict[str, int]:
+        """Get job counts by status."""
+        counts = {status: 0 for status in (JOB_QUEUED, JOB_RUNNING) + FINISHED_STATES}
+        for job in self._jobs.values():
+            counts[job.status] += 1
+        counts["workers"] = self.workers
+        return counts
+    
+    async def shutdown(self) -> None:
+        """Stop the worker tasks, cancelling jobs still in progress."""
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+        self._queue = None
+        self._pending = 0
+    
+    def _ensure_workers(self) -> None:
+        """Start the worker tasks on the running event loop if needed."""
+        if self._queue is not None and all(not task.done() for task in self._worker_tasks):
+            return
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        self._worker_tasks = [task for task in self._worker_tasks if not task.done()]
+        while len(self._worker_tasks) < self.workers:
+            # Start from an empty context so workers do not inherit the
+            # submitting request's state, such as its stage timings
+            task = contextvars.Context().run(asyncio.ensure_future, self._worker())
+            self._worker_tasks.append(task)
+    
+    async def _worker(self) -> None:
+        """Take jobs off the queue and render them one at a time."""
+        while True:
+            job = await self._queue.get()
+            if job.finished:
+                # Cancelled while it was waiting
+                continue
+            self._pending -= 1
+            
+            job.status = JOB_RUNNING
+            job.started_at = time.time()
+            job._task = asyncio.ensure_future(self._render(job))
+            try:
+                await asyncio.wait({job._task})
+            finally:
+                if not job._task.done():
+                    job._task.cancel()
+            
+            if job.finished:
+                continue
+            if job._task.exception() is not None:
+                job.error = str(job._task.exception()) or repr(job._task.exception())
+                self._finish(job, JOB_FAILED)
+                continue
+            
+            result = job._task.result()
+            if result.get("ok"):
+                job.result = result
+                self._finish(job, JOB_SUCCEEDED)
+            else:
+                job.error = result.get("error", "Failed to render diagram")
+                job.errors = result.get("errors")
+                self._finish(job, JOB_FAILED)
+    
+    async def _render(self, job: DiagramJob) -> Dict[str, Any]:
+        """Render a job's diagram, waiting for room when the render pool is full."""
+        while True:
+            try:
+                return await diagram_service.render_diagram_async(
+                    job.spec, engine=job.engine, output_format=job.output_format
+                )
+            except RenderQueueFullError as e:
+                await asyncio.sleep(e.retry_after)
+    
+    def _finish(self, job: DiagramJob, status: str) -> None:
+        """Move a job to a final state and start its expiry clock."""
+        job.status = status
+        job.finished_at = time.time()
+        job.expires_at = job.finished_at + self.ttl_seconds
+        job.spec = {}
+        # Keep jobs ordered by expiry so _expire can stop at the first live one
+        self._jobs.move_to_end(job.id)
+    
+    def _expire(self) -> None:
+        """Forget finished jobs whose results have expired."""
+        now = time.time()
+        for job_id in list(self._jobs):
+            job = self._jobs[job_id]
+            if not job.finished:
+                continue
+            if job.expires_at > now:
+                break
+            del self._jobs[job_id]
+
+
+# Global job queue instance
+diagram_jobs = DiagramJobQueue()
+
+metrics.gauge(
+    "diagram_service_diagram_jobs",
+    "Diagram jobs by status",
+    ("status",),
+    lambda: {(status,): count for status, count in diagram_jobs.stats().items() if status != "workers"},
+)
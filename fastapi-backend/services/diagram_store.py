@@ -0,0 +1,433 @@
+"""
+Bounded storage for rendered diagrams with pluggable backends.
+"""
+
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from config.settings import settings
+from services.metrics import metrics
+
+# Artifact names are a base name plus dotted suffixes, e.g.
+# `azure_arch_<hash>.preview.png`; anything else is rejected before it can
+# reach a backend, which rules out path traversal and header injection.
+_SAFE_NAME = re.compile(r"[A-Za-z0-9_-]+(\.[A-Za-z0-9]+)*")
+
+
+class StoredArtifact(NamedTuple):
+    """Index entry for one stored file."""
+    name: str
+    size: int
+    etag: Optional[str]
+    created_at: float
+
+
+def is_safe_name(name: str) -> bool:
+    """
+    Check whether a name may be used as an artifact name.
+    
+    Args:
+        name: Candidate artifact name
+    
+    Returns:
+        True if the name is a plain filename without path components
+    """
+    return bool(name) and len(name) <= 255 and _SAFE_NAME.fullmatch(name) is not None
+
+
+def group_of(name: str) -> str:
+    """
+    Get the group an artifact belongs to.
+    
+    All formats of a diagram and its spec share the base name before the first
+    dot, and are kept or evicted together.
+    
+    Args:
+        name: Artifact name
+    
+    Returns:
+        The group (base) name
+    """
+    return name.split(".", 1)[0]
+
+
+def compute_etag(data: bytes) -> str:
+    """Build a strong ETag from an artifact's content."""
+    return '"' + hashlib.sha256(data).hexdigest()[:32] + '"'
+
+
+class StorageBackend:
+    """Where artifact bytes live; the DiagramStore keeps the index and limits."""
+    
+    name = "abstract"
+    
+    def write(self, name: str, data: bytes) -> None:
+        """Store an artifact, replacing any previous content atomically."""
+        raise NotImplementedError
+    
+    def read(self, name: str) -> Optional[bytes]:
+        """Read an artifact, or None if it does not exist."""
+        raise NotImplementedError
+    
+    def read_range(self, name: str, start: int, end: int) -> Optional[bytes]:
+        """Read bytes [start, end) of an artifact, or None if it does not exist."""
+        data = self.read(name)
+        return data[start:end] if data is not None else None
+    
+    def delete(self, name: str) -> None:
+        """Delete an artifact if it exists."""
+        raise NotImplementedError
+    
+    def scan(self) -> List[Tuple[str, int, float]]:
+        """List existing artifacts as (name, size, modified time)."""
+        raise NotImplementedError
+    
+    def local_path(self, name: str) -> Optional[Path]:
+        """Get the artifact's path on the local filesystem, if it has one."""
+        return None
+
+
+class LocalDiskBackend(StorageBackend):
+    """Stores artifacts as files in a directory."""
+    
+    name = "local"
+    
+    def __init__(self, directory: str):
+        """
+        Initialize the backend.
+        
+        Args:
+            directory: Directory holding the artifacts; created if missing
+        """
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+    
+    def write(self, name: str, data: bytes) -> None:
+        """Write through a temporary file so readers never see partial content."""
+        path = self.directory / name
+        tmp_path = path.with_name(f".{name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+    
+    def read(self, name: str) -> Optional[bytes]:
+        """Read an artifact file."""
+        try:
+            return (self.directory / name).read_bytes()
+        except FileNotFoundError:
+            return None
+    
+    def read_range(self, name: str, start: int, end: int) -> Optional[bytes]:
+        """Read part of an artifact file without reading the rest."""
+        try:
+            with (self.directory / name).open("rb") as f:
+                f.seek(start)
+                return f.read(max(0, end - start))
+        except FileNotFoundError:
+            return None
+    
+    def delete(self, name: str) -> None:
+        """Delete an artifact file."""
+        try:
+            (self.directory / name).unlink()
+        except FileNotFoundError:
+            pass
+    
+    def scan(self) -> List[Tuple[str, int, float]]:
+        """List artifact files, skipping temporary and foreign files."""
+        found: List[Tuple[str, int, float]] = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.is_file() and is_safe_name(entry.name):
+                    stat = entry.stat()
+                    found.append((entry.name, stat.st_size, stat.st_mtime))
+        return found
+    
+    def local_path(self, name: str) -> Optional[Path]:
+        """Get the artifact file's path."""
+        return self.directory / name
+
+
+class MemoryBackend(StorageBackend):
+    """Keeps artifacts in process memory; intended for tests."""
+    
+    name = "memory"
+    
+    def __init__(self):
+        """Initialize an empty backend."""
+        self._data: Dict[str, Tuple[bytes, float]] = {}
+    
+    def write(self, name: str, data: bytes) -> None:
+        """Store an artifact in memory."""
+        self._data[name] = (bytes(data), time.time())
+    
+    def read(self, name: str) -> Optional[bytes]:
+        """Read an artifact from memory."""
+        entry = self._data.get(name)
+        return entry[0] if entry else None
+    
+    def delete(self, name: str) -> None:
+        """Drop an artifact from memory."""
+        self._data.pop(name, None)
+    
+    def scan(self) -> List[Tuple[str, int, float]]:
+        """List the artifacts held in memory."""
+        return [(name, len(data), mtime) for name, (data, mtime) in self._data.items()]
+
+
+class DiagramStore:
+    """
+    Index of stored artifacts with eviction by total bytes and idle age.
+    
+    Methods read and write the backend and block; async code calls them
+    through asyncio.to_thread.
+    """
+    
+    def __init__(self, backend: StorageBackend, max_bytes: int, max_age_seconds: float):
+        """
+        Initialize the store; the index is built from the backend on first use.
+        
+        Args:
+            backend: Where artifact bytes are kept
+            max_bytes: Upper bound for the total size of all artifacts
+            max_age_seconds: Evict groups not accessed for this long (0 disables)
+        """
+        self.backend = backend
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        # Groups in least recently used order, each mapping names to entries
+        self._groups: "OrderedDict[str, Dict[str, StoredArtifact]]" = OrderedDict()
+        self._accessed: Dict[str, float] = {}
+        self._bytes = 0
+        self._lock = threading.RLock()
+        self._loaded = False
+        self.evictions = 0
+    
+    def put(self, name: str, data: bytes) -> StoredArtifact:
+        """
+        Store an artifact and evict old groups if limits are exceeded.
+        
+        Args:
+            name: Artifact name
+            data: Artifact content
+        
+        Returns:
+            The index entry
+        
+        Raises:
+            ValueError: If the name is not a safe artifact name
+        """
+        self._check_name(name)
+        with self._lock:
+            self._load()
+            self.backend.write(name, data)
+            self._unindex(name)
+            artifact = StoredArtifact(name, len(data), compute_etag(data), time.time())
+            self._index(artifact)
+            self._touch(group_of(name))
+            self._evict(keep=group_of(name))
+            return artifact
+    
+    def get(self, name: str) -> Optional[Tuple[StoredArtifact, bytes]]:
+        """
+        Read an artifact and mark its group as recently used.
+        
+        Args:
+            name: Artifact name
+        
+        Returns:
+            Tuple of (entry, content), or None if it is not stored
+        """
+        if not is_safe_name(name):
+            return None
+        with self._lock:
+            self._load()
+            self._evict()
+            artifact = self._lookup(name)
+            if artifact is None:
+                return None
+            data = self.backend.read(name)
+            if data is None:
+                # Removed behind our back, e.g. by another process's eviction
+                self._unindex(name)
+                return None
+            if artifact.etag is None or artifact.size != len(data):
+                artifact = artifact._replace(size=len(data), etag=compute_etag(data))
+                self._unindex(name)
+                self._index(artifact)
+            self._touch(group_of(name))
+            return artifact, data
+    
+    def stat(self, name: str) -> Optional[StoredArtifact]:
+        """
+        Check whether an artifact is stored, marking its group as recently used.
+        
+        Args:
+            name: Artifact name
+        
+        Returns:
+            The index entry, or None if it is not stored
+        """
+        if not is_safe_name(name):
+            return None
+        with self._lock:
+            self._load()
+            self._evict()
+            artifact = self._lookup(name)
+            if artifact is not None:
+                self._touch(group_of(name))
+            return artifact
+    
+    def describe(self, name: str) -> Optional[StoredArtifact]:
+        """
+        Get an artifact's index entry with its ETag, marking its group as recently used.
+        
+        Artifacts found on the backend at start-up are read once to compute
+        their ETag; everything else is answered from the index.
+        
+        Args:
+            name: Artifact name
+        
+        Returns:
+            The index entry, or None if it is not stored
+        """
+        artifact = self.stat(name)
+        if artifact is None or artifact.etag is not None:
+            return artifact
+        found = self.get(name)
+        return found[0] if found else None
+    
+    def read_range(self, name: str, start: int, end: int) -> Optional[bytes]:
+        """
+        Read part of an artifact and mark its group as recently used.
+        
+        Args:
+            name: Artifact name
+            start: First byte
+            end: Byte after the last one
+        
+        Returns:
+            The bytes, or None if the artifact is not stored
+        """
+        if self.stat(name) is None:
+            return None
+        return self.backend.read_range(name, start, end)
+    
+    def local_path(self, name: str) -> Optional[Path]:
+        """Get an artifact's local filesystem path, if the backend has one."""
+        if not is_safe_name(name):
+            return None
+        return self.backend.local_path(name)
+    
+    def stats(self) -> Dict[str, object]:
+        """Get occupancy, limits and eviction count."""
+        with self._lock:
+            self._load()
+            return {
+                "backend": self.backend.name,
+                "groups": len(self._groups),
+                "artifacts": sum(len(files) for files in self._groups.values()),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "max_age_seconds": self.max_age_seconds,
+                "evictions": self.evictions,
+            }
+    
+    def _check_name(self, name: str) -> None:
+        """Reject names that are not plain artifact filenames."""
+        if not is_safe_name(name):
+            raise ValueError(f"Invalid artifact name: {name!r}")
+    
+    def _load(self) -> None:
+        """Build the index from what the backend already holds."""
+        if self._loaded:
+            return
+        self._loaded = True
+        for name, size, mtime in sorted(self.backend.scan(), key=lambda item: item[2]):
+            self._index(StoredArtifact(name, size, None, mtime))
+            group = group_of(name)
+            self._accessed[group] = max(self._accessed.get(group, 0.0), mtime)
+            self._groups.move_to_end(group)
+    
+    def _lookup(self, name: str) -> Optional[StoredArtifact]:
+        """Find an artifact in the index."""
+        files = self._groups.get(group_of(name))
+        return files.get(name) if files else None
+    
+    def _index(self, artifact: StoredArtifact) -> None:
+        """Add an artifact to the index."""
+        self._groups.setdefault(group_of(artifact.name), {})[artifact.name] = artifact
+        self._bytes += artifact.size
+    
+    def _unindex(self, name: str) -> None:
+        """Remove an artifact from the index."""
+        group = group_of(name)
+        files = self._groups.get(group)
+        if not files or name not in files:
+            return
+        self._bytes -= files.pop(name).size
+        if not files:
+            del self._groups[group]
+            self._accessed.pop(group, None)
+    
+    def _touch(self, group: str) -> None:
+        """Mark a group as most recently used."""
+        if group in self._groups:
+            self._groups.move_to_end(group)
+            self._accessed[group] = time.time()
+    
+    def _evict(self, keep: Optional[str] = None) -> None:
+        """
+        Delete least recently used groups that are too old or over the byte budget.
+        
+        Args:
+            keep: Group that must survive, e.g. the one just written
+        """
+        cutoff = time.time() - self.max_age_seconds if self.max_age_seconds > 0 else None
+        for group in list(self._groups):
+            if group == keep:
+                continue
+            too_old = cutoff is not None and self._accessed.get(group, 0.0) < cutoff
+            if not too_old and self._bytes <= self.max_bytes:
+                break
+            for name in list(self._groups[group]):
+                self.backend.delete(name)
+                self._unindex(name)
+            self.evictions += 1
+
+
+def create_backend(kind: str) -> StorageBackend:
+    """
+    Create the storage backend selected in settings.
+    
+    Args:
+        kind: "local" or "memory"
+    
+    Returns:
+        The backend instance
+    """
+    if kind == "local":
+        return LocalDiskBackend(settings.DIAGRAM_OUTPUT_DIR)
+    if kind == "memory":
+        return MemoryBackend()
+    raise ValueError(f"Unknown diagram store backend '{kind}' (expected 'local' or 'memory')")
+
+
+# Global store instance
+diagram_store = DiagramStore(
+    create_backend(settings.DIAGRAM_STORE_BACKEND),
+    settings.DIAGRAM_STORE_MAX_BYTES,
+    settings.DIAGRAM_STORE_MAX_AGE_SECONDS,
+)
+
+metrics.gauge(
+    "diagram_service_diagram_store",
+    "Diagram store occupancy",
+    ("stat",),
+    lambda: {(stat,): diagram_store.stats()[stat] for stat in ("bytes", "artifacts", "groups", "evictions")},
+)
@@ -0,0 +1,250 @@
+"""
+Direct Graphviz renderer compiling diagram specs to DOT without mingrammer's context API.
+"""
+
+import base64
+import functools
+import html
+import mimetypes
+import os
+import re
+import subprocess
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from config.settings import settings
+
+# Styling copied from mingrammer/diagrams so both engines produce the same look
+GRAPH_ATTRS: Dict[str, str] = {
+    "pad": "2.0",
+    "splines": "ortho",
+    "nodesep": "0.60",
+    "ranksep": "0.75",
+    "fontname": "Sans-Serif",
+    "fontsize": "15",
+    "fontcolor": "#2D3436",
+}
+NODE_ATTRS: Dict[str, str] = {
+    "shape": "box",
+    "style": "rounded",
+    "fixedsize": "true",
+    "width": "1.4",
+    "height": "1.4",
+    "labelloc": "b",
+    "imagescale": "true",
+    "fontname": "Sans-Serif",
+    "fontsize": "13",
+    "fontcolor": "#2D3436",
+}
+EDGE_ATTRS: Dict[str, str] = {
+    "color": "#7B8894",
+}
+EDGE_LABEL_ATTRS: Dict[str, str] = {
+    "fontcolor": "#2D3436",
+    "fontname": "Sans-Serif",
+    "fontsize": "13",
+}
+CLUSTER_ATTRS: Dict[str, str] = {
+    "shape": "box",
+    "style": "rounded",
+    "labeljust": "l",
+    "pencolor": "#AEB6BE",
+    "fontname": "Sans-Serif",
+    "fontsize": "12",
+    "rankdir": "LR",
+    "bgcolor": "#E5F5FD",
+}
+ICON_NODE_HEIGHT = 1.9
+
+# Graphviz SVG output references node images by their path on this machine
+_SVG_IMAGE_HREF = re.compile(rb'(<image\b[^>]*?\b(?:xlink:)?href=")([^"]+)(")')
+
+
+def quote(value: Any) -> str:
+    """Quote a value as a DOT string literal."""
+    text = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return f'"{text}"'
+
+
+def format_attrs(attrs: Dict[str, Any]) -> str:
+    """Format an attribute dictionary as a DOT attribute list."""
+    return " ".join(f"{key}={quote(value)}" for key, value in attrs.items())
+
+
+def icon_image_path(cls: Any) -> Optional[str]:
+    """
+    Get the PNG file mingrammer/diagrams would use for an icon class.
+    
+    Args:
+        cls: A diagrams Node subclass
+    
+    Returns:
+        Absolute path to the icon image, or None for classes without an icon
+    """
+    if not getattr(cls, "_icon", None):
+        return None
+    import diagrams
+    
+    package_root = Path(os.path.abspath(os.path.dirname(diagrams.__file__))).parent
+    return os.path.join(package_root, cls._icon_dir, cls._icon)
+
+
+def inline_svg_images(svg: bytes) -> bytes:
+    """
+    Embed the images referenced by file path in Graphviz SVG output as data URIs.
+    
+    Without this the SVG only displays on the machine that rendered it.
+    
+    Args:
+        svg: SVG document produced by Graphviz
+    
+    Returns:
+        The SVG with local image references inlined
+    """
+    def replace(match: "re.Match[bytes]") -> bytes:
+        data_uri = _image_data_uri(html.unescape(match.group(2).decode("utf-8")))
+        if data_uri is None:
+            return match.group(0)
+        return match.group(1) + data_uri.encode("ascii") + match.group(3)
+    
+    return _SVG_IMAGE_HREF.sub(replace, svg)
+
+
+@functools.lru_cache(maxsize=512)
+def _image_data_uri(path: str) -> Optional[str]:
+    """Encode a local image file as a data URI, or None if it is not a local file."""
+    if not os.path.isabs(path) or not os.path.isfile(path):
+        return None
+    media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    with open(path, "rb") as f:
+        encoded = base64.b64encode(f.read()).decode("ascii")
+    return f"data:{media_type};base64,{encoded}"
+
+
+class DotRenderer:
+    """Compiles validated specs to DOT and pipes them through Graphviz in memory."""
+    
+    def __init__(self, dot_binary: str = "dot"):
+        """
+        Initialize the renderer.
+        
+        Args:
+            dot_binary: Graphviz `dot` executable to run
+        """
+        self.dot_binary = dot_binary
+    
+    def compile(
+        self,
+        clusters: List,
+        nodes: List,
+        edges: List,
+        title: str,
+        direction: str,
+        resolve_icon: Callable[[str], Tuple[Any, bool]],
+        annotate_fallback: bool = True,
+        graph_attr: Optional[Dict[str, str]] = None
+    ) -> str:
+        """
+        Compile a validated specification to DOT source.
+        
+        Args:
+            clusters: List of cluster definitions
+            nodes: List of node definitions
+            edges: List of edge definitions
+            title: Diagram title
+            direction: Layout direction
+            resolve_icon: Maps an icon path to (icon_class, used_fallback_flag)
+            annotate_fallback: Whether to mark nodes drawn with the fallback icon
+            graph_attr: Extra graph attributes overriding the defaults
+        
+        Returns:
+            DOT source text
+        """
+        graph = {**GRAPH_ATTRS, "label": title, "rankdir": direction, **(graph_attr or {})}
+        lines = [
+            f"digraph {quote(title)} {{",
+            f"\tgraph [{format_attrs(graph)}]",
+            f"\tnode [{format_attrs(NODE_ATTRS)}]",
+            f"\tedge [{format_attrs(EDGE_ATTRS)}]",
+        ]
+        
+        cluster_labels = {c["id"]: c.get("label") or c["id"] for c in clusters}
+        clustered: Dict[str, List[str]] = {}
+        for n in nodes:
+            statement = self._node_statement(n, resolve_icon, annotate_fallback)
+            if n.get("cluster"):
+                clustered.setdefault(n["cluster"], []).append(statement)
+            else:
+                lines.append(f"\t{statement}")
+        
+        # Like mingrammer/diagrams, only clusters that contain nodes are drawn
+        for cid, statements in clustered.items():
+            attrs = {**CLUSTER_ATTRS, "label": cluster_labels.get(cid, cid)}
+            lines.append(f"\tsubgraph {quote('cluster_' + cid)} {{")
+            lines.append(f"\t\tgraph [{format_attrs(attrs)}]")
+            lines.extend(f"\t\t{statement}" for statement in statements)
+            lines.append("\t}")
+        
+        for e in edges:
+            attrs: Dict[str, Any] = dict(EDGE_LABEL_ATTRS)
+            if e.get("label"):
+                attrs["label"] = e["label"]
+            attrs["dir"] = "forward"
+            lines.append(f"\t{quote(e['source'])} -> {quote(e['target'])} [{format_attrs(attrs)}]")
+        
+        lines.append("}")
+        return "\n".join(lines) + "\n"
+    
+    def render(self, source: str, outformat: str = "png", timeout: Optional[float] = None) -> bytes:
+        """
+        Lay out and render DOT source, returning the image bytes.
+        
+        Args:
+            source: DOT source text
+            outformat: Graphviz output format
+            timeout: Seconds to wait for Graphviz
+        
+        Returns:
+            Rendered image bytes
+        
+        Raises:
+            RuntimeError: If Graphviz fails or is not installed
+        """
+        try:
+            completed = subprocess.run(
+                [self.dot_binary, f"-T{outformat}"],
+                input=source.encode("utf-8"),
+                capture_output=True,
+                timeout=timeout,
+            )
+        except FileNotFoundError:
+            raise RuntimeError(
+                f"Graphviz executable '{self.dot_binary}' not found; make sure it is on PATH"
+            ) from None
+        if completed.returncode != 0:
+            stderr = completed.stderr.decode("utf-8", errors="replace").strip()
+            raise RuntimeError(f"Graphviz failed ({completed.returncode}): {stderr}")
+        return completed.stdout
+    
+    def _node_statement(
+        self,
+        node: Dict[str, Any],
+        resolve_icon: Callable[[str], Tuple[Any, bool]],
+        annotate_fallback: bool
+    ) -> str:
+        """Build the DOT statement for one node."""
+        cls, used_fallback = resolve_icon(node["icon"])
+        label = node.get("label") or node["id"]
+        if used_fallback and annotate_fallback:
+            label = f"{label} (generic)"
+        
+        attrs: Dict[str, Any] = {"label": label}
+        image = icon_image_path(cls)
+        if image:
+            padding = 0.4 * label.count("\n")
+            attrs.update({"shape": "none", "height": str(ICON_NODE_HEIGHT + padding), "image": image})
+        return f"{quote(node['id'])} [{format_attrs(attrs)}]"
+
+
+# Global renderer instance
+dot_renderer = DotRenderer(settings.GRAPHVIZ_DOT_BINARY)
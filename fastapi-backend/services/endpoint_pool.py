@@ -0,0 +1,283 @@
+"""
+Latency- and error-aware routing of Azure OpenAI requests across several deployments.
+"""
+
+import contextlib
+import math
+import random
+import time
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+from openai import APIStatusError
+
+from services.admission import AdmissionController
+from services.metrics import LLM_ENDPOINT_EJECTIONS, LLM_ENDPOINT_REQUESTS
+from services.resilience import is_retryable
+
+HEALTHY = "healthy"
+THROTTLED = "throttled"
+EJECTED = "ejected"
+
+# Weight of a new latency in the moving average once it is below the average
+LATENCY_ALPHA = 0.3
+
+
+class Endpoint:
+    """One Azure OpenAI deployment, with its own admission control and routing statistics."""
+    
+    def __init__(
+        self,
+        name: str,
+        url: str,
+        api_key: str,
+        deployment: str,
+        text_deployment: str,
+        admission: AdmissionController,
+        weight: float = 1.0
+    ):
+        """
+        Initialize an endpoint without statistics.
+        
+        Args:
+            name: Name used in stats and metrics
+            url: Azure OpenAI resource endpoint
+            api_key: API key of the resource
+            deployment: Deployment answering diagram and session requests
+            text_deployment: Deployment answering text-only requests
+            admission: Admission control for the deployment's quotas
+            weight: Share of traffic relative to the other endpoints
+        """
+        self.name = name
+        self.url = url
+        self.api_key = api_key
+        self.deployment = deployment
+        self.text_deployment = text_deployment
+        self.admission = admission
+        self.weight = weight
+        # Created by AzureOpenAIService on first use
+        self.client: Any = None
+        
+        self.in_flight = 0
+        self.requests = 0
+        self.failures = 0
+        self.throttled = 0
+        self.consecutive_failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+        self.latencies: Dict[str, float] = {}
+        self._observed_at: Dict[str, float] = {}
+    
+    def state(self) -> str:
+        """Get whether the endpoint takes traffic: healthy, throttled (paused after a 429) or ejected."""
+        if time.monotonic() < self.ejected_until:
+            return EJECTED
+        if self.admission.paused_for() > 0:
+            return THROTTLED
+        return HEALTHY
+    
+    def latency(self, kind: str, decay_seconds: float) -> Optional[float]:
+        """
+        Get the expected latency of a kind of request.
+        
+        The estimate of an endpoint that has not answered for a while decays
+        towards zero, so an endpoint avoided after a slow spell is tried
+        again and measured afresh.
+        
+        Args:
+            kind: Kind of request, e.g. "diagram"
+            decay_seconds: Time constant of the decay; 0 for none
+        
+        Returns:
+            Seconds, or None before the first answer of that kind
+        """
+        latency = self.latencies.get(kind)
+        if latency is None or decay_seconds <= 0:
+            return latency
+        idle = time.monotonic() - self._observed_at[kind]
+        return latency * math.exp(-idle / decay_seconds)
+    
+    def observe(self, kind: str, seconds: float) -> None:
+        """
+        Fold a latency into the peak moving average of its kind.
+        
+        A latency above the average replaces it at once and lower ones pull
+        it down gradually, so the endpoint is avoided as soon as it slows down.
+        """
+        latency = self.latencies.get(kind)
+        if latency is None or seconds > latency:
+            self.latencies[kind] = seconds
+        else:
+            self.latencies[kind] = latency + (seconds - latency) * LATENCY_ALPHA
+        self._observed_at[kind] = time.monotonic()
+    
+    def stats(self, decay_seconds: float) -> Dict[str, Any]:
+        """Get the endpoint's configuration, state and statistics."""
+        return {
+            "name": self.name,
+            "endpoint": self.url,
+            "deployment": self.deployment,
+            "text_deployment": self.text_deployment,
+            "weight": self.weight,
+            "state": self.state(),
+            "in_flight": self.in_flight,
+            "queued": self.admission.queued(),
+            "concurrency_limit": self.admission.limit.current,
+            "latency_seconds": {
+                kind: round(self.latency(kind, decay_seconds), 4) for kind in sorted(self.latencies)
+            },
+            "requests": self.requests,
+            "failures": self.failures,
+            "throttled": self.throttled,
+            "ejections": self.ejections,
+            "ejected_for_seconds": round(max(0.0, self.ejected_until - time.monotonic()), 1),
+        }
+
+
+class EndpointPool:
+    """
+    Routes each request to one of several endpoints.
+    
+    Two endpoints are drawn at random in proportion to their weights and
+    the request goes to the one with the lower cost: its expected latency
+    for that kind of request times the requests it is already running or
+    queueing, divided by its weight. Failed attempts count as slow ones.
+    After `eject_failures` consecutive connection failures, timeouts or 5xx
+    answers an endpoint is ejected for `eject_seconds`, doubled each time it
+    fails again right after returning, up to `eject_max_seconds`; endpoints
+    paused by a 429 are skipped until their Retry-After. If no endpoint is
+    left, all of them are used.
+    """
+    
+    def __init__(
+        self,
+        endpoints: Sequence[Endpoint],
+        eject_failures: int = 3,
+        eject_seconds: float = 30.0,
+        eject_max_seconds: float = 300.0,
+        decay_seconds: float = 60.0,
+        rng: Optional[random.Random] = None
+    ):
+        """
+        Initialize the pool.
+        
+        Args:
+            endpoints: Endpoints to route between; at least one
+            eject_failures: Consecutive failures that eject an endpoint
+            eject_seconds: First ejection time in seconds
+            eject_max_seconds: Longest ejection time in seconds
+            decay_seconds: Time constant after which an idle endpoint's
+                latency estimate has decayed to a third; 0 for no decay
+            rng: Random source, for reproducible routing
+        """
+        if not endpoints:
+            raise ValueError("An endpoint pool needs at least one endpoint")
+        self.endpoints = list(endpoints)
+        self.eject_failures = max(1, eject_failures)
+        self.eject_seconds = eject_seconds
+        self.eject_max_seconds = eject_max_seconds
+        self.decay_seconds = decay_seconds
+        self._rng = rng or random.Random()
+    
+    def pick(self, kind: str) -> Endpoint:
+        """
+        Choose the endpoint for a request.
+        
+        Args:
+            kind: Kind of request, e.g. "diagram"; kinds have separate latencies
+        
+        Returns:
+            The endpoint to send the request to
+        """
+        if len(self.endpoints) == 1:
+            return self.endpoints[0]
+        candidates = [endpoint for endpoint in self.endpoints if endpoint.state() == HEALTHY]
+        if not candidates:
+            # Better to try an endpoint than fail every request outright
+            candidates = [endpoint for endpoint in self.endpoints if endpoint.state() != EJECTED] or self.endpoints
+        if len(candidates) == 1:
+            return candidates[0]
+        first = self._rng.choices(candidates, weights=[e.weight for e in candidates])[0]
+        rest = [endpoint for endpoint in candidates if endpoint is not first]
+        second = self._rng.choices(rest, weights=[e.weight for e in rest])[0]
+        return min((first, second), key=lambda endpoint: self.cost(endpoint, kind))
+    
+    def cost(self, endpoint: Endpoint, kind: str) -> float:
+        """
+        Get the cost of sending a request to an endpoint.
+        
+        An endpoint that has not answered a kind of request yet is expected
+        to be as fast as the fastest one that has.
+        """
+        latency = endpoint.latency(kind, self.decay_seconds)
+        if latency is None:
+            known = [
+                other.latency(kind, self.decay_seconds) for other in self.endpoints if kind in other.latencies
+            ]
+            latency = min(known) if known else 1.0
+        load = endpoint.in_flight + endpoint.admission.queued() + 1
+        return latency * load / endpoint.weight
+    
+    @contextlib.contextmanager
+    def track(self, endpoint: Endpoint, kind: str) -> Iterator[None]:
+        """
+        Run one upstream request on an endpoint, recording its latency and outcome.
+        
+        Args:
+            endpoint: Endpoint the request is sent to
+            kind: Kind of request
+        """
+        endpoint.in_flight += 1
+        endpoint.requests += 1
+        started = time.monotonic()
+        try:
+            yield
+        except Exception as e:
+            self._record_failure(endpoint, kind, time.monotonic() - started, e)
+            raise
+        except BaseException:
+            # Cancelled, e.g. the slower of two hedged attempts
+            LLM_ENDPOINT_REQUESTS.inc(endpoint=endpoint.name, outcome="cancelled")
+            raise
+        else:
+            LLM_ENDPOINT_REQUESTS.inc(endpoint=endpoint.name, outcome="ok")
+            endpoint.consecutive_failures = 0
+            endpoint.ejections = 0
+            endpoint.observe(kind, time.monotonic() - started)
+        finally:
+            endpoint.in_flight -= 1
+    
+    def stats(self) -> List[Dict[str, Any]]:
+        """Get the configuration, state and statistics of every endpoint."""
+        return [endpoint.stats(self.decay_seconds) for endpoint in self.endpoints]
+    
+    def _record_failure(self, endpoint: Endpoint, kind: str, seconds: float, error: Exception) -> None:
+        """Count a failed request and eject the endpoint if it keeps failing."""
+        if isinstance(error, APIStatusError) and error.status_code == 429:
+            # Quota, not health: admission pauses the endpoint for the Retry-After
+            LLM_ENDPOINT_REQUESTS.inc(endpoint=endpoint.name, outcome="throttled")
+            endpoint.throttled += 1
+            return
+        if not is_retryable(error):
+            # The request itself was at fault
+            LLM_ENDPOINT_REQUESTS.inc(endpoint=endpoint.name, outcome="error")
+            return
+        LLM_ENDPOINT_REQUESTS.inc(endpoint=endpoint.name, outcome="failed")
+        endpoint.failures += 1
+        endpoint.consecutive_failures += 1
+        # A failure counts as twice the usual latency, so that a fast-failing
+        # endpoint does not look like a fast one
+        usual = endpoint.latencies.get(kind)
+        if usual is None:
+            usual = max((other.latencies.get(kind, 0.0) for other in self.endpoints), default=0.0)
+        endpoint.observe(kind, max(seconds, 2 * usual))
+        # Requests sent before an ejection may still fail during it
+        if endpoint.consecutive_failures >= self.eject_failures and endpoint.state() != EJECTED:
+            self._eject(endpoint)
+    
+    def _eject(self, endpoint: Endpoint) -> None:
+        """Take an endpoint out of rotation; one more failure after it returns ejects it for longer."""
+        endpoint.ejections += 1
+        seconds = min(self.eject_max_seconds, self.eject_seconds * 2 ** (endpoint.ejections - 1))
+        endpoint.ejected_until = time.monotonic() + seconds
+        endpoint.consecutive_failures = self.eject_failures - 1
+        LLM_ENDPOINT_EJECTIONS.inc(endpoint=endpoint.name)
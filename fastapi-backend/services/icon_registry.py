@@ -0,0 +1,256 @@
+"""
+Registry of mingrammer/diagrams icon classes with alias and fuzzy resolution.
+"""
+
+import difflib
+import importlib
+import pkgutil
+import re
+import threading
+from typing import Any, Dict, FrozenSet, List, NamedTuple, Optional, Tuple
+
+from config.settings import settings
+
+# Names the model tends to invent, mapped to the icon it means. Keys are
+# normalized with IconRegistry.normalize_name, so they are written naturally.
+ICON_ALIASES: Dict[str, str] = {
+    "OpenAI": "diagrams.azure.ml.AzureOpenAI",
+    "AOAI": "diagrams.azure.ml.AzureOpenAI",
+    "AISearch": "diagrams.azure.web.Search",
+    "SearchService": "diagrams.azure.web.Search",
+    "Redis": "diagrams.azure.database.CacheForRedis",
+    "RedisCache": "diagrams.azure.database.CacheForRedis",
+    "FrontDoor": "diagrams.azure.network.FrontDoors",
+    "AppInsights": "diagrams.azure.monitor.ApplicationInsights",
+    "LogAnalytics": "diagrams.azure.monitor.LogAnalyticsWorkspaces",
+    "WebApp": "diagrams.azure.web.AppServices",
+    "AppService": "diagrams.azure.web.AppServices",
+    "Functions": "diagrams.azure.compute.FunctionApps",
+    "FunctionApp": "diagrams.azure.compute.FunctionApps",
+    "AKS": "diagrams.azure.compute.KubernetesServices",
+    "Kubernetes": "diagrams.azure.compute.KubernetesServices",
+    "SQL": "diagrams.azure.database.SQLDatabases",
+    "SQLDatabase": "diagrams.azure.database.SQLDatabases",
+    "Cosmos": "diagrams.azure.database.CosmosDb",
+    "Blob": "diagrams.azure.storage.BlobStorage",
+    "Storage": "diagrams.azure.storage.StorageAccounts",
+    "KeyVault": "diagrams.azure.security.KeyVaults",
+    "APIM": "diagrams.azure.integration.APIManagement",
+    "AppGateway": "diagrams.azure.network.ApplicationGateway",
+    "VNet": "diagrams.azure.network.VirtualNetworks",
+    "VirtualNetwork": "diagrams.azure.network.VirtualNetworks",
+    "EventHub": "diagrams.azure.analytics.EventHubs",
+    "ManagedIdentity": "diagrams.azure.identity.ManagedIdentities",
+    "DataFactory": "diagrams.azure.analytics.DataFactories",
+    "User": "diagrams.onprem.client.User",
+    "Client": "diagrams.onprem.client.User",
+}
+
+# Modules preferred when a class name exists in several of them
+PREFERRED_MODULES: Tuple[str, ...] = (
+    "web", "database", "compute", "storage", "network", "security", "identity",
+    "integration", "analytics", "ml", "monitor", "general", "client",
+)
+
+FUZZY_CUTOFF = 0.82
+
+# Bound on memoized resolutions, since paths come from model output
+MAX_MEMOIZED_RESOLUTIONS = 4096
+
+_NON_ALNUM = re.compile(r"[^a-z0-9]")
+
+
+class IconResolution(NamedTuple):
+    """An icon class together with the path it was resolved to."""
+    cls: Any
+    path: str
+    corrected: bool
+
+
+class IconRegistry:
+    """Index of icon classes under the allowed prefixes with O(1) lookup."""
+    
+    def __init__(self, allowed_prefixes: Tuple[str, ...]):
+        """
+        Initialize the registry; classes are indexed on first use.
+        
+        Args:
+            allowed_prefixes: Package prefixes to index, e.g. "diagrams.azure."
+        """
+        self.allowed_prefixes = allowed_prefixes
+        self._classes: Dict[str, Any] = {}
+        self._by_name: Dict[str, List[str]] = {}
+        self._aliases: Dict[str, str] = {}
+        self._resolved: Dict[str, Optional[IconResolution]] = {}
+        self._lock = threading.Lock()
+        self._loaded = False
+    
+    @staticmethod
+    def normalize_name(name: str) -> str:
+        """
+        Normalize a class name for tolerant matching.
+        
+        Case, punctuation, an "Azure" prefix and a trailing plural "s" are
+        ignored, so `CosmosDB`, `AzureCosmosDb` and `cosmos_db` compare equal.
+        
+        Args:
+            name: Class name or alias
+        
+        Returns:
+            Normalized name
+        """
+        key = _NON_ALNUM.sub("", name.lower())
+        if key.startswith("azure") and len(key) > len("azure"):
+            key = key[len("azure"):]
+        if key.endswith("s") and len(key) > 3:
+            key = key[:-1]
+        return key
+    
+    def load(self) -> None:
+        """Import every icon module under the allowed prefixes and index its classes."""
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            from diagrams import Node
+            
+            for prefix in self.allowed_prefixes:
+                package = importlib.import_module(prefix.rstrip("."))
+                for info in pkgutil.iter_modules(package.__path__):
+                    if info.name.startswith("_"):
+                        continue
+                    module = importlib.import_module(f"{package.__name__}.{info.name}")
+                    for name, obj in vars(module).items():
+                        if (
+                            not name.startswith("_")
+                            and isinstance(obj, type)
+                            and issubclass(obj, Node)
+                            and getattr(obj, "_icon", None)
+                        ):
+                            self._register(f"{module.__name__}.{name}", obj)
+            
+            for alias, path in ICON_ALIASES.items():
+                if path in self._classes:
+                    self._aliases[self.normalize_name(alias)] = path
+            self._loaded = True
+    
+    def paths(self) -> FrozenSet[str]:
+        """Get every indexed icon path, e.g. to use as a strict whitelist."""
+        self.load()
+        return frozenset(self._classes)
+    
+    def get(self, qualified_path: str) -> Optional[Any]:
+        """
+        Get an icon class by its exact path.
+        
+        Args:
+            qualified_path: Fully qualified class path
+        
+        Returns:
+            The icon class, or None if it does not exist
+        """
+        self.load()
+        cls = self._classes.get(qualified_path)
+        if cls is None and not qualified_path.startswith(self.allowed_prefixes):
+            # Outside the index (e.g. a custom fallback icon): import directly
+            try:
+                module_path, _, class_name = qualified_path.rpartition(".")
+                cls = getattr(importlib.import_module(module_path), class_name, None)
+            except Exception:
+                cls = None
+        return cls
+    
+    def resolve(self, qualified_path: str) -> Optional[IconResolution]:
+        """
+        Resolve an icon path, correcting near-misses.
+        
+        Lookup order is exact path, same class name with a different case or
+        plural in the same module, known alias, the same name in another
+        module, and finally a fuzzy match on the class name. Results are
+        memoized, so repeated lookups are a dictionary access.
+        
+        Args:
+            qualified_path: Fully qualified class path proposed by the model
+        
+        Returns:
+            The resolution, or None if nothing plausible matches
+        """
+        if qualified_path in self._resolved:
+            return self._resolved[qualified_path]
+        self.load()
+        
+        cls = self._classes.get(qualified_path)
+        if cls is not None:
+            resolution: Optional[IconResolution] = IconResolution(cls, qualified_path, False)
+        else:
+            path = self._correct(qualified_path)
+            resolution = IconResolution(self._classes[path], path, True) if path else None
+        
+        if len(self._resolved) >= MAX_MEMOIZED_RESOLUTIONS:
+            self._resolved.clear()
+        self._resolved[qualified_path] = resolution
+        return resolution
+    
+    def lookup_name(self, name: str) -> Optional[str]:
+        """
+        Find the icon path of a bare class name or alias, without a module.
+        
+        Args:
+            name: Class name or alias such as `SQLDatabases` or `KeyVault`
+        
+        Returns:
+            The icon path, or None if no class or alias has that name
+        """
+        self.load()
+        key = self.normalize_name(name)
+        if key in self._aliases:
+            return self._aliases[key]
+        candidates = self._by_name.get(key)
+        return self._pick(candidates, f"diagrams.azure.{name}") if candidates else None
+    
+    def _register(self, path: str, cls: Any) -> None:
+        """Add a class to the exact and name indexes."""
+        self._classes[path] = cls
+        key = self.normalize_name(path.rsplit(".", 1)[-1])
+        self._by_name.setdefault(key, []).append(path)
+    
+    def _correct(self, qualified_path: str) -> Optional[str]:
+        """Find the icon path a near-miss most likely meant."""
+        module_path, _, class_name = qualified_path.rpartition(".")
+        key = self.normalize_name(class_name)
+        
+        candidates = self._by_name.get(key, [])
+        same_module = [p for p in candidates if p.rpartition(".")[0] == module_path]
+        if same_module:
+            return same_module[0]
+        if key in self._aliases:
+            return self._aliases[key]
+        if candidates:
+            return self._pick(candidates, qualified_path)
+        
+        close = difflib.get_close_matches(key, self._by_name.keys(), n=1, cutoff=FUZZY_CUTOFF)
+        if close:
+            return self._pick(self._by_name[close[0]], qualified_path)
+        return None
+    
+    def _pick(self, candidates: List[str], qualified_path: str) -> str:
+        """Choose among same-named classes: same module, same provider, then preferred modules."""
+        module_path = qualified_path.rpartition(".")[0]
+        provider = ".".join(qualified_path.split(".")[:2])
+        
+        def rank(path: str) -> Tuple[int, int, int, str]:
+            module = path.rsplit(".", 2)[-2]
+            preferred = PREFERRED_MODULES.index(module) if module in PREFERRED_MODULES else len(PREFERRED_MODULES)
+            return (
+                0 if path.rpartition(".")[0] == module_path else 1,
+                0 if path.startswith(provider + ".") else 1,
+                preferred,
+                path,
+            )
+        
+        return min(candidates, key=rank)
+
+
+# Global registry instance
+icon_registry = IconRegistry(settings.ALLOWED_ICON_PREFIXES)
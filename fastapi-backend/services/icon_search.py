@@ -0,0 +1,287 @@
+"""
+Lexical (BM25) retrieval of the icon classes relevant to a prompt.
+"""
+
+import math
+import re
+import threading
+from collections import Counter as TokenCounter
+from typing import Dict, List, Optional, Tuple
+
+from config.settings import settings
+from services.compact_spec import icon_code
+from services.icon_registry import ICON_ALIASES, PREFERRED_MODULES, IconRegistry, icon_registry
+
+# Words users say for a service that do not appear in its class name
+ICON_KEYWORDS: Dict[str, str] = {
+    "diagrams.azure.ml.AzureOpenAI": "openai gpt llm chatgpt chat embeddings completions generative",
+    "diagrams.azure.ml.CognitiveServices": "ai cognitive vision speech language",
+    "diagrams.azure.web.Search": "ai cognitive search rag retrieval index vector",
+    "diagrams.azure.database.CosmosDb": "cosmos nosql document mongodb",
+    "diagrams.azure.database.SQLDatabases": "sql relational rdbms",
+    "diagrams.azure.database.CacheForRedis": "redis cache caching session",
+    "diagrams.azure.security.KeyVaults": "secrets keys certificates",
+    "diagrams.azure.compute.KubernetesServices": "aks kubernetes k8s containers cluster",
+    "diagrams.azure.compute.ContainerApps": "containers microservices",
+    "diagrams.azure.compute.ContainerRegistries": "acr registry images docker",
+    "diagrams.azure.compute.FunctionApps": "serverless functions",
+    "diagrams.azure.web.AppServices": "web app website frontend backend api",
+    "diagrams.azure.integration.APIManagement": "api gateway apim",
+    "diagrams.azure.integration.LogicApps": "workflow",
+    "diagrams.azure.integration.ServiceBus": "queue queues messaging topics",
+    "diagrams.azure.integration.EventGridTopics": "events eventing pubsub",
+    "diagrams.azure.analytics.EventHubs": "streaming events kafka telemetry ingestion iot",
+    "diagrams.azure.analytics.Databricks": "spark lakehouse",
+    "diagrams.azure.analytics.DataFactories": "etl ingestion pipeline",
+    "diagrams.azure.analytics.SynapseAnalytics": "warehouse analytics",
+    "diagrams.azure.storage.BlobStorage": "blob files objects documents uploads",
+    "diagrams.azure.storage.DataLakeStorage": "datalake lake adls",
+    "diagrams.azure.identity.ActiveDirectory": "entra aad login sso authentication",
+    "diagrams.azure.identity.ManagedIdentities": "identity",
+    "diagrams.azure.monitor.ApplicationInsights": "monitoring telemetry apm observability",
+    "diagrams.azure.monitor.LogAnalyticsWorkspaces": "logs logging",
+    "diagrams.azure.network.ApplicationGateway": "waf load balancer ingress",
+    "diagrams.azure.network.FrontDoors": "cdn global edge",
+    "diagrams.azure.network.VirtualNetworks": "vnet network hub spoke",
+    "diagrams.azure.network.PrivateEndpoint": "private link",
+    "diagrams.onprem.client.User": "user users client customer browser",
+    "diagrams.onprem.network.Internet": "internet public",
+}
+
+# Filled in, in this order, when a prompt matches fewer icons than asked for
+DEFAULT_ICONS: Tuple[str, ...] = (
+    "diagrams.azure.web.AppServices",
+    "diagrams.azure.database.SQLDatabases",
+    "diagrams.azure.storage.BlobStorage",
+    "diagrams.azure.security.KeyVaults",
+    "diagrams.azure.compute.FunctionApps",
+    "diagrams.azure.network.ApplicationGateway",
+    "diagrams.azure.monitor.ApplicationInsights",
+)
+
+# Words of a prompt that say nothing about which services it needs
+QUERY_STOPWORDS = frozenset(
+    "a an and are as at be by for from in into is it me my of on or our that the this to "
+    "using via we with azure architecture diagram draw design create build show solution".split()
+)
+
+# Score multiplier of icons outside diagrams.azure, so Azure wins ties
+OTHER_PROVIDER_WEIGHT = 0.6
+
+# Matches scoring below this fraction of the best match are left out
+RELATIVE_CUTOFF = 0.25
+
+# Weight of a word's score once per earlier pick that matched the word
+COVERAGE_DECAY = 0.5
+
+# Class name tokens count this many times, as they name the service best
+NAME_TOKEN_BOOST = 2
+
+_CAMEL = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|[0-9]+")
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+def _stem(token: str) -> str:
+    """Drop a trailing plural "s", as IconRegistry.normalize_name does."""
+    return token[:-1] if token.endswith("s") and len(token) > 3 else token
+
+
+def split_name(name: str) -> List[str]:
+    """Split a class name such as `SQLDatabases` into stemmed lowercase words."""
+    return [_stem(part.lower()) for part in _CAMEL.findall(name)]
+
+
+def tokenize(text: str) -> List[str]:
+    """Split free text into stemmed lowercase words."""
+    return [_stem(word) for word in _WORD.findall(text.lower())]
+
+
+class IconSearch:
+    """BM25 index over the icon classes of a registry; built on first search."""
+    
+    def __init__(self, registry: IconRegistry, k1: float = 1.2, b: float = 0.5):
+        """
+        Initialize the index.
+        
+        Args:
+            registry: Registry whose icon classes are indexed
+            k1: BM25 term frequency saturation
+            b: BM25 document length normalization
+        """
+        self.registry = registry
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, List[Tuple[int, int]]] = {}
+        self._paths: List[str] = []
+        self._lengths: List[int] = []
+        self._owner: Dict[str, str] = {}
+        self._average_length = 0.0
+        self._lock = threading.Lock()
+        self._built = False
+    
+    def search(self, query: str, k: int) -> List[str]:
+        """
+        Find the icons most relevant to a query.
+        
+        Args:
+            query: The user prompt
+            k: Number of icons to return
+        
+        Returns:
+            Up to k icon paths, best first, or common icons when the query
+            matches none
+        """
+        self.build()
+        documents = len(self._paths)
+        contributions: Dict[int, Dict[str, float]] = {}
+        for token in set(tokenize(query)) - QUERY_STOPWORDS:
+            postings = self._postings.get(token)
+            if not postings:
+                continue
+            idf = math.log(1 + (documents - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc, frequency in postings:
+                norm = self.k1 * (1 - self.b + self.b * self._lengths[doc] / self._average_length)
+                weight = 1.0 if self._paths[doc].startswith("diagrams.azure.") else OTHER_PROVIDER_WEIGHT
+                contributions.setdefault(doc, {})[token] = (
+                    weight * idf * frequency * (self.k1 + 1) / (frequency + norm)
+                )
+        if not contributions:
+            return [self._owner[path] for path in DEFAULT_ICONS if path in self._owner][:k]
+        
+        # Greedy selection where every pick discounts the words it matched, so
+        # one common word ("app") cannot crowd out the other services asked for
+        cutoff = max(sum(tokens.values()) for tokens in contributions.values()) * RELATIVE_CUTOFF
+        contributions = {doc: tokens for doc, tokens in contributions.items() if sum(tokens.values()) >= cutoff}
+        covered: Dict[str, int] = {}
+        found: List[str] = []
+        while contributions and len(found) < k:
+            gains = {
+                doc: sum(score * COVERAGE_DECAY ** covered.get(token, 0) for token, score in tokens.items())
+                for doc, tokens in contributions.items()
+            }
+            doc = min(gains, key=lambda d: (-gains[d], self._paths[d]))
+            found.append(self._paths[doc])
+            for token in contributions.pop(doc):
+                covered[token] = covered.get(token, 0) + 1
+        return found
+    
+    def build(self) -> None:
+        """Index every icon class once, folding re-exported aliases into their class; called by search() if needed."""
+        if self._built:
+            return
+        with self._lock:
+            if self._built:
+                return
+            # The same service often exists under several names and modules
+            # (AKS and KubernetesServices, database.CosmosDb and
+            # databases.AzureCosmosDb); each is indexed once, under its best
+            # path, with the other names as keywords
+            groups: Dict[str, List[str]] = {}
+            for path in self.registry.paths():
+                key = self.registry.normalize_name(self.registry.get(path).__name__)
+                groups.setdefault(key, []).append(path)
+            documents: Dict[str, List[str]] = {}
+            curated = set(ICON_KEYWORDS) | set(DEFAULT_ICONS) | set(ICON_ALIASES.values())
+            for paths in groups.values():
+                best = min(paths, key=lambda path: (path not in curated, self._rank(path)))
+                documents[best] = self._describe(best)
+                for path in paths:
+                    self._owner[path] = best
+                    if path != best:
+                        documents[best].extend(split_name(path.rsplit(".", 1)[-1]))
+            for alias, path in ICON_ALIASES.items():
+                if path in self._owner:
+                    documents[self._owner[path]].extend(split_name(alias))
+            for path, keywords in ICON_KEYWORDS.items():
+                if path in self._owner:
+                    documents[self._owner[path]].extend(tokenize(keywords))
+            
+            postings: Dict[str, List[Tuple[int, int]]] = {}
+            for doc, (path, words) in enumerate(documents.items()):
+                for token, frequency in TokenCounter(words).items():
+                    postings.setdefault(token, []).append((doc, frequency))
+                self._paths.append(path)
+                self._lengths.append(len(words))
+            self._postings = postings
+            self._average_length = sum(self._lengths) / max(1, len(self._lengths))
+            self._built = True
+    
+    def _rank(self, path: str) -> Tuple[int, int, int, int, str]:
+        """Order paths naming the same service: Azure, class names over short aliases, preferred modules."""
+        parts = path.split(".")
+        module = parts[-2]
+        preferred = PREFERRED_MODULES.index(module) if module in PREFERRED_MODULES else len(PREFERRED_MODULES)
+        return (
+            0 if parts[1] == "azure" else 1,
+            0 if self.registry.get(path).__name__ == parts[-1] else 1,
+            preferred,
+            len(parts[-1]),
+            path,
+        )
+    
+    @staticmethod
+    def _describe(path: str) -> List[str]:
+        """Words of an icon path: its class name (boosted), module and provider."""
+        parts = path.split(".")
+        return split_name(parts[-1]) * NAME_TOKEN_BOOST + [_stem(part) for part in parts[1:-1]]
+
+
+def format_icon_hint(paths: List[str]) -> str:
+    """
+    Format icon paths compactly, grouped by module.
+    
+    Args:
+        paths: Fully qualified icon class paths
+    
+    Returns:
+        Text such as `diagrams.azure.web: AppServices, Search; diagrams.azure.database: CosmosDb`
+    """
+    modules: Dict[str, List[str]] = {}
+    for path in paths:
+        module, _, name = path.rpartition(".")
+        modules.setdefault(module, []).append(name)
+    return "; ".join(f"{module}: {', '.join(names)}" for module, names in modules.items())
+
+
+def format_icon_codes(paths: List[str], registry: IconRegistry) -> str:
+    """
+    Format icon paths as the icon codes or class names of the compact spec dialect.
+    
+    Args:
+        paths: Fully qualified icon class paths
+        registry: Registry resolving class names; paths whose class name
+            resolves elsewhere are kept whole
+    
+    Returns:
+        Text such as `app, srch, cosmos, EventGridDomains`
+    """
+    codes = []
+    for path in paths:
+        code = icon_code(path)
+        if "." not in code and code[:1].isupper() and registry.lookup_name(code) != path:
+            code = path
+        codes.append(code)
+    return ", ".join(codes)
+
+
+def relevant_icons(prompt: str, k: Optional[int] = None, codes: bool = False) -> str:
+    """
+    Get the compact list of icons relevant to a prompt.
+    
+    Args:
+        prompt: The user prompt
+        k: Number of icons (defaults to ICON_RETRIEVAL_TOP_K)
+        codes: List icon codes and class names, for the compact spec dialect
+    
+    Returns:
+        Icons grouped by module (see format_icon_hint()), or icon codes (see
+        format_icon_codes())
+    """
+    paths = icon_search.search(prompt, k or settings.ICON_RETRIEVAL_TOP_K)
+    if codes:
+        return format_icon_codes(paths, icon_search.registry)
+    return format_icon_hint(paths)
+
+
+# Global index instance
+icon_search = IconSearch(icon_registry)
@@ -0,0 +1,207 @@
+"""
+Local intent routing of prompts to the diagram tool call or a lean text-only call.
+"""
+
+import json
+import math
+import re
+from collections import Counter as TokenCounter
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from config.settings import settings
+from services.metrics import INTENT_OUTCOMES, INTENT_ROUTES
+
+DIAGRAM = "diagram"
+TEXT = "text"
+
+# Weighted patterns scored against the lowercased prompt; positive weights
+# point to a diagram request, negative ones to a plain question
+KEYWORD_RULES: List[Tuple[str, float]] = [
+    (r"\b(diagrams?|draw|drawing|sketch|visuali[sz]e|visual|blueprint|schematic|topology|flowchart|picture|render)\b", 3.0),
+    (r"\barchitectures?\b", 1.5),
+    (r"\b(design|architect|build|create|generate|make|plan|propose)\b", 1.0),
+    (r"\b(show|map out|lay out|layout)\b", 0.8),
+    (r"\b(solution|landing zone|pipeline|end[- ]to[- ]end)\b", 0.7),
+    (r"^\s*(what|who|when|why|which|where)\b", -2.0),
+    (r"^\s*(how (do|does|can|should|much|many|long)|is|are|can|does|do|should|explain|define|describe|tell me)\b", -1.5),
+    (r"\b(difference|differences|vs\.?|versus|compare|comparison|pricing|price|cost|sla|limits?|quotas?|meaning|definition)\b", -1.0),
+    (r"\?\s*$", -0.7),
+]
+KEYWORD_BIAS = -0.5
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Split a prompt into lowercase word tokens."""
+    return _TOKEN.findall(text.lower())
+
+
+class RouteDecision(NamedTuple):
+    """Where a prompt is sent and how sure the router was."""
+    route: str
+    probability: float
+
+
+class NaiveBayesModel:
+    """Tiny naive Bayes classifier of diagram requests over the words of a prompt."""
+    
+    def __init__(self, log_prior: float, log_ratios: Dict[str, float], unseen_ratio: float):
+        """
+        Initialize a trained model; use train() to build one.
+        
+        Args:
+            log_prior: Log-odds of a diagram request before seeing any token
+            log_ratios: Per-token log-likelihood ratio of diagram over text
+            unseen_ratio: Log-likelihood ratio of tokens not seen in training
+        """
+        self.log_prior = log_prior
+        self.log_ratios = log_ratios
+        self.unseen_ratio = unseen_ratio
+    
+    @classmethod
+    def train(cls, examples: Iterable[Tuple[str, str]]) -> "NaiveBayesModel":
+        """
+        Train on labelled prompts with Laplace smoothing.
+        
+        Args:
+            examples: Pairs of (prompt, intent), intent being "diagram" or "text"
+        
+        Returns:
+            The trained model
+        
+        Raises:
+            ValueError: If an intent is unknown or a class has no examples
+        """
+        counts = {DIAGRAM: TokenCounter(), TEXT: TokenCounter()}
+        documents = {DIAGRAM: 0, TEXT: 0}
+        for prompt, intent in examples:
+            if intent not in counts:
+                raise ValueError(f"Unknown intent '{intent}' (expected {DIAGRAM} or {TEXT})")
+            counts[intent].update(set(tokenize(prompt)))
+            documents[intent] += 1
+        if not documents[DIAGRAM] or not documents[TEXT]:
+            raise ValueError("Training needs examples of both intents")
+        
+        vocabulary = set(counts[DIAGRAM]) | set(counts[TEXT])
+        totals = {intent: sum(counts[intent].values()) + len(vocabulary) + 1 for intent in counts}
+        log_ratios = {
+            token: math.log((counts[DIAGRAM][token] + 1) / totals[DIAGRAM])
+            - math.log((counts[TEXT][token] + 1) / totals[TEXT])
+            for token in vocabulary
+        }
+        unseen = math.log(1 / totals[DIAGRAM]) - math.log(1 / totals[TEXT])
+        log_prior = math.log(documents[DIAGRAM] / documents[TEXT])
+        return cls(log_prior, log_ratios, unseen)
+    
+    def log_odds(self, prompt: str) -> float:
+        """Log-odds that a prompt asks for a diagram."""
+        return self.log_prior + sum(
+            self.log_ratios.get(token, self.unseen_ratio) for token in set(tokenize(prompt))
+        )
+
+
+class IntentRouter:
+    """
+    Decides whether a prompt needs the diagram tool before the model is called.
+    
+    Keyword scores and, when trained, the naive Bayes model's log-odds are
+    added up and squashed into a diagram probability. Prompts below the
+    threshold go to the text-only call; uncertain prompts keep the tool, as
+    sending a diagram request to the text-only call costs a useless answer
+    while the reverse only costs tokens.
+    """
+    
+    def __init__(self, enabled: bool = True, threshold: float = 0.3, model: Optional[NaiveBayesModel] = None):
+        """
+        Initialize the router.
+        
+        Args:
+            enabled: When False every prompt is routed to the diagram tool call
+            threshold: Diagram probability below which a prompt is routed to text
+            model: Optional trained model combined with the keyword scores
+        """
+        self.enabled = enabled
+        self.threshold = threshold
+        self.model = model
+        self._rules = [(re.compile(pattern), weight) for pattern, weight in KEYWORD_RULES]
+    
+    @classmethod
+    def from_examples_file(cls, path: str, **kwargs) -> "IntentRouter":
+        """
+        Build a router whose model is trained on a JSON Lines file.
+        
+        Args:
+            path: File with one `{"prompt": ..., "intent": "diagram" | "text"}` per line
+            **kwargs: Passed on to the constructor
+        
+        Returns:
+            The router
+        """
+        examples = []
+        with Path(path).open(encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    example = json.loads(line)
+                    examples.append((example["prompt"], example["intent"]))
+        return cls(model=NaiveBayesModel.train(examples), **kwargs)
+    
+    def diagram_probability(self, prompt: str) -> float:
+        """
+        Estimate how likely a prompt asks for a diagram.
+        
+        Args:
+            prompt: The user prompt
+        
+        Returns:
+            Probability between 0 and 1
+        """
+        text = prompt.lower()
+        score = KEYWORD_BIAS + sum(weight for rule, weight in self._rules if rule.search(text))
+        if self.model is not None:
+            score += self.model.log_odds(prompt)
+        # Clamped so extreme scores cannot overflow exp()
+        return 1 / (1 + math.exp(-max(-30.0, min(30.0, score))))
+    
+    def route(self, prompt: str) -> RouteDecision:
+        """
+        Route a prompt and count the decision.
+        
+        Args:
+            prompt: The user prompt
+        
+        Returns:
+            The decision
+        """
+        if not self.enabled:
+            decision = RouteDecision(DIAGRAM, 1.0)
+        else:
+            probability = self.diagram_probability(prompt)
+            decision = RouteDecision(DIAGRAM if probability >= self.threshold else TEXT, probability)
+        INTENT_ROUTES.inc(route=decision.route)
+        return decision
+    
+    def record_outcome(self, decision: RouteDecision, produced_diagram: bool) -> None:
+        """
+        Count what the model answered for a routed prompt.
+        
+        A diagram route answered with text, or a text route whose answer
+        still carried a diagram spec, counts as a misroute.
+        
+        Args:
+            decision: The routing decision
+            produced_diagram: Whether the answer contained a diagram spec
+        """
+        INTENT_OUTCOMES.inc(route=decision.route, outcome=DIAGRAM if produced_diagram else TEXT)
+
+
+# Global router instance
+if settings.INTENT_ROUTER_MODEL:
+    intent_router = IntentRouter.from_examples_file(
+        settings.INTENT_ROUTER_MODEL,
+        enabled=settings.INTENT_ROUTER_ENABLED,
+        threshold=settings.INTENT_ROUTER_THRESHOLD,
+    )
+else:
+    intent_router = IntentRouter(settings.INTENT_ROUTER_ENABLED, settings.INTENT_ROUTER_THRESHOLD)
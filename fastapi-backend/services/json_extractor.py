@@ -0,0 +1,203 @@
+"""
+Incremental extraction of JSON objects and diagram specs from model output.
+"""
+
+import json
+import re
+from typing import Any, Dict, List, Optional
+
+FENCE = "```"
+
+# Structural tokens that matter in each scanner state; everything else is
+# skipped by the regex engine instead of a Python-level loop.
+_TOP_LEVEL = re.compile(r'[{"]|```')
+_IN_OBJECT = re.compile(r'[{}"]|```')
+_IN_STRING = re.compile(r'["\\\n]')
+
+
+def diagram_spec_from_object(obj: Any) -> Optional[Dict[str, Any]]:
+    """
+    Get the DiagramSpec carried by a parsed JSON object, if any.
+    
+    Accepts a bare spec (with `nodes` and `edges`) or a tool-call shaped object
+    whose `arguments` holds the spec, either as a dict or a JSON string.
+    
+    Args:
+        obj: A parsed JSON value
+    
+    Returns:
+        The diagram specification, or None
+    """
+    if not isinstance(obj, dict):
+        return None
+    if "nodes" in obj and "edges" in obj:
+        return obj
+    args = obj.get("arguments")
+    if isinstance(args, str):
+        try:
+            args = json.loads(args)
+        except ValueError:
+            return None
+    if isinstance(args, dict) and "nodes" in args and "edges" in args:
+        return args
+    return None
+
+
+class IncrementalJSONExtractor:
+    """Streaming scanner yielding top-level JSON objects embedded in text."""
+    
+    def __init__(self, stop_at_spec: bool = False):
+        """
+        Initialize the scanner.
+        
+        Args:
+            stop_at_spec: Ignore further input once a DiagramSpec has been found
+        """
+        self.stop_at_spec = stop_at_spec
+        self.spec: Optional[Dict[str, Any]] = None
+        self._buf = ""
+        self._pos = 0
+        self._start: Optional[int] = None
+        self._depth = 0
+        self._in_str = False
+        self._esc = False
+    
+    @property
+    def done(self) -> bool:
+        """Whether the scanner has stopped consuming input."""
+        return self.stop_at_spec and self.spec is not None
+    
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        """
+        Consume the next piece of text.
+        
+        Args:
+            chunk: Text following everything fed so far
+        
+        Returns:
+            Top-level JSON objects completed by this chunk
+        """
+        if self.done or not chunk:
+            return []
+        
+        # Rebinding to a local keeps the string uniquely referenced, which lets
+        # CPython grow it in place instead of copying the pending candidate.
+        buf = self._buf
+        self._buf = ""
+        buf += chunk
+        self._buf = buf
+        
+        found: List[Dict[str, Any]] = []
+        self._scan(found)
+        return found
+    
+    def _scan(self, found: List[Dict[str, Any]]) -> None:
+        """Advance the scanner over the buffered text."""
+        buf = self._buf
+        pos = self._pos
+        end = len(buf)
+        
+        while pos < end:
+            if self._esc:
+                # The character after a backslash inside a string is literal
+                self._esc = False
+                pos += 1
+                continue
+            
+            if self._in_str:
+                m = _IN_STRING.search(buf, pos)
+                if m is None:
+                    pos = end
+                    break
+                pos = m.end()
+                token = m.group()
+                if token == "\\":
+                    self._esc = True
+                elif token == "\n":
+                    # JSON strings cannot span lines: the opening quote was
+                    # prose (e.g. a quoted phrase after a stray brace, or an
+                    # unpaired quote between objects).
+                    self._abandon()
+                else:
+                    self._in_str = False
+                continue
+            
+            m = (_IN_OBJECT if self._depth else _TOP_LEVEL).search(buf, pos)
+            if m is None:
+                # Keep a possible partial fence marker for the next chunk
+                pos = max(pos, end - len(FENCE) + 1)
+                break
+            token = m.group()
+            pos = m.end()
+            
+            if token == FENCE:
+                if self._depth:
+                    # A fence cannot occur inside valid JSON: the candidate was
+                    # an unbalanced brace in a code block, so drop it.
+                    self._abandon()
+            elif token == '"':
+                # Quoted prose is skipped too, so a brace inside it does not
+                # start a candidate
+                self._in_str = True
+            elif token == "{":
+                if self._depth == 0:
+                    self._start = m.start()
+                self._depth += 1
+            else:
+                self._depth -= 1
+                if self._depth == 0 and self._start is not None:
+                    self._emit(buf[self._start:pos], found)
+                    self._start = None
+                    if self.done:
+                        break
+        
+        # Drop text that can no longer be part of a candidate
+        keep_from = self._start if self._start is not None else pos
+        self._buf = buf[keep_from:]
+        self._pos = pos - keep_from
+        if self._start is not None:
+            self._start = 0
+    
+    def _abandon(self) -> None:
+        """Give up on the current candidate and resume top-level scanning."""
+        self._depth = 0
+        self._start = None
+        self._in_str = False
+    
+    def _emit(self, candidate: str, found: List[Dict[str, Any]]) -> None:
+        """Parse a balanced candidate and record it if it is valid JSON."""
+        try:
+            obj = json.loads(candidate)
+        except ValueError:
+            return
+        found.append(obj)
+        if self.spec is None:
+            self.spec = diagram_spec_from_object(obj)
+
+
+def extract_json_objects(text: str) -> List[Dict[str, Any]]:
+    """
+    Extract top-level JSON objects from arbitrary text.
+    
+    Args:
+        text: Text content that may contain JSON objects
+    
+    Returns:
+        List of parsed JSON objects
+    """
+    return IncrementalJSONExtractor().feed(text or "")
+
+
+def find_diagram_spec(text: str) -> Optional[Dict[str, Any]]:
+    """
+    Find the first DiagramSpec in text, stopping as soon as it is parsed.
+    
+    Args:
+        text: Text content that may contain a diagram specification
+    
+    Returns:
+        Diagram specification dict or None if not found
+    """
+    extractor = IncrementalJSONExtractor(stop_at_spec=True)
+    extractor.feed(text or "")
+    return extractor.spec
@@ -0,0 +1,186 @@
+"""
+JSON Patch (RFC 6902) for editing stored diagram specs without the model.
+"""
+
+import copy
+import re
+from typing import Any, List, Tuple
+
+OPERATIONS = ("add", "remove", "replace", "move", "copy", "test")
+
+
+class JsonPatchError(ValueError):
+    """Raised when a patch is malformed or cannot be applied to the document."""
+
+
+class JsonPatchTestFailed(JsonPatchError):
+    """Raised when a `test` operation does not match the document."""
+
+
+def apply_json_patch(document: Any, patch: List[Any]) -> Any:
+    """
+    Apply a JSON Patch to a document.
+    
+    Operations are applied in order to a copy of the document; if any of them
+    fails the whole patch fails and nothing is changed.
+    
+    Args:
+        document: The JSON document; left unchanged
+        patch: List of operations, each with `op`, `path` and, depending on
+            the operation, `value` or `from`
+    
+    Returns:
+        The patched document
+    
+    Raises:
+        JsonPatchTestFailed: If a `test` operation does not match
+        JsonPatchError: If the patch is malformed or refers to missing locations
+    """
+    if not isinstance(patch, list):
+        raise JsonPatchError("Patch must be a list of operations")
+    result = copy.deepcopy(document)
+    for index, operation in enumerate(patch):
+        try:
+            result = _apply_operation(result, operation)
+        except JsonPatchTestFailed as e:
+            raise JsonPatchTestFailed(f"Operation {index}: {e}") from None
+        except JsonPatchError as e:
+            raise JsonPatchError(f"Operation {index}: {e}") from None
+    return result
+
+
+def parse_pointer(pointer: Any) -> List[str]:
+    """
+    Split a JSON Pointer (RFC 6901) into its unescaped reference tokens.
+    
+    Args:
+        pointer: Pointer such as `/nodes/0/label`; the empty string is the whole document
+    
+    Returns:
+        Reference tokens, e.g. ["nodes", "0", "label"]
+    
+    Raises:
+        JsonPatchError: If the pointer is not a string or does not start with "/"
+    """
+    if not isinstance(pointer, str):
+        raise JsonPatchError("JSON Pointer must be a string")
+    if pointer == "":
+        return []
+    if not pointer.startswith("/"):
+        raise JsonPatchError(f"JSON Pointer must start with '/': {pointer!r}")
+    # "~1" is unescaped before "~0" so "~01" becomes "~1" and not "/"
+    return [token.replace("~1", "/").replace("~0", "~") for token in pointer[1:].split("/")]
+
+
+def _apply_operation(document: Any, operation: Any) -> Any:
+    """Apply one operation to a document, in place where possible."""
+    if not isinstance(operation, dict):
+        raise JsonPatchError("Every operation must be an object")
+    op = operation.get("op")
+    if op not in OPERATIONS:
+        raise JsonPatchError(f"Member 'op' must be one of: {', '.join(OPERATIONS)}")
+    if "path" not in operation:
+        raise JsonPatchError(f"'{op}' needs a 'path'")
+    path = parse_pointer(operation["path"])
+    
+    if op in ("add", "replace", "test"):
+        if "value" not in operation:
+            raise JsonPatchError(f"'{op}' needs a 'value'")
+        value = copy.deepcopy(operation["value"])
+    elif op in ("move", "copy"):
+        if "from" not in operation:
+            raise JsonPatchError(f"'{op}' needs a 'from'")
+        source = parse_pointer(operation["from"])
+        if op == "move" and path[:len(source)] == source and path != source:
+            raise JsonPatchError("Cannot move a value into one of its own children")
+        value = copy.deepcopy(_get(document, source))
+        if op == "move":
+            document = _remove(document, source)
+    
+    if op == "remove":
+        return _remove(document, path)
+    if op == "replace":
+        document = _remove(document, path)
+        return _add(document, path, value)
+    if op == "test":
+        actual = _get(document, path)
+        if not _json_equal(actual, value):
+            raise JsonPatchTestFailed(f"Value at {operation['path']!r} does not match")
+        return document
+    return _add(document, path, value)
+
+
+def _resolve_parent(document: Any, path: List[str]) -> Tuple[Any, str]:
+    """Find the container a path points into and the last reference token."""
+    if not path:
+        raise JsonPatchError("Operation needs a location inside the document")
+    parent = _get(document, path[:-1])
+    if not isinstance(parent, (dict, list)):
+        raise JsonPatchError(f"Cannot reach /{'/'.join(path)}: parent is not an object or array")
+    return parent, path[-1]
+
+
+def _get(document: Any, path: List[str]) -> Any:
+    """Get the value a path refers to."""
+    current = document
+    for token in path:
+        if isinstance(current, dict):
+            if token not in current:
+                raise JsonPatchError(f"Path not found: /{'/'.join(path)}")
+            current = current[token]
+        elif isinstance(current, list):
+            current = current[_array_index(token, len(current) - 1)]
+        else:
+            raise JsonPatchError(f"Path not found: /{'/'.join(path)}")
+    return current
+
+
+def _add(document: Any, path: List[str], value: Any) -> Any:
+    """Add a value, inserting into arrays and replacing object members."""
+    if not path:
+        return value
+    parent, token = _resolve_parent(document, path)
+    if isinstance(parent, dict):
+        parent[token] = value
+    elif token == "-":
+        parent.append(value)
+    else:
+        parent.insert(_array_index(token, len(parent)), value)
+    return document
+
+
+def _remove(document: Any, path: List[str]) -> Any:
+    """Remove the value a path refers to, which must exist."""
+    if not path:
+        return None
+    parent, token = _resolve_parent(document, path)
+    if isinstance(parent, dict):
+        if token not in parent:
+            raise JsonPatchError(f"Path not found: /{'/'.join(path)}")
+        del parent[token]
+    else:
+        del parent[_array_index(token, len(parent) - 1)]
+    return document
+
+
+def _array_index(token: str, maximum: int) -> int:
+    """Parse an array index, which may not have leading zeros or exceed maximum."""
+    if not re.fullmatch(r"0|[1-9][0-9]*", token):
+        raise JsonPatchError(f"Invalid array index: {token!r}")
+    index = int(token)
+    if index > maximum:
+        raise JsonPatchError(f"Array index out of range: {index}")
+    return index
+
+
+def _json_equal(a: Any, b: Any) -> bool:
+    """Compare JSON values, keeping booleans distinct from numbers."""
+    if isinstance(a, bool) or isinstance(b, bool):
+        return type(a) is type(b) and a == b
+    if isinstance(a, dict) and isinstance(b, dict):
+        return a.keys() == b.keys() and all(_json_equal(a[k], b[k]) for k in a)
+    if isinstance(a, list) and isinstance(b, list):
+        return len(a) == len(b) and all(_json_equal(x, y) for x, y in zip(a, b))
+    if isinstance(a, (dict, list)) or isinstance(b, (dict, list)):
+        return False
+    return a == b
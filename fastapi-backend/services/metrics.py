@@ -0,0 +1,453 @@
+"""
+In-process metrics with Prometheus text exposition and per-request stage timings.
+"""
+
+import bisect
+import contextlib
+import math
+import threading
+import time
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Latency buckets in seconds, from sub-millisecond parsing to slow renders
+DEFAULT_BUCKETS: Tuple[float, ...] = (
+    0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+
+LabelValues = Tuple[str, ...]
+
+# Stage durations of the current request, in the order they were first seen
+_request_stages: ContextVar[Optional[Dict[str, float]]] = ContextVar("request_stages", default=None)
+
+# Events recorded in a worker process, to be replayed by the parent
+_captured: ContextVar[Optional[List[Tuple[Any, ...]]]] = ContextVar("captured_metrics", default=None)
+
+
+def _format_value(value: float) -> str:
+    """Format a sample value for the exposition format."""
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    """Format a label set, escaping values as the exposition format requires."""
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        escaped = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{escaped}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class _Metric:
+    """Common parts of counters, gauges and histograms."""
+    
+    kind = "untyped"
+    
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+    
+    def _label_values(self, labels: Dict[str, Any]) -> LabelValues:
+        """Order label values by the metric's label names."""
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+    
+    def _record(self, value: float, labels: Dict[str, Any]) -> None:
+        """Apply a value now, or capture it when running inside a render worker."""
+        captured = _captured.get()
+        if captured is not None:
+            captured.append(("metric", self.name, labels, value))
+        else:
+            self._apply(value, self._label_values(labels))
+    
+    def _apply(self, value: float, label_values: LabelValues) -> None:
+        raise NotImplementedError
+    
+    def samples(self) -> List[str]:
+        """Get the exposition lines for this metric's samples."""
+        raise NotImplementedError
+    
+    def expose(self) -> str:
+        """Get the metric in Prometheus text exposition format."""
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """Monotonically increasing count."""
+    
+    kind = "counter"
+    
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help_text, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+    
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        """
+        Increase the counter.
+        
+        Args:
+            amount: Non-negative increment
+            **labels: Label values
+        """
+        if amount:
+            self._record(amount, labels)
+    
+    def _apply(self, value: float, label_values: LabelValues) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + value
+    
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, lv)} {_format_value(v)}" for lv, v in items]
+
+
+class Gauge(_Metric):
+    """Point-in-time value, read from a callback when metrics are scraped."""
+    
+    kind = "gauge"
+    
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        labelnames: Sequence[str],
+        callback: Callable[[], Dict[LabelValues, float]]
+    ):
+        """
+        Initialize the gauge.
+        
+        Args:
+            name: Metric name
+            help_text: Metric description
+            labelnames: Label names
+            callback: Returns current values keyed by label values
+        """
+        super().__init__(name, help_text, labelnames)
+        self.callback = callback
+    
+    def samples(self) -> List[str]:
+        try:
+            values = self.callback()
+        except Exception:
+            return []
+        return [
+            f"{self.name}{_format_labels(self.labelnames, lv)} {_format_value(float(v))}"
+            for lv, v in sorted(values.items())
+        ]
+
+
+class Histogram(_Metric):
+    """Distribution of observed values over fixed buckets."""
+    
+    kind = "histogram"
+    
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: bucket counts (non-cumulative, last is +Inf), sum, count
+        self._values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+    
+    def observe(self, value: float, **labels: Any) -> None:
+        """
+        Record an observation.
+        
+        Args:
+            value: Observed value, e.g. seconds
+            **labels: Label values
+        """
+        self._record(value, labels)
+    
+    def _apply(self, value: float, label_values: LabelValues) -> None:
+        # Buckets are upper bounds, so a value equal to a bound belongs to it
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.setdefault(
+                label_values, ([0] * (len(self.buckets) + 1), [0.0])
+            )
+            counts[index] += 1
+            total[0] += value
+    
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((lv, (list(c), t[0])) for lv, (c, t) in self._values.items())
+        lines: List[str] = []
+        names = self.labelnames + ("le",)
+        for label_values, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                labels = _format_labels(names, label_values + (_format_value(bound),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, label_values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """Named collection of metrics rendered together on /metrics."""
+    
+    def __init__(self):
+        """Initialize an empty registry."""
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+    
+    def register(self, metric: _Metric) -> _Metric:
+        """
+        Add a metric, replacing any previous metric of the same name.
+        
+        Args:
+            metric: The metric to expose
+        
+        Returns:
+            The metric
+        """
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+    
+    def counter(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Counter:
+        """Create and register a counter."""
+        return self.register(Counter(name, help_text, labelnames))
+    
+    def histogram(
+        self,
+        name: str,
+        help_text: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        """Create and register a histogram."""
+        return self.register(Histogram(name, help_text, labelnames, buckets))
+    
+    def gauge(
+        self,
+        name: str,
+        help_text: str,
+        labelnames: Sequence[str],
+        callback: Callable[[], Dict[LabelValues, float]]
+    ) -> Gauge:
+        """Create and register a callback gauge."""
+        return self.register(Gauge(name, help_text, labelnames, callback))
+    
+    def get(self, name: str) -> Optional[_Metric]:
+        """Look up a metric by name."""
+        return self._metrics.get(name)
+    
+    def expose(self) -> str:
+        """
+        Render every metric in Prometheus text exposition format (version 0.0.4).
+        
+        Returns:
+            The exposition text
+        """
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda m: m.name)
+        return "\n".join(metric.expose() for metric in metrics) + "\n"
+    
+    @contextlib.contextmanager
+    def capture(self) -> Iterator[List[Tuple[Any, ...]]]:
+        """
+        Collect metric events instead of applying them.
+        
+        Used inside render worker processes, whose registry is never scraped:
+        the events travel back with the render result and are replayed in the
+        parent with replay().
+        
+        Yields:
+            The list the events are appended to
+        """
+        events: List[Tuple[Any, ...]] = []
+        token = _captured.set(events)
+        try:
+            yield events
+        finally:
+            _captured.reset(token)
+    
+    def replay(self, events: Sequence[Tuple[Any, ...]]) -> None:
+        """
+        Apply events captured in another process.
+        
+        Args:
+            events: Events collected by capture()
+        """
+        for event in events:
+            if event[0] == "stage":
+                record_stage(event[1], event[2])
+            else:
+                _, name, labels, value = event
+                metric = self.get(name)
+                if metric is not None:
+                    metric._record(value, labels)
+
+
+# Global registry instance
+metrics = MetricsRegistry()
+
+STAGE_SECONDS = metrics.histogram(
+    "diagram_service_stage_seconds",
+    "Time spent in each stage of handling a request",
+    ("stage",),
+)
+HTTP_REQUEST_SECONDS = metrics.histogram(
+    "diagram_service_http_request_seconds",
+    "HTTP request latency until the response is complete",
+    ("method", "route", "status"),
+)
+LLM_TOKENS = metrics.counter(
+    "diagram_service_llm_tokens_total",
+    "Tokens reported in Azure OpenAI completion usage",
+    ("kind",),
+)
+LLM_ATTEMPTS = metrics.counter(
+    "diagram_service_llm_attempts_total",
+    "Azure OpenAI request attempts by outcome: ok, failed (transient), throttled (429), error or cancelled",
+    ("outcome",),
+)
+LLM_RETRIES = metrics.counter(
+    "diagram_service_llm_retries_total",
+    "Azure OpenAI retries sent, or skipped for lack of budget or time or an open circuit",
+    ("outcome",),
+)
+LLM_HEDGES = metrics.counter(
+    "diagram_service_llm_hedges_total",
+    "Hedged Azure OpenAI requests sent, won against the first attempt, or skipped for lack of budget",
+    ("outcome",),
+)
+LLM_DEADLINES_EXCEEDED = metrics.counter(
+    "diagram_service_llm_deadlines_exceeded_total",
+    "Azure OpenAI calls that did not succeed before their deadline",
+)
+LLM_CIRCUIT_REJECTIONS = metrics.counter(
+    "diagram_service_llm_circuit_rejections_total",
+    "Azure OpenAI calls failed fast by the open circuit breaker",
+)
+LLM_ADMISSIONS = metrics.counter(
+    "diagram_service_llm_admissions_total",
+    "Azure OpenAI requests admitted at once or after queueing, or shed, rejected or timed out waiting",
+    ("priority", "outcome"),
+)
+LLM_THROTTLED = metrics.counter(
+    "diagram_service_llm_throttled_total",
+    "Azure OpenAI 429 responses, each pausing admission for its Retry-After",
+)
+LLM_ENDPOINT_REQUESTS = metrics.counter(
+    "diagram_service_llm_endpoint_requests_total",
+    "Azure OpenAI requests per endpoint by outcome: ok, failed (transient), throttled (429), error or cancelled",
+    ("endpoint", "outcome"),
+)
+LLM_ENDPOINT_EJECTIONS = metrics.counter(
+    "diagram_service_llm_endpoint_ejections_total",
+    "Times an Azure OpenAI endpoint was taken out of rotation after consecutive failures",
+    ("endpoint",),
+)
+FALLBACK_ICONS = metrics.counter(
+    "diagram_service_fallback_icons_total",
+    "Nodes drawn with the generic fallback icon",
+)
+RENDER_ERRORS = metrics.counter(
+    "diagram_service_render_errors_total",
+    "Diagram renders that did not produce an image",
+    ("reason",),
+)
+SPEC_REPAIRS = metrics.counter(
+    "diagram_service_spec_repairs_total",
+    "Problems in model-written specs fixed by auto-repair instead of failing the render",
+    ("kind",),
+)
+INTENT_ROUTES = metrics.counter(
+    "diagram_service_intent_routes_total",
+    "Prompts routed to the diagram tool call or the text-only call",
+    ("route",),
+)
+INTENT_OUTCOMES = metrics.counter(
+    "diagram_service_intent_outcomes_total",
+    "Routed prompts by what the model answered with",
+    ("route", "outcome"),
+)
+
+
+def record_stage(stage: str, seconds: float) -> None:
+    """
+    Record how long a stage took, for /metrics and the request's Server-Timing.
+    
+    Args:
+        stage: Stage name, e.g. "completion" or "render"
+        seconds: Duration in seconds
+    """
+    captured = _captured.get()
+    if captured is not None:
+        captured.append(("stage", stage, seconds))
+        return
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    stages = _request_stages.get()
+    if stages is not None:
+        stages[stage] = stages.get(stage, 0.0) + seconds
+
+
+@contextlib.contextmanager
+def timed(stage: str) -> Iterator[None]:
+    """
+    Time a block as a named stage.
+    
+    Args:
+        stage: Stage name
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - started)
+
+
+def start_request_timing() -> Tuple[Dict[str, float], Any]:
+    """
+    Begin collecting stage timings for the current request.
+    
+    Tasks spawned while handling the request inherit the collector.
+    
+    Returns:
+        Tuple of (stage durations, token to pass to end_request_timing)
+    """
+    stages: Dict[str, float] = {}
+    return stages, _request_stages.set(stages)
+
+
+def end_request_timing(token: Any) -> None:
+    """Stop collecting stage timings for the current request."""
+    _request_stages.reset(token)
+
+
+def server_timing_header(stages: Dict[str, float], total: Optional[float] = None) -> str:
+    """
+    Format stage durations as a Server-Timing header value.
+    
+    Args:
+        stages: Seconds per stage
+        total: Total request time in seconds, if known
+    
+    Returns:
+        Header value, e.g. `completion;dur=812.4, render;dur=402.0, total;dur=1230.7`
+    """
+    entries = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in stages.items()]
+    if total is not None:
+        entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries)
@@ -0,0 +1,193 @@
+"""
+Bounded process pool for running diagram renders off the event loop.
+"""
+
+import asyncio
+import importlib
+import multiprocessing
+import os
+import signal
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Optional
+
+from config.settings import settings
+from services.metrics import metrics
+
+
+class RenderQueueFullError(Exception):
+    """Raised when the render pool has no free worker or queue slot."""
+    
+    def __init__(self, retry_after: int):
+        super().__init__("Diagram renderer is busy, please retry shortly")
+        self.retry_after = retry_after
+
+
+class RenderTimeoutError(Exception):
+    """Raised when a render does not finish within its time budget."""
+
+
+def _raise_worker_timeout(signum: int, frame: Any) -> None:
+    """Signal handler that aborts a render running inside a worker process."""
+    raise TimeoutError("Render exceeded its time budget")
+
+
+def _run_with_alarm(fn: Callable[..., Any], timeout: float, *args: Any) -> Any:
+    """
+    Run a callable inside a worker process under a hard time limit.
+    
+    The parent stops waiting after RENDER_TIMEOUT_SECONDS, but a stuck Graphviz
+    process would keep occupying the worker. Where SIGALRM is available the
+    worker interrupts itself, which also kills the `dot` subprocess.
+    
+    Args:
+        fn: Picklable top-level callable to execute
+        timeout: Hard limit in seconds
+        *args: Positional arguments for the callable
+    
+    Returns:
+        The callable's result
+    """
+    if not hasattr(signal, "SIGALRM"):
+        return fn(*args)
+    
+    previous = signal.signal(signal.SIGALRM, _raise_worker_timeout)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return fn(*args)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def _warm_worker() -> None:
+    """
+    Preload rendering code and icon modules when a worker process starts.
+    
+    Failures are left to the first render, which reports them per request
+    rather than breaking the pool.
+    """
+    try:
+        importlib.import_module("services.diagram")
+        from services.icon_registry import icon_registry
+        icon_registry.load()
+    except Exception:
+        pass
+
+
+class RenderPool:
+    """Process pool with a bounded admission queue for render jobs."""
+    
+    def __init__(self):
+        """Initialize pool limits from settings; workers start on first use."""
+        self.max_workers = max(1, settings.RENDER_POOL_SIZE)
+        self.queue_depth = max(0, settings.RENDER_QUEUE_DEPTH)
+        self.timeout = settings.RENDER_TIMEOUT_SECONDS
+        self.retry_after = settings.RENDER_RETRY_AFTER_SECONDS
+        self.start_method = settings.RENDER_POOL_START_METHOD or None
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._pending = 0
+    
+    @property
+    def capacity(self) -> int:
+        """Maximum number of renders running or waiting at once."""
+        return self.max_workers + self.queue_depth
+    
+    def stats(self) -> Dict[str, int]:
+        """Get current pool occupancy."""
+        running = min(self._pending, self.max_workers)
+        return {
+            "workers": self.max_workers,
+            "running": running,
+            "queued": self._pending - running,
+            "capacity": self.capacity,
+        }
+    
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """
+        Run a picklable callable in a worker process.
+        
+        Args:
+            fn: Top-level callable to execute in the worker
+            *args: Picklable positional arguments
+        
+        Returns:
+            The callable's result
+        
+        Raises:
+            RenderQueueFullError: If every worker and queue slot is taken
+            RenderTimeoutError: If the render exceeds RENDER_TIMEOUT_SECONDS
+        """
+        if self._pending >= self.capacity:
+            raise RenderQueueFullError(self.retry_after)
+        
+        loop = asyncio.get_running_loop()
+        future = self._submit(fn, *args)
+        # The slot is released when the worker is actually done, not when the
+        # caller gives up, so admission reflects real worker occupancy.
+        self._pending += 1
+        future.add_done_callback(lambda _: self._release_threadsafe(loop))
+        
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            raise RenderTimeoutError(
+                f"Diagram render exceeded {self.timeout:g}s"
+            ) from None
+    
+    async def warm_up(self) -> None:
+        """
+        Start every worker process ahead of the first render.
+        
+        Workers preload the rendering code and icon modules as they start; a
+        no-op per worker is submitted at once so that all of them are spawned,
+        and awaited so warm-up ends once they are up.
+        """
+        futures = [self._submit(os.getpid) for _ in range(self.max_workers)]
+        await asyncio.gather(*(asyncio.wrap_future(future) for future in futures))
+    
+    def _submit(self, fn: Callable[..., Any], *args: Any) -> Future:
+        """Submit work, recreating the executor if a worker died."""
+        try:
+            return self._get_executor().submit(_run_with_alarm, fn, self.timeout + 1, *args)
+        except BrokenProcessPool:
+            self._executor = None
+            return self._get_executor().submit(_run_with_alarm, fn, self.timeout + 1, *args)
+    
+    def _get_executor(self) -> ProcessPoolExecutor:
+        """Get the process pool, creating it lazily."""
+        if self._executor is None:
+            context = multiprocessing.get_context(self.start_method)
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers, mp_context=context, initializer=_warm_worker
+            )
+        return self._executor
+    
+    def _release(self) -> None:
+        """Free an admission slot once a worker finishes (runs on the event loop)."""
+        self._pending = max(0, self._pending - 1)
+    
+    def _release_threadsafe(self, loop: asyncio.AbstractEventLoop) -> None:
+        """Schedule _release from the executor's callback thread."""
+        try:
+            loop.call_soon_threadsafe(self._release)
+        except RuntimeError:
+            # The event loop already shut down; nobody waits for the slot
+            pass
+    
+    def shutdown(self) -> None:
+        """Stop the worker processes, dropping queued renders."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+# Global pool instance
+render_pool = RenderPool()
+
+metrics.gauge(
+    "diagram_service_render_pool_tasks",
+    "Renders running in or waiting for the render pool",
+    ("state",),
+    lambda: {(state,): render_pool.stats()[state] for state in ("running", "queued", "capacity")},
+)
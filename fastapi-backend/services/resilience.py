@@ -0,0 +1,437 @@
+"""
+Deadlines, budgeted retries, hedged requests and a circuit breaker for upstream calls.
+"""
+
+import asyncio
+import math
+import random
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, TypeVar
+
+from openai import APIConnectionError, APIStatusError
+
+from services.metrics import (
+    LLM_ATTEMPTS,
+    LLM_CIRCUIT_REJECTIONS,
+    LLM_DEADLINES_EXCEEDED,
+    LLM_HEDGES,
+    LLM_RETRIES,
+)
+
+T = TypeVar("T")
+
+# Attempts get the time left until the deadline, to pass on as their timeout
+Attempt = Callable[[float], Awaitable[T]]
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream that is failing."""
+    
+    def __init__(self, retry_after: int):
+        super().__init__("Azure OpenAI is unavailable, please retry shortly")
+        self.retry_after = retry_after
+
+
+class DeadlineExceededError(Exception):
+    """Raised when a call, retries and hedges included, runs past its deadline."""
+    
+    def __init__(self, deadline: float):
+        super().__init__(f"Azure OpenAI did not answer within {deadline:g}s")
+        self.deadline = deadline
+
+
+def is_retryable(error: BaseException) -> bool:
+    """
+    Whether an upstream error is worth retrying.
+    
+    Connection failures and timeouts, rate limiting and server errors are
+    transient; other client errors would fail the same way again.
+    """
+    if isinstance(error, APIConnectionError):
+        return True
+    if isinstance(error, APIStatusError):
+        return error.status_code in (408, 409, 429) or error.status_code >= 500
+    return False
+
+
+def retry_after_seconds(error: BaseException) -> Optional[float]:
+    """
+    Get the wait an upstream error asks for, from its `retry-after-ms` or `retry-after` header.
+    
+    Returns:
+        Seconds to wait, or None if the error carries no usable header
+    """
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    for header, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        value = response.headers.get(header)
+        if value:
+            try:
+                return max(0.0, float(value) * scale)
+            except ValueError:
+                continue
+    return None
+
+
+class LatencyWindow:
+    """Latencies of the most recent successful attempts, for quantile estimates."""
+    
+    def __init__(self, size: int = 200):
+        """
+        Initialize an empty window.
+        
+        Args:
+            size: Number of recent latencies kept
+        """
+        self._recent: Deque[float] = deque(maxlen=size)
+    
+    def __len__(self) -> int:
+        return len(self._recent)
+    
+    def add(self, seconds: float) -> None:
+        """Record the latency of a successful attempt."""
+        self._recent.append(seconds)
+    
+    def quantile(self, q: float) -> Optional[float]:
+        """Get a latency quantile (nearest rank), or None without samples."""
+        if not self._recent:
+            return None
+        ordered = sorted(self._recent)
+        return ordered[min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))]
+
+
+class RetryBudget:
+    """
+    Token bucket that caps retries and hedges at a fraction of calls.
+    
+    Every call deposits `ratio` tokens and every retry or hedge withdraws
+    one, so during an outage extra requests stay a small share of traffic
+    instead of multiplying it. A steady `min_per_second` allowance keeps
+    retries possible at low traffic.
+    """
+    
+    def __init__(self, ratio: float, min_per_second: float, capacity: float = 10.0):
+        """
+        Initialize a full budget.
+        
+        Args:
+            ratio: Retries and hedges allowed per call
+            min_per_second: Retries and hedges allowed per second regardless of traffic
+            capacity: Most tokens that can be saved up
+        """
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.capacity = capacity
+        self.tokens = capacity
+        self._updated = time.monotonic()
+    
+    def deposit(self) -> None:
+        """Credit the budget for one call."""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + self.ratio)
+    
+    def withdraw(self) -> bool:
+        """Take one token for a retry or hedge; False if the budget is spent."""
+        self._refill()
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+    
+    def _refill(self) -> None:
+        """Add the time-based allowance since the last update."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.min_per_second)
+        self._updated = now
+
+
+class CircuitBreaker:
+    """
+    Fails calls fast while the upstream keeps failing.
+    
+    After `failure_threshold` consecutive failed attempts the circuit opens
+    and calls are rejected for `reset_seconds`. Then one probe call is let
+    through (half-open): its success closes the circuit, its failure opens
+    it again.
+    """
+    
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        """
+        Initialize a closed circuit.
+        
+        Args:
+            failure_threshold: Consecutive failures that open the circuit
+            reset_seconds: How long the circuit stays open before a probe
+        """
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_seconds = reset_seconds
+        self.state = CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+    
+    def acquire(self) -> bool:
+        """
+        Admit a call.
+        
+        Returns:
+            True if the call is the half-open probe, which must be passed to
+            release() once it finishes
+        
+        Raises:
+            CircuitOpenError: If the circuit is open or a probe is running
+        """
+        if self.state == OPEN:
+            if time.monotonic() - self._opened_at < self.reset_seconds:
+                self._reject()
+            self.state = HALF_OPEN
+        if self.state == HALF_OPEN:
+            if self._probing:
+                self._reject()
+            self._probing = True
+            return True
+        return False
+    
+    def release(self, probe: bool) -> None:
+        """Let the next call probe again if a probe ended without an outcome, e.g. cancelled."""
+        if probe:
+            self._probing = False
+    
+    def record_success(self) -> None:
+        """Record an attempt the upstream answered."""
+        self.failures = 0
+        self.state = CLOSED
+    
+    def record_failure(self) -> None:
+        """Record a failed attempt, opening the circuit if there were too many."""
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            self.state = OPEN
+            self._opened_at = time.monotonic()
+    
+    def retry_after(self) -> int:
+        """Whole seconds until the next probe is allowed."""
+        if self.state != OPEN:
+            return 1
+        return max(1, math.ceil(self.reset_seconds - (time.monotonic() - self._opened_at)))
+    
+    def _reject(self) -> None:
+        """Count and raise a rejected call."""
+        LLM_CIRCUIT_REJECTIONS.inc()
+        raise CircuitOpenError(self.retry_after())
+
+
+class Resilience:
+    """
+    Runs upstream calls under a deadline with retries, hedging and a circuit breaker.
+    
+    Each call has a deadline covering all of its attempts. Transient
+    failures are retried with exponential backoff and full jitter, while the
+    retry budget allows it and time is left. An attempt still running after
+    the observed `hedge_quantile` latency of its kind gets a hedged
+    duplicate; whichever answers first wins and the other is cancelled,
+    which aborts its HTTP request.
+    """
+    
+    def __init__(
+        self,
+        deadline: float,
+        max_retries: int,
+        backoff: float,
+        backoff_max: float,
+        budget: RetryBudget,
+        breaker: CircuitBreaker,
+        hedge_enabled: bool = True,
+        hedge_quantile: float = 0.95,
+        hedge_min_delay: float = 1.0,
+        hedge_min_samples: int = 20
+    ):
+        """
+        Initialize the policy.
+        
+        Args:
+            deadline: Default deadline of a call in seconds
+            max_retries: Retries after the first attempt
+            backoff: Backoff before the first retry in seconds, doubled after each
+            backoff_max: Longest backoff in seconds
+            budget: Budget shared by retries and hedges
+            breaker: Circuit breaker for the upstream
+            hedge_enabled: Whether slow attempts are hedged
+            hedge_quantile: Latency quantile after which an attempt is hedged
+            hedge_min_delay: Shortest wait before hedging, in seconds
+            hedge_min_samples: Latencies of a kind observed before it is hedged
+        """
+        self.deadline = deadline
+        self.max_retries = max(0, max_retries)
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.budget = budget
+        self.breaker = breaker
+        self.hedge_enabled = hedge_enabled
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_min_samples = hedge_min_samples
+        self.latencies: Dict[str, LatencyWindow] = {}
+        self._rng = random.Random()
+    
+    def hedge_delay(self, kind: str) -> Optional[float]:
+        """
+        Get how long an attempt of a kind runs before it is hedged.
+        
+        Args:
+            kind: Kind of call, e.g. "diagram"; kinds have separate latencies
+        
+        Returns:
+            Delay in seconds, or None if hedging is off or too few latencies
+            have been observed
+        """
+        window = self.latencies.get(kind)
+        if not self.hedge_enabled or window is None or len(window) < self.hedge_min_samples:
+            return None
+        return max(self.hedge_min_delay, window.quantile(self.hedge_quantile))
+    
+    async def call(
+        self,
+        attempt: Attempt,
+        kind: str = "default",
+        deadline: Optional[float] = None,
+        hedge: bool = True
+    ) -> Any:
+        """
+        Run a call with the full policy.
+        
+        Args:
+            attempt: Coroutine function making one attempt; it gets the
+                seconds left until the deadline
+            kind: Kind of call, for hedging delays
+            deadline: Deadline in seconds (defaults to the policy's)
+            hedge: Whether the call may be hedged (not for streams)
+        
+        Returns:
+            The result of the first successful attempt
+        
+        Raises:
+            CircuitOpenError: If the upstream is failing
+            DeadlineExceededError: If no attempt succeeded in time
+            Exception: The last attempt's error if it was not retryable or
+                retries ran out
+        """
+        deadline = self.deadline if deadline is None else deadline
+        deadline_at = time.monotonic() + deadline
+        probe = self.breaker.acquire()
+        self.budget.deposit()
+        try:
+            retries = 0
+            while True:
+                try:
+                    return await self._attempt(attempt, kind, deadline, deadline_at, hedge and not probe)
+                except DeadlineExceededError:
+                    self.breaker.record_failure()
+                    LLM_DEADLINES_EXCEEDED.inc()
+                    raise
+                except Exception as e:
+                    if not is_retryable(e):
+                        raise
+                    delay = self._retry_delay(e, retries, deadline_at)
+                    if delay is None:
+                        raise
+                retries += 1
+                LLM_RETRIES.inc(outcome="sent")
+                await asyncio.sleep(delay)
+        finally:
+            self.breaker.release(probe)
+    
+    def _retry_delay(self, error: Exception, retries: int, deadline_at: float) -> Optional[float]:
+        """Get the backoff before retrying a failed attempt, or None if it must not be retried."""
+        if retries >= self.max_retries:
+            return None
+        if self.breaker.state == OPEN:
+            LLM_RETRIES.inc(outcome="circuit_open")
+            return None
+        # Full jitter spreads out the retries of calls that failed together
+        delay = self._rng.uniform(0, min(self.backoff_max, self.backoff * 2 ** retries))
+        retry_after = retry_after_seconds(error)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        if time.monotonic() + delay >= deadline_at:
+            LLM_RETRIES.inc(outcome="no_time")
+            return None
+        if not self.budget.withdraw():
+            LLM_RETRIES.inc(outcome="budget_exhausted")
+            return None
+        return delay
+    
+    async def _attempt(
+        self,
+        attempt: Attempt,
+        kind: str,
+        deadline: float,
+        deadline_at: float,
+        hedge: bool
+    ) -> Any:
+        """Make one attempt, hedged if it is slow, and wait for the first success."""
+        primary = asyncio.ensure_future(self._timed(attempt, kind, deadline_at))
+        pending = {primary}
+        hedged: Optional[asyncio.Future] = None
+        error: Optional[BaseException] = None
+        try:
+            delay = self.hedge_delay(kind) if hedge else None
+            if delay is not None and time.monotonic() + delay < deadline_at:
+                done, _ = await asyncio.wait(pending, timeout=delay)
+                if not done:
+                    if self.budget.withdraw():
+                        LLM_HEDGES.inc(outcome="sent")
+                        hedged = asyncio.ensure_future(self._timed(attempt, kind, deadline_at))
+                        pending.add(hedged)
+                    else:
+                        LLM_HEDGES.inc(outcome="budget_exhausted")
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, timeout=max(0.0, deadline_at - time.monotonic()),
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    raise DeadlineExceededError(deadline)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedged:
+                            LLM_HEDGES.inc(outcome="won")
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # The slower attempt is cancelled, aborting its HTTP request
+            for task in pending:
+                task.cancel()
+    
+    async def _timed(self, attempt: Attempt, kind: str, deadline_at: float) -> Any:
+        """Run one attempt, recording its outcome and, on success, its latency."""
+        started = time.monotonic()
+        try:
+            result = await attempt(max(0.0, deadline_at - started))
+        except asyncio.CancelledError:
+            LLM_ATTEMPTS.inc(outcome="cancelled")
+            raise
+        except Exception as e:
+            if isinstance(e, APIStatusError) and e.status_code == 429:
+                # Quota, not health: retried after its Retry-After without tripping the breaker
+                LLM_ATTEMPTS.inc(outcome="throttled")
+            elif is_retryable(e):
+                LLM_ATTEMPTS.inc(outcome="failed")
+                self.breaker.record_failure()
+            else:
+                LLM_ATTEMPTS.inc(outcome="error")
+                if isinstance(e, APIStatusError):
+                    # The upstream answered; the request itself was at fault
+                    self.breaker.record_success()
+            raise
+        LLM_ATTEMPTS.inc(outcome="ok")
+        self.breaker.record_success()
+        self.latencies.setdefault(kind, LatencyWindow()).add(time.monotonic() - started)
+        return result
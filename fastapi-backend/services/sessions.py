@@ -0,0 +1,208 @@
+"""
+Chat sessions with server-side history and a current diagram.
+"""
+
+import asyncio
+import json
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from config.settings import settings
+from services.metrics import metrics
+
+# Rough size of a message's role and framing in tokens
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# When history outgrows its budget it is cut down to this fraction of it, so
+# the prompt prefix then stays unchanged for several turns instead of
+# shifting by one turn on every request
+TRIM_TO_FRACTION = 0.6
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimate the number of tokens in a text.
+    
+    Uses the common approximation of four characters per token, which is
+    close enough for budgeting without a tokenizer dependency.
+    
+    Args:
+        text: The text
+    
+    Returns:
+        Estimated token count
+    """
+    return (len(text) + 3) // 4
+
+
+def message_tokens(message: Dict[str, str]) -> int:
+    """Estimate the tokens a chat message takes in the prompt."""
+    return estimate_tokens(message.get("content") or "") + MESSAGE_OVERHEAD_TOKENS
+
+
+class ChatSession:
+    """One conversation: its recent turns and the diagram it is working on."""
+    
+    def __init__(self, max_history_tokens: int):
+        """
+        Initialize an empty session.
+        
+        Args:
+            max_history_tokens: Token budget for the history sent with each turn
+        """
+        self.id = uuid.uuid4().hex
+        self.max_history_tokens = max_history_tokens
+        self.messages: List[Dict[str, str]] = []
+        self.spec: Optional[Dict[str, Any]] = None
+        self.turns = 0
+        self.trimmed_turns = 0
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        # Turns of one session run one at a time, in order
+        self.lock = asyncio.Lock()
+    
+    def add_turn(self, user_message: str, assistant_message: str) -> None:
+        """
+        Append a turn to the history and trim it to the token budget.
+        
+        Args:
+            user_message: What the user said
+            assistant_message: The answer, or a short note of the diagram change
+        """
+        self.messages.append({"role": "user", "content": user_message})
+        self.messages.append({"role": "assistant", "content": assistant_message})
+        self.turns += 1
+        self.updated_at = time.time()
+        if self.history_tokens() > self.max_history_tokens:
+            self._trim(int(self.max_history_tokens * TRIM_TO_FRACTION))
+    
+    def history_tokens(self) -> int:
+        """Estimate the tokens the history takes in the prompt."""
+        return sum(message_tokens(message) for message in self.messages)
+    
+    def spec_json(self) -> Optional[str]:
+        """Serialize the current diagram compactly for the prompt."""
+        if self.spec is None:
+            return None
+        return json.dumps(self.spec, ensure_ascii=False, separators=(",", ":"))
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Describe the session for API responses.
+        
+        Returns:
+            Identity, history size, and the current diagram
+        """
+        return {
+            "session_id": self.id,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+            "turns": self.turns,
+            "history_messages": len(self.messages),
+            "history_tokens": self.history_tokens(),
+            "trimmed_turns": self.trimmed_turns,
+            "spec": self.spec,
+        }
+    
+    def _trim(self, target_tokens: int) -> None:
+        """Drop the oldest turns until the history fits the target."""
+        tokens = self.history_tokens()
+        while self.messages and tokens > target_tokens:
+            # Drop a whole user/assistant pair so the history keeps alternating
+            for message in self.messages[:2]:
+                tokens -= message_tokens(message)
+            del self.messages[:2]
+            self.trimmed_turns += 1
+
+
+class SessionStore:
+    """In-memory sessions, expired when idle and bounded in number."""
+    
+    def __init__(self, max_sessions: int, ttl_seconds: float, max_history_tokens: int):
+        """
+        Initialize the store.
+        
+        Args:
+            max_sessions: Most sessions kept; the least recently used go first
+            ttl_seconds: Forget sessions idle for this long
+            max_history_tokens: Token budget for each session's history
+        """
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.max_history_tokens = max_history_tokens
+        self._sessions: "OrderedDict[str, ChatSession]" = OrderedDict()
+        self.evictions = 0
+    
+    def create(self) -> ChatSession:
+        """
+        Start a new session.
+        
+        Returns:
+            The session
+        """
+        self._expire()
+        session = ChatSession(self.max_history_tokens)
+        self._sessions[session.id] = session
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+            self.evictions += 1
+        return session
+    
+    def get(self, session_id: str) -> Optional[ChatSession]:
+        """
+        Look up a session and mark it as recently used.
+        
+        Args:
+            session_id: Id returned by create
+        
+        Returns:
+            The session, or None if it is unknown or has expired
+        """
+        self._expire()
+        session = self._sessions.get(session_id)
+        if session is not None:
+            session.updated_at = time.time()
+            self._sessions.move_to_end(session_id)
+        return session
+    
+    def delete(self, session_id: str) -> bool:
+        """
+        End a session.
+        
+        Args:
+            session_id: Id returned by create
+        
+        Returns:
+            True if the session existed
+        """
+        return self._sessions.pop(session_id, None) is not None
+    
+    def stats(self) -> Dict[str, int]:
+        """Get the number of live sessions and evictions."""
+        self._expire()
+        return {"sessions": len(self._sessions), "evictions": self.evictions}
+    
+    def _expire(self) -> None:
+        """Forget sessions that have been idle longer than the TTL."""
+        cutoff = time.time() - self.ttl_seconds
+        for session_id in list(self._sessions):
+            if self._sessions[session_id].updated_at > cutoff:
+                break
+            del self._sessions[session_id]
+
+
+# Global session store instance
+session_store = SessionStore(
+    settings.SESSION_MAX_COUNT,
+    settings.SESSION_TTL_SECONDS,
+    settings.SESSION_HISTORY_MAX_TOKENS,
+)
+
+metrics.gauge(
+    "diagram_service_chat_sessions",
+    "Live chat sessions",
+    (),
+    lambda: {(): session_store.stats()["sessions"]},
+)
@@ -0,0 +1,65 @@
+"""
+Single-flight helper for collapsing concurrent identical work.
+"""
+
+import asyncio
+from typing import Awaitable, Callable, Dict, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """Run at most one computation per key; concurrent callers share its result."""
+    
+    def __init__(self):
+        """Initialize the in-flight table."""
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self._waiters: Dict[Hashable, int] = {}
+        self.coalesced = 0
+    
+    def in_flight(self, key: Hashable) -> bool:
+        """Check whether a computation for the key is currently running."""
+        return key in self._inflight
+    
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        """
+        Run fn for the key, or join the computation already running for it.
+        
+        The shared task is shielded, so one caller being cancelled (for example
+        because its client disconnected) does not abort the work for the others.
+        The work itself is cancelled once every caller waiting on it has gone.
+        
+        Args:
+            key: Identity of the computation
+            fn: Factory for the coroutine to run when no computation is in flight
+        
+        Returns:
+            The computation's result (exceptions propagate to every caller)
+        """
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+        else:
+            self.coalesced += 1
+        
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if self._waiters.get(key) == 1 and not task.done():
+                task.cancel()
+            raise
+        finally:
+            remaining = self._waiters.get(key, 1) - 1
+            if remaining:
+                self._waiters[key] = remaining
+            else:
+                self._waiters.pop(key, None)
+    
+    def _forget(self, key: Hashable, task: asyncio.Task) -> None:
+        """Drop a finished computation, marking its exception as retrieved."""
+        self._inflight.pop(key, None)
+        if not task.cancelled():
+            task.exception()
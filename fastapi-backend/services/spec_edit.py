@@ -0,0 +1,148 @@
+"""
+Incremental edits to a DiagramSpec, as produced by the edit_azure_architecture tool.
+"""
+
+import copy
+from typing import Any, Dict, List
+
+from services.diagram import DIRECTIONS
+
+NODE_FIELDS = ("label", "icon", "cluster")
+
+_PAST_TENSE = {"add": "added", "update": "updated", "remove": "removed"}
+
+
+def apply_spec_edit(spec: Dict[str, Any], edit: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Apply an edit to a diagram specification.
+    
+    Removals are applied before additions, so an edit can replace a node or
+    edge by removing and re-adding it. Removing a node also removes its
+    edges; removing a cluster keeps its nodes outside any cluster.
+    
+    Args:
+        spec: The current specification; left unchanged
+        edit: Edit with optional `title`, `direction`, `add_clusters`,
+            `remove_clusters`, `add_nodes`, `update_nodes`, `remove_nodes`,
+            `add_edges` and `remove_edges`
+    
+    Returns:
+        The edited specification
+    
+    Raises:
+        ValueError: If the edit is malformed or refers to unknown nodes
+    """
+    if not isinstance(edit, dict):
+        raise ValueError("Edit must be an object")
+    result = copy.deepcopy(spec)
+    clusters: List[Dict[str, Any]] = result.setdefault("clusters", [])
+    nodes: List[Dict[str, Any]] = result.setdefault("nodes", [])
+    edges: List[Dict[str, Any]] = result.setdefault("edges", [])
+    
+    # Removals
+    removed_edges = {(e["source"], e["target"]) for e in _items(edit, "remove_edges", ("source", "target"))}
+    removed_nodes = set(_ids(edit, "remove_nodes"))
+    removed_clusters = set(_ids(edit, "remove_clusters"))
+    edges[:] = [
+        e for e in edges
+        if (e.get("source"), e.get("target")) not in removed_edges
+        and e.get("source") not in removed_nodes
+        and e.get("target") not in removed_nodes
+    ]
+    nodes[:] = [n for n in nodes if n.get("id") not in removed_nodes]
+    clusters[:] = [c for c in clusters if c.get("id") not in removed_clusters]
+    for node in nodes:
+        if node.get("cluster") in removed_clusters:
+            del node["cluster"]
+    
+    # Additions; an added node or cluster with an existing id replaces it
+    for cluster in _items(edit, "add_clusters", ("id",)):
+        clusters[:] = [c for c in clusters if c.get("id") != cluster["id"]]
+        clusters.append(cluster)
+    for node in _items(edit, "add_nodes", ("id", "icon")):
+        nodes[:] = [n for n in nodes if n.get("id") != node["id"]]
+        nodes.append(node)
+    
+    by_id = {n.get("id"): n for n in nodes}
+    for update in _items(edit, "update_nodes", ("id",)):
+        node = by_id.get(update["id"])
+        if node is None:
+            raise ValueError(f"Cannot update unknown node: {update['id']}")
+        for field in NODE_FIELDS:
+            if field in update:
+                if update[field] in (None, ""):
+                    node.pop(field, None)
+                else:
+                    node[field] = update[field]
+    
+    existing_edges = {(e.get("source"), e.get("target"), e.get("label")) for e in edges}
+    for edge in _items(edit, "add_edges", ("source", "target")):
+        for end in ("source", "target"):
+            if edge[end] not in by_id:
+                raise ValueError(f"Edge refers to unknown node: {edge[end]}")
+        key = (edge["source"], edge["target"], edge.get("label"))
+        if key not in existing_edges:
+            existing_edges.add(key)
+            edges.append(edge)
+    
+    if edit.get("title"):
+        result["title"] = str(edit["title"])
+    if edit.get("direction"):
+        direction = str(edit["direction"]).strip().upper()
+        if direction not in DIRECTIONS:
+            raise ValueError(f"Invalid direction: {edit['direction']}")
+        result["direction"] = direction
+    return result
+
+
+def describe_spec_edit(edit: Dict[str, Any]) -> str:
+    """
+    Summarize an edit in a few words, e.g. for the conversation history.
+    
+    Args:
+        edit: The edit
+    
+    Returns:
+        Summary such as "added nodes redis; added 2 edges"
+    """
+    parts: List[str] = []
+    for noun in ("nodes", "clusters"):
+        for verb, past in _PAST_TENSE.items():
+            ids = [
+                str(item.get("id")) if isinstance(item, dict) else str(item)
+                for item in edit.get(f"{verb}_{noun}") or []
+            ]
+            if ids:
+                parts.append(f"{past} {noun} {', '.join(ids)}")
+    for verb in ("add", "remove"):
+        count = len(edit.get(f"{verb}_edges") or [])
+        if count:
+            parts.append(f"{_PAST_TENSE[verb]} {count} edge{'s' if count != 1 else ''}")
+    for field in ("title", "direction"):
+        if edit.get(field):
+            parts.append(f"set {field} to {edit[field]}")
+    return "; ".join(parts) or "no changes"
+
+
+def _items(edit: Dict[str, Any], key: str, required: tuple) -> List[Dict[str, Any]]:
+    """Get a list of objects from an edit, checking their required string fields."""
+    items = edit.get(key) or []
+    if not isinstance(items, list):
+        raise ValueError(f"'{key}' must be a list")
+    checked = []
+    for item in items:
+        # Ids end up in sets and dict keys, so they must be strings
+        if not isinstance(item, dict) or any(
+            not item.get(field) or not isinstance(item[field], str) for field in required
+        ):
+            raise ValueError(f"Every entry of '{key}' needs {', '.join(required)}")
+        checked.append(dict(item))
+    return checked
+
+
+def _ids(edit: Dict[str, Any], key: str) -> List[str]:
+    """Get a list of ids from an edit."""
+    ids = edit.get(key) or []
+    if not isinstance(ids, list) or not all(isinstance(i, str) for i in ids):
+        raise ValueError(f"'{key}' must be a list of ids")
+    return ids
@@ -0,0 +1,152 @@
+"""
+Auto-repair of the mistakes models make when writing a DiagramSpec.
+"""
+
+import copy
+from typing import Any, Dict, Iterator, List, Set, Tuple
+
+from services.metrics import SPEC_REPAIRS
+
+# String fields of each kind of item
+_STRING_FIELDS = {
+    "cluster": ("id", "label"),
+    "node": ("id", "label", "icon", "cluster"),
+    "edge": ("source", "target", "label"),
+}
+
+
+def repair_spec(
+    spec: Dict[str, Any],
+    max_nodes: int,
+    max_edges: int,
+    fallback_icon: str
+) -> Tuple[Dict[str, Any], List[str]]:
+    """
+    Repair a diagram specification so it passes validation.
+    
+    Numeric ids and labels become strings, lists, items and fields of any
+    other type are dropped, items without an id are dropped, a repeated
+    node is dropped and a different node reusing an id renamed,
+    nodes without an icon get the fallback icon, clusters that nodes refer
+    to are declared, node and edge counts are clamped to the limits (in the
+    order the model wrote them), and edges to unknown nodes are dropped.
+    
+    Args:
+        spec: Specification as cleaned by DiagramService; left unchanged
+        max_nodes: Node limit
+        max_edges: Edge limit
+        fallback_icon: Icon class path for nodes without an icon
+    
+    Returns:
+        Tuple of (repaired specification, descriptions of the repairs made)
+    """
+    result = copy.deepcopy(spec)
+    repairs: List[str] = []
+    
+    def repaired(kind: str, message: str) -> None:
+        SPEC_REPAIRS.inc(kind=kind)
+        repairs.append(message)
+    
+    def objects(key: str, singular: str) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        """Enumerate the object items of a spec list, dropping anything else."""
+        items = result.get(key)
+        if items is None:
+            return
+        if not isinstance(items, list):
+            repaired("malformed", f"Dropped {key}, which is not a list")
+            return
+        for index, item in enumerate(items):
+            if not isinstance(item, dict):
+                repaired("malformed", f"Dropped {singular} {index}, which is not an object")
+                continue
+            for field in _coerce_strings(item, _STRING_FIELDS[singular]):
+                repaired("malformed", f"Dropped the {field} of {singular} {index}, which is not a string")
+            yield index, item
+    
+    # Clusters: one per id
+    clusters: List[Dict[str, Any]] = []
+    cluster_ids: Set[str] = set()
+    for index, cluster in objects("clusters", "cluster"):
+        cid = cluster.get("id")
+        if not cid:
+            repaired("missing_id", f"Dropped cluster {index} without an id")
+        elif cid in cluster_ids:
+            repaired("duplicate_id", f"Dropped duplicate cluster '{cid}'")
+        else:
+            cluster_ids.add(cid)
+            clusters.append(cluster)
+    
+    # Nodes: unique ids, an icon each, within the limit
+    nodes: List[Dict[str, Any]] = []
+    by_id: Dict[str, Dict[str, Any]] = {}
+    for index, node in objects("nodes", "node"):
+        nid = node.get("id")
+        if not nid:
+            repaired("missing_id", f"Dropped node {index} without an id")
+            continue
+        if not node.get("icon"):
+            node["icon"] = fallback_icon
+            repaired("missing_icon", f"Gave node '{nid}' the fallback icon")
+        if nid in by_id:
+            if node == by_id[nid]:
+                repaired("duplicate_id", f"Dropped repeated node '{nid}'")
+                continue
+            node["id"] = _unique_id(nid, by_id)
+            repaired("duplicate_id", f"Renamed duplicate node id '{nid}' to '{node['id']}'")
+        if len(nodes) == max_nodes:
+            repaired("too_many_nodes", f"Dropped node '{node['id']}' over the limit of {max_nodes} nodes")
+            continue
+        by_id[node["id"]] = node
+        nodes.append(node)
+    
+    for node in nodes:
+        cid = node.get("cluster")
+        if cid and cid not in cluster_ids:
+            cluster_ids.add(cid)
+            clusters.append({"id": cid})
+            repaired("missing_cluster", f"Added missing cluster '{cid}'")
+    
+    # Edges: between known nodes, within the limit
+    edges: List[Dict[str, Any]] = []
+    for index, edge in objects("edges", "edge"):
+        source, target = edge.get("source"), edge.get("target")
+        unknown = [ref for ref in (source, target) if ref not in by_id]
+        if not source or not target:
+            repaired("dangling_edge", f"Dropped edge {index} without a {'target' if source else 'source'}")
+        elif unknown:
+            repaired("dangling_edge", f"Dropped edge {index} to unknown node '{unknown[0]}'")
+        elif len(edges) == max_edges:
+            repaired("too_many_edges", f"Dropped edge '{source}' -> '{target}' over the limit of {max_edges} edges")
+        else:
+            edges.append(edge)
+    
+    result.update(clusters=clusters, nodes=nodes, edges=edges)
+    return result, repairs
+
+
+def _coerce_strings(item: Dict[str, Any], keys: Tuple[str, ...]) -> List[str]:
+    """
+    Turn numeric fields into strings and drop fields of any other non-string type.
+    
+    Returns:
+        The keys of the dropped fields
+    """
+    dropped: List[str] = []
+    for key in keys:
+        value = item.get(key)
+        if value is None or isinstance(value, str):
+            continue
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            item[key] = str(value)
+        else:
+            del item[key]
+            dropped.append(key)
+    return dropped
+
+
+def _unique_id(nid: str, taken: Dict[str, Any]) -> str:
+    """Get the first free id of the form "<id>_<n>"."""
+    suffix = 2
+    while f"{nid}_{suffix}" in taken:
+        suffix += 1
+    return f"{nid}_{suffix}"
@@ -0,0 +1,122 @@
+"""
+Start-up warm-up of lazily initialized services, and application readiness.
+"""
+
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from services.metrics import metrics
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+WarmUpStep = Tuple[str, Callable[[], Awaitable[Any]]]
+
+
+class WarmUp:
+    """
+    Runs the start-up warm-up steps and tracks readiness.
+    
+    Services build their expensive parts (icon modules, render workers, the
+    HTTP connection pool) on first use, so importing the application stays
+    fast. Warm-up builds them in the background right after start-up, before
+    traffic is routed to the process. The application is ready once every
+    step has finished: a failed step is reported, but only means its work is
+    done by the first request that needs it.
+    
+    Import time of the application and the latency of the first request to
+    each route are kept as well, to show what a cold start costs.
+    """
+    
+    def __init__(self):
+        """Initialize an application that is not ready yet."""
+        self.ready = False
+        self.import_seconds: Optional[float] = None
+        self.seconds: Optional[float] = None
+        self.steps: Dict[str, Dict[str, Any]] = {}
+        self.first_requests: Dict[str, float] = {}
+    
+    async def run(self, steps: List[WarmUpStep]) -> None:
+        """
+        Run warm-up steps concurrently, then mark the application ready.
+        
+        Args:
+            steps: Pairs of (name, coroutine function) to run
+        """
+        started = time.perf_counter()
+        self.steps = {name: {"status": PENDING} for name, _ in steps}
+        await asyncio.gather(*(self._run_step(name, step) for name, step in steps))
+        self.seconds = time.perf_counter() - started
+        self.ready = True
+    
+    def skip(self) -> None:
+        """Mark the application ready without warming up (WARMUP_ENABLED=false)."""
+        self.seconds = 0.0
+        self.ready = True
+    
+    def record_request(self, route: str, seconds: float) -> None:
+        """
+        Keep the latency of the first request to a route.
+        
+        Args:
+            route: Route path template, e.g. "/chat"
+            seconds: Request latency in seconds
+        """
+        self.first_requests.setdefault(route, seconds)
+    
+    def status(self) -> Dict[str, Any]:
+        """Get readiness, warm-up progress and start-up timings."""
+        return {
+            "ready": self.ready,
+            "import_seconds": self.import_seconds,
+            "warmup_seconds": self.seconds,
+            "steps": {name: dict(step) for name, step in self.steps.items()},
+            "first_request_seconds": dict(self.first_requests),
+        }
+    
+    async def _run_step(self, name: str, step: Callable[[], Awaitable[Any]]) -> None:
+        """Run one step, recording its outcome and duration."""
+        self.steps[name] = {"status": RUNNING}
+        started = time.perf_counter()
+        try:
+            await step()
+        except Exception as e:
+            self.steps[name] = {"status": FAILED, "seconds": time.perf_counter() - started, "error": repr(e)}
+        else:
+            self.steps[name] = {"status": DONE, "seconds": time.perf_counter() - started}
+
+
+# Global warm-up instance
+warm_up = WarmUp()
+
+metrics.gauge(
+    "diagram_service_ready",
+    "1 once start-up warm-up has finished",
+    (),
+    lambda: {(): float(warm_up.ready)},
+)
+metrics.gauge(
+    "diagram_service_startup_seconds",
+    "Time spent importing the application and warming it up",
+    ("phase",),
+    lambda: {
+        (phase,): seconds
+        for phase, seconds in (("import", warm_up.import_seconds), ("warmup", warm_up.seconds))
+        if seconds is not None
+    },
+)
+metrics.gauge(
+    "diagram_service_warmup_step_seconds",
+    "Duration of each finished warm-up step",
+    ("step",),
+    lambda: {(name,): step["seconds"] for name, step in warm_up.steps.items() if "seconds" in step},
+)
+metrics.gauge(
+    "diagram_service_first_request_seconds",
+    "Latency of the first request to each route since start-up",
+    ("route",),
+    lambda: {(route,): seconds for route, seconds in warm_up.first_requests.items()},
+)